@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+SQLite store for ROM build analysis, keyed by image SHA-1.
+
+Each ingested image keeps its decoded instructions, symbols with label
+and code extents, xrefs and DMA/block-move findings (dmaextract.py), so
+questions about old builds are queries instead of re-runs of the compare
+scripts. Symbols carry a hash of their bytes and of their opcode
+sequence; diffing two builds is a join on symbol name and the result is
+cached in the diffs table.
+
+Builds are ordered by the image file's mtime at ingestion. Ingesting an
+image whose hash is already present only updates its path.
+
+Usage:
+    analysisdb.py ingest menu.bin [...] [--labels snes-64tass/menu.labels] [--map menu] [--db analysis.db]
+    analysisdb.py list
+    analysisdb.py history store_blockram_routine_src
+    analysisdb.py diff OLD NEW [--all]          (hash prefixes or paths)
+    analysisdb.py xrefs IMAGE 2181
+    analysisdb.py sql "SELECT ..."
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+import disasm65
+import dmaextract
+import snesmap
+
+DEFAULT_DB = "analysis.db"
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    sha1 TEXT UNIQUE NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    map TEXT NOT NULL,
+    labels TEXT,
+    built REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS insns (
+    image_id INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    address INTEGER NOT NULL,
+    opcode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    operand INTEGER NOT NULL,
+    m_flag INTEGER NOT NULL,
+    x_flag INTEGER NOT NULL,
+    PRIMARY KEY (image_id, offset)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS symbols (
+    image_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    address INTEGER NOT NULL,
+    label_end INTEGER NOT NULL,
+    code_end INTEGER,
+    hash TEXT NOT NULL,
+    shape TEXT,
+    PRIMARY KEY (image_id, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name, image_id);
+CREATE TABLE IF NOT EXISTS xrefs (
+    image_id INTEGER NOT NULL,
+    src INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    target INTEGER NOT NULL,
+    target_offset INTEGER
+);
+CREATE INDEX IF NOT EXISTS xrefs_target ON xrefs (image_id, target);
+CREATE INDEX IF NOT EXISTS xrefs_src ON xrefs (image_id, src);
+CREATE TABLE IF NOT EXISTS transfers (
+    image_id INTEGER NOT NULL,
+    site INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    channel INTEGER,
+    mode INTEGER,
+    bbus INTEGER,
+    source INTEGER,
+    size INTEGER,
+    dest INTEGER,
+    status TEXT
+);
+CREATE INDEX IF NOT EXISTS transfers_image ON transfers (image_id);
+CREATE TABLE IF NOT EXISTS diffs (
+    old_id INTEGER NOT NULL,
+    new_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    old_size INTEGER,
+    new_size INTEGER,
+    PRIMARY KEY (old_id, new_id, name)
+) WITHOUT ROWID;
+"""
+
+# read-modify-write and store mnemonics count as writes
+WRITES = frozenset(("STA", "STX", "STY", "STZ", "INC", "DEC", "ASL", "LSR", "ROL", "ROR", "TSB", "TRB"))
+DATA_MODES = frozenset(("abs", "absx", "absy", "long", "longx"))
+
+
+def _sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def run_addresses(mapper, offsets):
+    """Vectorized execution address of image offsets (WRAM copies included)."""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    addr = mapper.to_address(offsets)
+    if hasattr(mapper, "run_address") and len(offsets):
+        run = mapper.run_address(offsets)
+        addr = np.where(run >= 0, run, addr)
+    return addr
+
+
+def analyse(data, mapper, symbols=None):
+    """Analyse one image. Returns (insn rows, symbol rows, xref rows, transfer rows)
+    without image ids, ready for executemany()."""
+    roots = disasm65.image_roots(data, mapper, symbols)
+    cm, transfers = dmaextract.extract(data, mapper, roots)
+
+    offsets = sorted(cm.insns)
+    addresses = run_addresses(mapper, offsets)
+    insns = [(off, int(addr), cm.insns[off].opcode, cm.insns[off].size, cm.insns[off].operand,
+              int(cm.insns[off].m_flag), int(cm.insns[off].x_flag))
+             for off, addr in zip(offsets, addresses)]
+
+    xrefs = []
+    for off, addr in zip(offsets, addresses):
+        insn = cm.insns[off]
+        if insn.opcode in disasm65.CALLS:
+            target = disasm65.flow_targets(insn, int(addr))
+            xrefs.append((off, "call", target, cm.calls.get(off)))
+        elif insn.opcode in disasm65.BRANCHES or insn.opcode in disasm65.JUMPS:
+            target = disasm65.flow_targets(insn, int(addr))
+            toff = int(mapper.to_offset(target))
+            xrefs.append((off, "jump", target, toff if 0 <= toff < len(data) else None))
+        elif insn.mode in DATA_MODES and insn.opcode not in disasm65.INDIRECT_JUMPS:
+            kind = "write" if insn.mnem in WRITES else "read"
+            toff = int(mapper.to_offset(insn.operand)) if insn.mode.startswith("long") else -1
+            xrefs.append((off, kind, insn.operand, toff if 0 <= toff < len(data) else None))
+
+    syms = []
+    if symbols is not None:
+        code_ends = {}
+        for i in range(len(symbols)):
+            start, end = int(symbols.offsets[i]), int(symbols.ends[i])
+            if start not in code_ends:
+                code_ends[start] = disasm65.routine_extent(cm, start)[1] if start in cm.insns else None
+            code_end = code_ends[start]
+            shape = None
+            if code_end is not None:
+                shape = _sha1(bytes(cm.insns[o].opcode for o in offsets_in(offsets, start, code_end)))
+            syms.append((symbols.names[i], start, symbols.addresses[i], end, code_end,
+                         _sha1(data[start:end]), shape))
+
+    rows = []
+    for t in transfers:
+        check = dmaextract.check_copy(t, data, cm, mapper, symbols)
+        rows.append(tuple(t) + (check[0] if check else None,))
+    return insns, syms, xrefs, rows
+
+
+def offsets_in(sorted_offsets, start, end):
+    """Instruction offsets in [start, end) from a sorted list."""
+    lo = np.searchsorted(sorted_offsets, start)
+    hi = np.searchsorted(sorted_offsets, end)
+    return sorted_offsets[lo:hi]
+
+
+class AnalysisDB:
+    """Thin query layer over the SQLite file."""
+
+    def __init__(self, path=DEFAULT_DB):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self):
+        self.conn.close()
+
+    def image_id(self, key):
+        """Find an image by SHA-1 prefix or path (the newest build wins)."""
+        row = self.conn.execute("SELECT id FROM images WHERE sha1 LIKE ? ORDER BY built DESC LIMIT 1",
+                                (key.lower() + "%",)).fetchone()
+        if row is None:
+            row = self.conn.execute("SELECT id FROM images WHERE path = ? ORDER BY built DESC LIMIT 1",
+                                    (os.path.abspath(key),)).fetchone()
+        if row is None:
+            raise KeyError(f"no image matching '{key}'")
+        return row[0]
+
+    def ingest(self, path, mapper_name="menu", labels_path=None):
+        """Analyse and store one image. Returns (image id, True if newly added)."""
+        with open(path, "rb") as f:
+            data = f.read()
+        sha1 = _sha1(data)
+        path = os.path.abspath(path)
+        row = self.conn.execute("SELECT id FROM images WHERE sha1 = ?", (sha1,)).fetchone()
+        if row is not None:
+            with self.conn:
+                self.conn.execute("UPDATE images SET path = ? WHERE id = ?", (path, row[0]))
+            return row[0], False
+
+        labels = symbols = None
+        if labels_path:
+            from menulabels import label_widths, load_labels, rom_symbols
+            labels = load_labels(labels_path)
+        mapper = snesmap.get_mapper(mapper_name, labels)
+        if labels:
+            symbols = rom_symbols(labels, mapper, len(data), label_widths(labels_path))
+        insns, syms, xrefs, transfers = analyse(data, mapper, symbols)
+
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO images (sha1, path, size, map, labels, built) VALUES (?, ?, ?, ?, ?, ?)",
+                (sha1, path, len(data), mapper_name, labels_path and os.path.abspath(labels_path),
+                 os.path.getmtime(path)))
+            image_id = cur.lastrowid
+            self.conn.executemany("INSERT INTO insns VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                  ((image_id,) + r for r in insns))
+            self.conn.executemany("INSERT OR IGNORE INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                  ((image_id,) + r for r in syms))
+            self.conn.executemany("INSERT INTO xrefs VALUES (?, ?, ?, ?, ?)",
+                                  ((image_id,) + r for r in xrefs))
+            self.conn.executemany("INSERT INTO transfers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  ((image_id,) + r for r in transfers))
+        return image_id, True
+
+    def images(self):
+        return self.conn.execute(
+            "SELECT id, sha1, path, size, built FROM images ORDER BY built").fetchall()
+
+    def history(self, name):
+        """(sha1, path, built, label size, code size, hash) of a symbol in every build."""
+        return self.conn.execute(
+            "SELECT i.sha1, i.path, i.built, s.label_end - s.offset, s.code_end - s.offset, s.hash "
+            "FROM symbols s JOIN images i ON i.id = s.image_id WHERE s.name = ? ORDER BY i.built",
+            (name,)).fetchall()
+
+    def diff(self, old_id, new_id):
+        """Per-symbol comparison of two builds, cached in the diffs table.
+
+        status is same, operands (same opcodes, different operand bytes,
+        usually just relocation), changed, added or removed.
+        """
+        cached = self.conn.execute(
+            "SELECT name, status, old_size, new_size FROM diffs WHERE old_id = ? AND new_id = ? "
+            "ORDER BY name", (old_id, new_id)).fetchall()
+        if cached:
+            return cached
+        query = """
+            SELECT o.name,
+                CASE WHEN o.hash = n.hash THEN 'same'
+                     WHEN o.shape IS NOT NULL AND o.shape = n.shape THEN 'operands'
+                     ELSE 'changed' END,
+                o.label_end - o.offset, n.label_end - n.offset
+            FROM symbols o JOIN symbols n ON n.name = o.name AND n.image_id = :new
+            WHERE o.image_id = :old
+            UNION ALL
+            SELECT o.name, 'removed', o.label_end - o.offset, NULL FROM symbols o
+            WHERE o.image_id = :old AND NOT EXISTS
+                (SELECT 1 FROM symbols n WHERE n.image_id = :new AND n.name = o.name)
+            UNION ALL
+            SELECT n.name, 'added', NULL, n.label_end - n.offset FROM symbols n
+            WHERE n.image_id = :new AND NOT EXISTS
+                (SELECT 1 FROM symbols o WHERE o.image_id = :old AND o.name = n.name)
+            ORDER BY 1
+        """
+        rows = self.conn.execute(query, {"old": old_id, "new": new_id}).fetchall()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO diffs VALUES (?, ?, ?, ?, ?, ?)",
+                                  ((old_id, new_id) + tuple(r) for r in rows))
+        return rows
+
+    def xrefs_to(self, image_id, target):
+        """(src offset, src address, kind, target) of references to an address.
+
+        Absolute operands are stored as written (16 bits), so the low
+        word of target also matches.
+        """
+        return self.conn.execute(
+            "SELECT x.src, i.address, x.kind, x.target FROM xrefs x "
+            "LEFT JOIN insns i ON i.image_id = x.image_id AND i.offset = x.src "
+            "WHERE x.image_id = ? AND x.target IN (?, ?) ORDER BY x.src",
+            (image_id, target, target & 0xFFFF)).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store and query ROM build analysis in SQLite.")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("ingest", help="analyse and store images")
+    p.add_argument("images", nargs="+")
+    p.add_argument("--labels", help="64tass label file")
+    p.add_argument("--map", default="menu", help="memory map (" + ", ".join(snesmap.MAPPERS) + ")")
+    sub.add_parser("list", help="list stored builds")
+    p = sub.add_parser("history", help="size and hash of a symbol across builds")
+    p.add_argument("name")
+    p = sub.add_parser("diff", help="per-symbol diff of two builds")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--all", action="store_true", help="also list unchanged symbols")
+    p = sub.add_parser("xrefs", help="references to an address")
+    p.add_argument("image")
+    p.add_argument("address", type=lambda s: int(s.lstrip("$"), 16))
+    p = sub.add_parser("sql", help="run a raw query")
+    p.add_argument("query")
+    args = parser.parse_args()
+
+    db = AnalysisDB(args.db)
+    if args.cmd == "ingest":
+        for path in args.images:
+            image_id, added = db.ingest(path, args.map, args.labels)
+            print(f"{path}: {'added' if added else 'already stored'} as #{image_id}")
+    elif args.cmd == "list":
+        for image_id, sha1, path, size, built in db.images():
+            print(f"  #{image_id:<4} {sha1[:12]}  {size:8d}  {path}")
+    elif args.cmd == "history":
+        last = None
+        for sha1, path, built, label_size, code_size, digest in db.history(args.name):
+            mark = "" if last is None or digest == last else "  *"
+            code = "-" if code_size is None else f"{code_size}"
+            print(f"  {sha1[:12]}  label {label_size:5d}  code {code:>5}  {path}{mark}")
+            last = digest
+    elif args.cmd == "diff":
+        rows = db.diff(db.image_id(args.old), db.image_id(args.new))
+        for name, status, old_size, new_size in rows:
+            if status != "same" or args.all:
+                sizes = f"{'-' if old_size is None else old_size} -> {'-' if new_size is None else new_size}"
+                print(f"  {status:<8} {sizes:>14}  {name}")
+    elif args.cmd == "xrefs":
+        for src, addr, kind, target in db.xrefs_to(db.image_id(args.image), args.address):
+            print(f"  ${addr:06X}  {kind:<5} ${target:06X}")
+    else:
+        for row in db.conn.execute(args.query):
+            print("  " + "  ".join(str(v) for v in row))
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
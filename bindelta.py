@@ -0,0 +1,563 @@
+#!/usr/bin/env python3
+"""
+Binary deltas between two builds of an image (menu.bin, firmware).
+
+Three patch formats, chosen by the output extension:
+
+    .bps  beat BPS: SourceRead / TargetRead / SourceCopy / TargetCopy,
+          with CRC32s of source, target and patch. Copies are found with
+          a suffix array over the old image (and one over the new image
+          for TargetCopy), so code that moved is a copy, not new bytes.
+    .ips  IPS: in-place changed ranges, with RLE records for long runs of
+          one byte and the truncation extension when the image shrinks.
+    .put  ranges for USBINT_SERVER_OPCODE_PUT, merged wherever one PUT
+          costs fewer bytes on the wire than two (a command block plus
+          whole data blocks plus the response). Layout, little endian:
+          "PUT1", u32 target size, u32 CRC32 source, u32 CRC32 target,
+          then per range u32 offset, u32 length and the bytes.
+
+IPS and PUT can only overwrite in place, so an insertion that shifts the
+rest of the image makes them as large as the shifted part; BPS stays
+small. The device itself only understands PUT: push sends the ranges of
+a .put delta to SNES space through usbint.py.
+
+The suffix array is built by prefix doubling in numpy. Matching is
+greedy: at each position the longest of the in-place run, the best
+source copy and the best earlier-target copy wins when it pays for its
+header; anything else becomes literal bytes.
+
+Usage:
+    bindelta.py make old.bin new.bin -o new.bps|new.ips|new.put [--block 512]
+    bindelta.py apply old.bin patch.bps -o new.bin
+    bindelta.py verify old.bin new.bin patch.bps
+    bindelta.py bench build1.bin build2.bin [build3.bin ...]   (consecutive pairs)
+    bindelta.py push old.bin new.bin TARGET [--base 0]
+"""
+
+import argparse
+import asyncio
+import bisect
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+BPS_MAGIC = b"BPS1"
+IPS_MAGIC = b"PATCH"
+IPS_EOF = b"EOF"
+PUT_MAGIC = b"PUT1"
+
+SOURCE_READ, TARGET_READ, SOURCE_COPY, TARGET_COPY = range(4)
+
+MIN_READ = 3
+MIN_COPY = 6
+SEARCH_BELOW = 64
+COMPARE_CAP = 256
+TARGET_NEIGHBOURS = 8
+
+IPS_MAX_OFFSET = 0xFFFFFF
+IPS_MAX_RECORD = 0xFFFF
+IPS_EOF_OFFSET = 0x454F46
+IPS_RLE_MIN = 16
+
+USB_BLOCK = 512
+
+
+def suffix_array(data):
+    """Suffix array of data (int64), by prefix doubling."""
+    n = len(data)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    rank = np.frombuffer(bytes(data), dtype=np.uint8).astype(np.int64)
+    scale = max(n, 256) + 1
+    k = 1
+    while True:
+        second = np.zeros(n, dtype=np.int64)
+        second[:n - k] = rank[k:] + 1
+        key = rank * scale + second
+        sa = np.argsort(key, kind="stable")
+        sorted_key = key[sa]
+        rank = np.empty(n, dtype=np.int64)
+        rank[sa] = np.concatenate(([0], np.cumsum(sorted_key[1:] != sorted_key[:-1])))
+        if rank[sa[-1]] == n - 1 or k >= n:
+            return sa
+        k *= 2
+
+
+def _runs_equal(a, b):
+    """For each i < min(len): number of equal bytes from i on."""
+    n = min(len(a), len(b))
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    eq = np.frombuffer(a, dtype=np.uint8, count=n) == np.frombuffer(b, dtype=np.uint8, count=n)
+    idx = np.arange(n, dtype=np.int64)
+    # index of the next unequal byte at or after i
+    nxt = np.where(eq, n, idx)
+    nxt = np.minimum.accumulate(nxt[::-1])[::-1]
+    return nxt - idx
+
+
+class Matcher:
+    """Longest matches for positions of target in source and in the target before them."""
+
+    def __init__(self, source, target):
+        self.source, self.target = bytes(source), bytes(target)
+        self.src = np.frombuffer(self.source, dtype=np.uint8)
+        self.tgt = np.frombuffer(self.target, dtype=np.uint8)
+        self.src_sa = suffix_array(self.source).tolist()
+        tgt_sa = suffix_array(self.target)
+        self.tgt_sa = tgt_sa.tolist()
+        self.tgt_rank = np.empty(len(tgt_sa), dtype=np.int64)
+        self.tgt_rank[tgt_sa] = np.arange(len(tgt_sa))
+        self.tgt_rank = self.tgt_rank.tolist()
+        self.same = _runs_equal(self.source, self.target).tolist()
+
+    @staticmethod
+    def _match_len(a, i, b, j, limit):
+        n, step = 0, 32
+        while n < limit:
+            k = min(step, limit - n)
+            x, y = a[i + n:i + n + k], b[j + n:j + n + k]
+            if np.array_equal(x, y):
+                n += k
+                step *= 2
+            else:
+                return n + int(np.argmax(x != y))
+        return n
+
+    def source_match(self, t):
+        """(length, source position) of the longest source match for target[t:]."""
+        sa, src = self.src_sa, self.source
+        if not sa:
+            return 0, 0
+        probe = self.target[t:t + COMPARE_CAP]
+        lo = bisect.bisect_left(sa, probe, key=lambda i: src[i:i + COMPARE_CAP])
+        limit = len(self.target) - t
+        best = (0, 0)
+        for r in (lo - 1, lo):
+            if 0 <= r < len(sa):
+                s = sa[r]
+                length = self._match_len(self.src, s, self.tgt, t, min(limit, len(src) - s))
+                if length > best[0]:
+                    best = (length, s)
+        return best
+
+    def target_match(self, t):
+        """(length, position < t) of the longest earlier-target match for target[t:]; overlap allowed."""
+        sa, rank = self.tgt_sa, self.tgt_rank[t]
+        limit = len(self.target) - t
+        best = (0, 0)
+        for direction in (-1, 1):
+            r = rank + direction
+            for _ in range(TARGET_NEIGHBOURS):
+                if not 0 <= r < len(sa):
+                    break
+                p = sa[r]
+                r += direction
+                if p >= t:
+                    continue
+                length = self._match_len(self.tgt, p, self.tgt, t, limit)
+                if length < MIN_COPY:
+                    break
+                if length > best[0]:
+                    best = (length, p)
+        return best
+
+    def ops(self):
+        """[(action, length, position)]: position is the source/target offset for copies, the target offset otherwise."""
+        n = len(self.target)
+        same = self.same
+        out = []
+        literal = None
+        t = 0
+        while t < n:
+            run = same[t] if t < len(same) else 0
+            best = (run, SOURCE_READ, t) if run >= MIN_READ else (0, TARGET_READ, t)
+            if run < SEARCH_BELOW:
+                length, pos = self.source_match(t)
+                if length >= MIN_COPY and length > best[0] + 2:
+                    best = (length, SOURCE_COPY, pos)
+                length, pos = self.target_match(t)
+                if length >= MIN_COPY and length > best[0] + 2:
+                    best = (length, TARGET_COPY, pos)
+            if best[0] == 0:
+                if literal is None:
+                    literal = t
+                t += 1
+                continue
+            if literal is not None:
+                out.append((TARGET_READ, t - literal, literal))
+                literal = None
+            out.append((best[1], best[0], best[2]))
+            t += best[0]
+        if literal is not None:
+            out.append((TARGET_READ, n - literal, literal))
+        return out
+
+
+def _bps_number(n):
+    out = bytearray()
+    while True:
+        x = n & 0x7F
+        n >>= 7
+        if n == 0:
+            out.append(0x80 | x)
+            return bytes(out)
+        out.append(x)
+        n -= 1
+
+
+def _bps_signed(n):
+    return _bps_number((abs(n) << 1) | (n < 0))
+
+
+def _read_number(data, pos):
+    value, shift = 0, 1
+    while True:
+        if pos >= len(data):
+            raise ValueError("BPS patch truncated")
+        x = data[pos]
+        pos += 1
+        value += (x & 0x7F) * shift
+        if x & 0x80:
+            return value, pos
+        shift <<= 7
+        value += shift
+
+
+def make_bps(source, target, ops=None):
+    """BPS patch from source to target."""
+    if ops is None:
+        ops = Matcher(source, target).ops()
+    out = bytearray(BPS_MAGIC)
+    out += _bps_number(len(source)) + _bps_number(len(target)) + _bps_number(0)
+    src_rel = tgt_rel = 0
+    for action, length, pos in ops:
+        out += _bps_number(((length - 1) << 2) | action)
+        if action == TARGET_READ:
+            out += target[pos:pos + length]
+        elif action == SOURCE_COPY:
+            out += _bps_signed(pos - src_rel)
+            src_rel = pos + length
+        elif action == TARGET_COPY:
+            out += _bps_signed(pos - tgt_rel)
+            tgt_rel = pos + length
+    out += struct.pack("<II", zlib.crc32(source), zlib.crc32(target))
+    out += struct.pack("<I", zlib.crc32(out))
+    return bytes(out)
+
+
+def apply_bps(source, patch):
+    if patch[:4] != BPS_MAGIC or len(patch) < 16:
+        raise ValueError("not a BPS patch")
+    if zlib.crc32(patch[:-4]) != struct.unpack("<I", patch[-4:])[0]:
+        raise ValueError("BPS patch checksum mismatch")
+    src_crc, tgt_crc = struct.unpack("<II", patch[-12:-4])
+    if zlib.crc32(source) != src_crc:
+        raise ValueError("source does not match the patch (CRC32)")
+    pos = 4
+    src_size, pos = _read_number(patch, pos)
+    tgt_size, pos = _read_number(patch, pos)
+    meta, pos = _read_number(patch, pos)
+    pos += meta
+    if src_size != len(source):
+        raise ValueError(f"patch is for a {src_size} byte source, not {len(source)}")
+    out = bytearray()
+    src_rel = tgt_rel = 0
+    end = len(patch) - 12
+    while pos < end:
+        value, pos = _read_number(patch, pos)
+        action, length = value & 3, (value >> 2) + 1
+        if action == SOURCE_READ:
+            out += source[len(out):len(out) + length]
+        elif action == TARGET_READ:
+            out += patch[pos:pos + length]
+            pos += length
+        else:
+            rel, pos = _read_number(patch, pos)
+            rel = -(rel >> 1) if rel & 1 else rel >> 1
+            if action == SOURCE_COPY:
+                src_rel += rel
+                out += source[src_rel:src_rel + length]
+                src_rel += length
+            else:
+                tgt_rel += rel
+                if tgt_rel + length <= len(out):
+                    out += out[tgt_rel:tgt_rel + length]
+                else:
+                    for i in range(length):
+                        out.append(out[tgt_rel + i])
+                tgt_rel += length
+    if len(out) != tgt_size or zlib.crc32(out) != tgt_crc:
+        raise ValueError("patched image does not match the patch's target (size/CRC32)")
+    return bytes(out)
+
+
+def changed_ranges(source, target):
+    """[(offset, end)] of target bytes that differ from source in place (bytes past the source end differ)."""
+    n = min(len(source), len(target))
+    neq = np.frombuffer(source, dtype=np.uint8, count=n) != np.frombuffer(target, dtype=np.uint8, count=n)
+    neq = np.concatenate(([False], neq, np.ones(len(target) - n, dtype=bool), [False]))
+    edges = np.flatnonzero(np.diff(neq.astype(np.int8)))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def merge_ranges(ranges, cost):
+    """Join neighbouring ranges while cost(joined) <= cost(a) + cost(b)."""
+    out = []
+    for start, end in ranges:
+        if out and cost(end - out[-1][0]) <= cost(out[-1][1] - out[-1][0]) + cost(end - start):
+            out[-1] = (out[-1][0], end)
+        else:
+            out.append((start, end))
+    return out
+
+
+def _byte_runs(data):
+    """For each i: number of bytes equal to data[i] from i on."""
+    arr = np.frombuffer(data, dtype=np.uint8)
+    if len(arr) == 0:
+        return arr.astype(np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], arr[1:] != arr[:-1])))
+    ends = np.append(starts[1:], len(arr))
+    owner = np.repeat(np.arange(len(starts)), ends - starts)
+    return ends[owner] - np.arange(len(arr))
+
+
+def make_ips(source, target):
+    """IPS patch from source to target."""
+    if len(target) > IPS_MAX_OFFSET + 1:
+        raise ValueError("IPS offsets stop at 16 MB")
+    runs = _byte_runs(target).tolist()
+    out = bytearray(IPS_MAGIC)
+    for start, end in merge_ranges(changed_ranges(source, target), lambda n: n + 5):
+        pos = start
+        while pos < end:
+            run = min(runs[pos], end - pos, IPS_MAX_RECORD)
+            if run >= IPS_RLE_MIN and pos != IPS_EOF_OFFSET:
+                out += struct.pack(">I", pos)[1:] + struct.pack(">HHB", 0, run, target[pos])
+                pos += run
+                continue
+            # literal bytes up to the next long run
+            stop = pos
+            while stop < end and stop - pos < IPS_MAX_RECORD - 1:
+                run = min(runs[stop], end - stop)
+                if run >= IPS_RLE_MIN and stop > pos:
+                    break
+                stop += min(run, IPS_MAX_RECORD - 1 - (stop - pos))
+            # an offset that reads "EOF" would end the patch: start a byte earlier
+            first = pos - 1 if pos == IPS_EOF_OFFSET else pos
+            out += struct.pack(">I", first)[1:] + struct.pack(">H", stop - first) + target[first:stop]
+            pos = stop
+    out += IPS_EOF
+    if len(target) < len(source):
+        out += struct.pack(">I", len(target))[1:]
+    return bytes(out)
+
+
+def apply_ips(source, patch):
+    if patch[:5] != IPS_MAGIC:
+        raise ValueError("not an IPS patch")
+    out = bytearray(source)
+    pos = 5
+    while True:
+        if patch[pos:pos + 3] == IPS_EOF:
+            pos += 3
+            break
+        if pos + 5 > len(patch):
+            raise ValueError("IPS patch truncated")
+        offset = int.from_bytes(patch[pos:pos + 3], "big")
+        size = int.from_bytes(patch[pos + 3:pos + 5], "big")
+        pos += 5
+        if size:
+            data = patch[pos:pos + size]
+            pos += size
+        else:
+            count, value = struct.unpack(">HB", patch[pos:pos + 3])
+            data = bytes([value]) * count
+            pos += 3
+        if offset > len(out):
+            out += bytes(offset - len(out))
+        out[offset:offset + len(data)] = data
+    if len(patch) - pos >= 3:
+        del out[int.from_bytes(patch[pos:pos + 3], "big"):]
+    return bytes(out)
+
+
+def put_cost(length, block=USB_BLOCK):
+    """Bytes on the wire for one PUT of length bytes: command, padded data blocks, response."""
+    return USB_BLOCK + max(1, -(-length // block)) * block + USB_BLOCK
+
+
+def put_ranges(source, target, block=USB_BLOCK):
+    """[(offset, end)] of PUTs that turn source into target."""
+    return merge_ranges(changed_ranges(source, target), lambda n: put_cost(n, block))
+
+
+def make_put(source, target, block=USB_BLOCK):
+    out = bytearray(PUT_MAGIC)
+    out += struct.pack("<III", len(target), zlib.crc32(source), zlib.crc32(target))
+    for start, end in put_ranges(source, target, block):
+        out += struct.pack("<II", start, end - start) + target[start:end]
+    return bytes(out)
+
+
+def read_put(patch):
+    """(target size, source CRC32, target CRC32, [(offset, data)])."""
+    if patch[:4] != PUT_MAGIC or len(patch) < 16:
+        raise ValueError("not a PUT list")
+    size, src_crc, tgt_crc = struct.unpack("<III", patch[4:16])
+    puts, pos = [], 16
+    while pos < len(patch):
+        if pos + 8 > len(patch):
+            raise ValueError("PUT list truncated")
+        offset, length = struct.unpack("<II", patch[pos:pos + 8])
+        puts.append((offset, patch[pos + 8:pos + 8 + length]))
+        pos += 8 + length
+    return size, src_crc, tgt_crc, puts
+
+
+def apply_put(source, patch):
+    size, src_crc, tgt_crc, puts = read_put(patch)
+    if zlib.crc32(source) != src_crc:
+        raise ValueError("source does not match the patch (CRC32)")
+    out = bytearray(source[:size]) + bytes(max(0, size - len(source)))
+    for offset, data in puts:
+        out[offset:offset + len(data)] = data
+    if zlib.crc32(out) != tgt_crc:
+        raise ValueError("patched image does not match the patch's target (CRC32)")
+    return bytes(out)
+
+
+FORMATS = {".bps": (make_bps, apply_bps), ".ips": (make_ips, apply_ips), ".put": (make_put, apply_put)}
+
+
+def apply_patch(source, patch):
+    """Apply a patch of any format, told apart by its magic."""
+    for magic, apply in ((BPS_MAGIC, apply_bps), (IPS_MAGIC, apply_ips), (PUT_MAGIC, apply_put)):
+        if patch.startswith(magic):
+            return apply(source, patch)
+    raise ValueError("unknown patch format")
+
+
+def bench_pair(source, target, block=USB_BLOCK):
+    """{name: value} for one build pair: patch sizes, encode times, PUT wire bytes."""
+    row = {}
+    t0 = time.perf_counter()
+    matcher = Matcher(source, target)
+    t1 = time.perf_counter()
+    ops = matcher.ops()
+    bps = make_bps(source, target, ops)
+    t2 = time.perf_counter()
+    ips = make_ips(source, target)
+    t3 = time.perf_counter()
+    ranges = put_ranges(source, target, block)
+    t4 = time.perf_counter()
+    if apply_bps(source, bps) != target or apply_ips(source, ips) != target:
+        raise ValueError("round trip failed")
+    row["index ms"] = (t1 - t0) * 1000
+    row["bps"] = len(bps)
+    row["bps ms"] = (t2 - t1) * 1000
+    row["ips"] = len(ips)
+    row["ips ms"] = (t3 - t2) * 1000
+    row["puts"] = len(ranges)
+    row["put bytes"] = sum(e - s for s, e in ranges)
+    row["put wire"] = sum(put_cost(e - s, block) for s, e in ranges)
+    row["full wire"] = put_cost(len(target), block)
+    row["put ms"] = (t4 - t3) * 1000
+    return row
+
+
+async def push(source, target, address, base=0, block=USB_BLOCK):
+    """PUT the changed ranges of target to SNES space at base; returns (PUTs, bytes)."""
+    from usbint import SPACE_SNES, Client
+    client = await Client.open(address, depth=8, block=block)
+    try:
+        ranges = put_ranges(source, target, block)
+        pending = [await client.submit_put(SPACE_SNES, base + s, target[s:e]) for s, e in ranges]
+        for task in pending:
+            await task
+    finally:
+        await client.close()
+    return len(ranges), sum(e - s for s, e in ranges)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Binary deltas between image builds (BPS, IPS, PUT list).")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("make")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("-o", "--output", required=True, help="patch file (.bps, .ips or .put)")
+    p = sub.add_parser("apply")
+    p.add_argument("old")
+    p.add_argument("patch")
+    p.add_argument("-o", "--output", required=True)
+    p = sub.add_parser("verify")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("patch")
+    p = sub.add_parser("bench")
+    p.add_argument("builds", nargs="+", help="images in build order")
+    p = sub.add_parser("push")
+    p.add_argument("old", help="image the device holds now")
+    p.add_argument("new")
+    p.add_argument("target", help="HOST:PORT or serial device")
+    p.add_argument("--base", type=lambda s: int(s, 16), default=0, help="SNES space address of the image (hex)")
+    for name in ("make", "bench", "push"):
+        sub.choices[name].add_argument("--block", type=int, choices=(64, USB_BLOCK), default=USB_BLOCK,
+                                       help="PUT data block size")
+    args = parser.parse_args()
+
+    try:
+        if args.cmd == "make":
+            ext = os.path.splitext(args.output)[1].lower()
+            if ext not in FORMATS:
+                parser.error("output must end in " + ", ".join(FORMATS))
+            old, new = _read(args.old), _read(args.new)
+            t0 = time.perf_counter()
+            if ext == ".put":
+                patch = make_put(old, new, args.block)
+            else:
+                patch = FORMATS[ext][0](old, new)
+            elapsed = time.perf_counter() - t0
+            with open(args.output, "wb") as f:
+                f.write(patch)
+            print(f"{args.output}: {len(patch)} bytes for a {len(new)} byte image ({elapsed * 1000:.0f} ms)")
+        elif args.cmd == "apply":
+            data = apply_patch(_read(args.old), _read(args.patch))
+            with open(args.output, "wb") as f:
+                f.write(data)
+            print(f"{args.output}: {len(data)} bytes")
+        elif args.cmd == "verify":
+            if apply_patch(_read(args.old), _read(args.patch)) != _read(args.new):
+                print("MISMATCH")
+                raise SystemExit(1)
+            print("ok")
+        elif args.cmd == "bench":
+            if len(args.builds) < 2:
+                parser.error("need at least two builds")
+            cols = ("index ms", "bps", "bps ms", "ips", "ips ms", "puts", "put bytes", "put wire", "full wire")
+            print(f"{'pair':<40} {'size':>8} " + " ".join(f"{c:>10}" for c in cols))
+            for a, b in zip(args.builds, args.builds[1:]):
+                old, new = _read(a), _read(b)
+                row = bench_pair(old, new, args.block)
+                name = f"{os.path.basename(a)} -> {os.path.basename(b)}"
+                print(f"{name:<40} {len(new):8d} " + " ".join(
+                    f"{row[c]:10.1f}" if c.endswith("ms") else f"{row[c]:10d}" for c in cols))
+        else:
+            count, size = asyncio.run(push(_read(args.old), _read(args.new), args.target, args.base, args.block))
+            print(f"{count} PUTs, {size} bytes")
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
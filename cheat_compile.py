@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Compile an sd2snes cheat list into ROM slot assignments and a WRAM cheat routine.
+
+cheat_program() (src/cheat.c) sends every enabled code either to one of
+the 6 FPGA ROM patch slots or, for WRAM codes (cheat_is_wram_cheat()),
+appends "LDA #val / STA long" to the routine at SNESCMD_WRAM_CHEATS that
+the NMI hook calls every frame. This does the same classification ahead
+of time and then shrinks the WRAM routine:
+
+  - codes are deduplicated; for the same address the last one wins,
+    as it does in the firmware's store order
+  - codes on consecutive addresses become one 16-bit store in a
+    REP #$20 ... SEP #$20 section, when that pays for the REP/SEP
+  - stores are grouped by value so one LDA serves several addresses
+
+The hook calls the routine with 8-bit A and unknown DB/D, so stores stay
+long. Cost is given in CPU cycles and master clocks (code in the
+$2000-$3FFF fast area, WRAM/stack at 8 clocks) including the JSR/RTS,
+against the firmware's own layout and the vblank time of a 224-line
+frame.
+
+Usage:
+    cheat_compile.py build cheats/game.yml [-o wram_cheats.bin] [--rom game.sfc] [--objective cycles|bytes] [--all]
+    cheat_compile.py show cheats/game.yml [--all]
+    cheat_compile.py convert DD62-1F0F 7E0DBE09 ...
+"""
+
+import argparse
+import sys
+from collections import namedtuple
+
+from compare_wram import disasm_block
+
+# mirrors src/snes.h / src/cheat.h
+SNESCMD_WRAM_CHEATS = 0x2AD8
+SNESCMD_NMI_RESET = 0x2BA0
+WRAM_CHEAT_SPACE = SNESCMD_NMI_RESET - SNESCMD_WRAM_CHEATS
+ROM_SLOTS = 6
+CHEAT_NUM_CODES_PER_CHEAT = 40
+ASM_LDA_IMM = 0xA9
+ASM_STA_ABSLONG = 0x8F
+ASM_REP = 0xC2
+ASM_SEP = 0xE2
+ASM_RTS = 0x60
+
+# master clocks per access (see the module docstring)
+CLK_FETCH = 6
+CLK_IO = 6
+CLK_STACK = 8
+VBLANK_CLOCKS = (262 - 225) * 1364
+
+GG2RAW = (0x4, 0x6, 0xD, 0xE, 0x2, 0x7, 0x8, 0x3, 0xB, 0x5, 0xC, 0x9, 0xA, 0x0, 0xF, 0x1)
+RAW2GG = (0xD, 0xF, 0x4, 0x7, 0x0, 0x9, 0x1, 0x5, 0x6, 0xB, 0xC, 0x8, 0xA, 0x2, 0x3, 0xE)
+
+Cheat = namedtuple("Cheat", "name enabled codes")
+Patch = namedtuple("Patch", "address value code name")
+Cost = namedtuple("Cost", "bytes cycles clocks")
+
+
+def gg2raw(patch):
+    """cheat_gg2raw(): Game Genie code (as an integer) to raw bank/address/value."""
+    decrypt = 0
+    for _ in range(8):
+        decrypt = ((decrypt >> 4) & 0x0FFFFFFF) | (GG2RAW[patch & 0xF] << 28)
+        patch >>= 4
+    return (((decrypt & 0xFF000000) >> 24)
+            | (decrypt & 0x00F00000)
+            | ((decrypt & 0x000F0000) >> 4)
+            | ((decrypt & 0x0000C000) << 2)
+            | ((decrypt & 0x00003C00) << 18)
+            | ((decrypt & 0x000003C0) << 2)
+            | ((decrypt & 0x0000003C) << 22)
+            | ((decrypt & 0x00000003) << 18))
+
+
+def raw2gg(patch):
+    """cheat_raw2gg(): raw code to the Game Genie integer."""
+    patch = (((patch & 0xF0000000) >> 18)
+             | ((patch & 0x0F000000) >> 22)
+             | (patch & 0x00F00000)
+             | ((patch & 0x000C0000) >> 18)
+             | ((patch & 0x00030000) >> 2)
+             | ((patch & 0x0000F000) << 4)
+             | ((patch & 0x00000F00) >> 2)
+             | ((patch & 0x000000FF) << 24))
+    encrypt = 0
+    for _ in range(8):
+        encrypt = ((encrypt >> 4) & 0x0FFFFFFF) | (RAW2GG[patch & 0xF] << 28)
+        patch >>= 4
+    return encrypt
+
+
+def str2bin(text):
+    """cheat_str2bin(): "XXXX-XXXX" Game Genie or 8-digit PAR/raw hex to the raw code."""
+    text = text.strip()
+    try:
+        if len(text) > 4 and text[4] == "-":
+            return gg2raw(int(text[:4] + text[5:9], 16))
+        return int(text, 16) & 0xFFFFFFFF
+    except ValueError:
+        raise ValueError(f"bad cheat code '{text}'") from None
+
+
+def is_wram_cheat(code):
+    """cheat_is_wram_cheat(): banks $7E/$7F, or below $2000 in the system banks."""
+    return ((code & 0xFE000000) == 0x7E000000
+            or (not code & 0x40000000 and (code & 0xFFFF00) < 0x200000))
+
+
+def code_address(code):
+    return code >> 8
+
+
+def _unquote(text):
+    text = text.strip()
+    if text[:1] in "\"'":
+        return text[1:].split(text[0], 1)[0]
+    return text
+
+
+def parse_cheats(path):
+    """[Cheat] from a cheats/*.yml file, in file order (what cheat_yaml_load() reads)."""
+    cheats = []
+    item = None
+    in_code = False
+    with open(path, "r", encoding="latin-1") as f:
+        for raw in f:
+            line = raw.rstrip("\r\n")
+            stripped = line.strip()
+            if stripped.startswith("#") or stripped in ("", "---", "..."):
+                continue
+            if line.startswith("- ") or line == "-":
+                item = {"name": "", "enabled": False, "codes": []}
+                cheats.append(item)
+                in_code = False
+                stripped = line[1:].strip()
+                if not stripped:
+                    continue
+            if item is None:
+                continue
+            if stripped.startswith("- ") and in_code:
+                item["codes"].append(_unquote(stripped[2:].split("#", 1)[0]))
+                continue
+            key, _, value = stripped.partition(":")
+            key = key.strip().lower()
+            value = value.split("#", 1)[0] if not value.strip().startswith(("\"", "'")) else value
+            in_code = False
+            if key == "name":
+                item["name"] = _unquote(value)
+            elif key == "enabled":
+                item["enabled"] = value.strip().lower() in ("true", "yes", "on", "1")
+            elif key == "code":
+                value = value.strip()
+                if value.startswith("["):
+                    item["codes"] += [_unquote(v) for v in value.strip("[]").split(",") if v.strip()]
+                elif value:
+                    item["codes"].append(_unquote(value))
+                else:
+                    in_code = True
+    return [Cheat(c["name"], c["enabled"], c["codes"][:CHEAT_NUM_CODES_PER_CHEAT]) for c in cheats]
+
+
+def patches(cheats, include_disabled=False):
+    """[Patch] for the enabled cheats, in the order cheat_program() deploys them."""
+    out = []
+    for cheat in cheats:
+        if cheat.enabled or include_disabled:
+            for text in cheat.codes:
+                code = str2bin(text)
+                out.append(Patch(code_address(code), code & 0xFF, code, cheat.name))
+    return out
+
+
+def classify(patch_list):
+    """(ROM patches, WRAM patches, notes), deduplicated.
+
+    Repeated WRAM addresses keep the last value (the last store wins);
+    repeated ROM codes keep one slot, and conflicting ROM values for one
+    address keep the last one too.
+    """
+    rom, wram, notes = {}, {}, []
+    for p in patch_list:
+        table = wram if is_wram_cheat(p.code) else rom
+        old = table.pop(p.address, None)
+        if old is not None:
+            what = "duplicate" if old.value == p.value else f"overrides ${old.value:02X} ({old.name})"
+            notes.append(f"${p.address:06X}={p.value:02X} ({p.name}): {what}")
+        table[p.address] = p
+    return list(rom.values()), list(wram.values()), notes
+
+
+def rom_noops(rom_patches, image):
+    """ROM patches that write the byte the ROM already has (image: romindex entry, data, mapper)."""
+    entry, data, mapper = image
+    base = 0x200 if entry["copier_header"] else 0
+    out = []
+    for p in rom_patches:
+        off = int(mapper.to_offset(p.address))
+        if 0 <= off and base + off < len(data) and data[base + off] == p.value:
+            out.append(p)
+    return out
+
+
+def assign_slots(rom_patches):
+    """(slots, overflow): what fpga_write_cheat() gets, in order, and what does not fit."""
+    return rom_patches[:ROM_SLOTS], rom_patches[ROM_SLOTS:]
+
+
+def _stores(code, value, address, wide):
+    if wide:
+        code += bytes((ASM_LDA_IMM, value & 0xFF, value >> 8)) if value is not None else b""
+    elif value is not None:
+        code += bytes((ASM_LDA_IMM, value))
+    code += bytes((ASM_STA_ABSLONG, address & 0xFF, (address >> 8) & 0xFF, address >> 16))
+    return code
+
+
+def _section(stores, wide):
+    """Code for [(address, value)], sorted so equal values share one LDA."""
+    code = bytearray()
+    last = None
+    for address, value in sorted(stores, key=lambda s: (s[1], s[0])):
+        code = _stores(code, None if value == last else value, address, wide)
+        last = value
+    return code
+
+
+def pair_words(wram_patches):
+    """([(address, 16-bit value)], [(address, byte)]) pairing codes on consecutive addresses."""
+    by_addr = sorted((p.address, p.value) for p in wram_patches)
+    words, singles = [], []
+    i = 0
+    while i < len(by_addr):
+        addr, value = by_addr[i]
+        if i + 1 < len(by_addr) and by_addr[i + 1][0] == addr + 1:
+            words.append((addr, value | (by_addr[i + 1][1] << 8)))
+            i += 2
+        else:
+            singles.append((addr, value))
+            i += 1
+    return words, singles
+
+
+def compile_wram(wram_patches, objective="cycles"):
+    """Smallest/fastest WRAM cheat routine (bytes, ending in RTS) for the given patches."""
+    bytes_only = [(p.address, p.value) for p in wram_patches]
+    candidates = [bytes(_section(bytes_only, False)) + bytes((ASM_RTS,))]
+    words, singles = pair_words(wram_patches)
+    if words:
+        code = _section(singles, False)
+        code += bytes((ASM_REP, 0x20)) + _section(words, True) + bytes((ASM_SEP, 0x20, ASM_RTS))
+        candidates.append(bytes(code))
+    key = (lambda c: (routine_cost(c).cycles, len(c))) if objective == "cycles" else \
+        (lambda c: (len(c), routine_cost(c).cycles))
+    return min(candidates, key=key)
+
+
+def firmware_wram(patch_list):
+    """The routine cheat_program_ram_cheat() writes: 6 bytes per WRAM code, then RTS."""
+    code = bytearray()
+    for p in patch_list:
+        if is_wram_cheat(p.code):
+            code = _stores(code, p.value, p.address, False)
+    return bytes(code) + bytes((ASM_RTS,))
+
+
+def write_clocks(address):
+    """Master clocks of a data write to a 24-bit address."""
+    bank, addr = address >> 16, address & 0xFFFF
+    if bank & 0x40 or addr >= 0x6000:
+        return 8
+    if addr < 0x2000:
+        return 8
+    if 0x4000 <= addr < 0x4200:
+        return 12
+    return 6
+
+
+def routine_cost(code):
+    """Cost of one call (JSR from the NMI hook included): Cost(bytes, cycles, master clocks)."""
+    cycles = 6                                          # JSR: 3 fetches, 1 internal, 2 stack writes
+    clocks = 3 * CLK_FETCH + CLK_IO + 2 * CLK_STACK
+    wide = False
+    pos = 0
+    while pos < len(code):
+        op = code[pos]
+        if op == ASM_LDA_IMM:
+            size = 3 if wide else 2
+            cycles += size
+            clocks += size * CLK_FETCH
+        elif op == ASM_STA_ABSLONG:
+            size = 4
+            address = code[pos + 1] | (code[pos + 2] << 8) | (code[pos + 3] << 16)
+            writes = [address, address + 1] if wide else [address]
+            cycles += 4 + len(writes)
+            clocks += 4 * CLK_FETCH + sum(write_clocks(a & 0xFFFFFF) for a in writes)
+        elif op in (ASM_REP, ASM_SEP):
+            size = 2
+            wide = op == ASM_REP
+            cycles += 3
+            clocks += 2 * CLK_FETCH + CLK_IO
+        elif op == ASM_RTS:
+            # opcode fetch, 2 internal, 2 stack reads, 1 internal
+            size = 1
+            cycles += 6
+            clocks += CLK_FETCH + 3 * CLK_IO + 2 * CLK_STACK
+            if pos + 1 != len(code):
+                raise ValueError(f"+${pos:02X}: RTS before the end of the routine")
+        else:
+            raise ValueError(f"+${pos:02X}: unexpected opcode ${op:02X} in WRAM cheat code")
+        pos += size
+    return Cost(len(code), cycles, clocks)
+
+
+def compile_cheats(path, include_disabled=False, objective="cycles", image=None):
+    """(slots, overflow, noops, wram code, firmware code, notes) for a cheat file."""
+    plist = patches(parse_cheats(path), include_disabled)
+    rom, wram, notes = classify(plist)
+    noops = rom_noops(rom, image) if image else []
+    slots, overflow = assign_slots([p for p in rom if p not in noops])
+    code = compile_wram(wram, objective)
+    if len(code) > WRAM_CHEAT_SPACE:
+        raise ValueError(f"WRAM cheat routine needs {len(code)} bytes, only {WRAM_CHEAT_SPACE} "
+                         f"fit at ${SNESCMD_WRAM_CHEATS:04X}")
+    return slots, overflow, noops, code, firmware_wram(plist), notes
+
+
+def load_image(path):
+    """(romindex entry, data, mapper) for --rom."""
+    import snesmap
+    from romindex import scan_rom
+    with open(path, "rb") as f:
+        data = f.read()
+    entry = scan_rom(data, len(data))
+    return entry, data, snesmap.get_mapper(entry["mapping"])
+
+
+def _cost_line(label, cost):
+    share = 100.0 * cost.clocks / VBLANK_CLOCKS
+    return (f"  {label:<9} {cost.bytes:4d} bytes {cost.cycles:6d} cycles {cost.clocks:7d} master clocks "
+            f"({share:.1f}% of vblank)")
+
+
+def print_routine(code):
+    for off, bstr, mnem, size in disasm_block(code, 0, len(code), m_flag=True, x_flag=True):
+        print(f"    ${SNESCMD_WRAM_CHEATS + off:04X}  {bstr:<12} {mnem}")
+
+
+def cmd_build(args):
+    image = load_image(args.rom) if args.rom else None
+    slots, overflow, noops, code, firmware, notes = compile_cheats(args.yml, args.all, args.objective, image)
+    for note in notes:
+        print(f"  note: {note}")
+    print(f"ROM slots ({len(slots)} of {ROM_SLOTS}):")
+    for i, p in enumerate(slots):
+        gg = raw2gg(p.code)
+        print(f"  {i}: {p.code:08X}  GG {gg >> 16:04X}-{gg & 0xFFFF:04X}  ${p.address:06X}=${p.value:02X}  {p.name}")
+    for p in noops:
+        print(f"  -  {p.code:08X}  ROM already has ${p.value:02X} at ${p.address:06X}  {p.name}")
+    for p in overflow:
+        print(f"  !! {p.code:08X}  no ROM slot left  {p.name}")
+    new, old = routine_cost(code), routine_cost(firmware)
+    print(f"WRAM cheats at ${SNESCMD_WRAM_CHEATS:04X}:")
+    print_routine(code)
+    print(_cost_line("compiled", new))
+    print(_cost_line("firmware", old))
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(code)
+        print(f"{len(code)} bytes -> {args.output}")
+    return 1 if overflow else 0
+
+
+def cmd_show(args):
+    for cheat in parse_cheats(args.yml):
+        if not cheat.enabled and not args.all:
+            continue
+        print(f"{'+' if cheat.enabled else '-'} {cheat.name}")
+        for text in cheat.codes:
+            code = str2bin(text)
+            kind = "WRAM" if is_wram_cheat(code) else "ROM "
+            print(f"    {text:<10} {kind} ${code_address(code):06X}=${code & 0xFF:02X}")
+    return 0
+
+
+def cmd_convert(args):
+    for text in args.codes:
+        code = str2bin(text)
+        gg = raw2gg(code)
+        kind = "WRAM" if is_wram_cheat(code) else "ROM"
+        print(f"  {text:<10} raw {code:08X}  GG {gg >> 16:04X}-{gg & 0xFFFF:04X}  {kind}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile sd2snes cheat lists for the ROM slots and NMI hook.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("build", help="assign ROM slots and compile the WRAM cheat routine")
+    p.add_argument("yml", help="cheat list (sd2snes/cheats/*.yml)")
+    p.add_argument("-o", "--output", help="write the WRAM cheat routine here")
+    p.add_argument("--rom", help="ROM image: drop ROM codes that change nothing")
+    p.add_argument("--objective", choices=("cycles", "bytes"), default="cycles")
+    p.add_argument("--all", action="store_true", help="include disabled cheats")
+    p.set_defaults(func=cmd_build)
+
+    p = sub.add_parser("show", help="list cheats and how each code is classified")
+    p.add_argument("yml")
+    p.add_argument("--all", action="store_true", help="include disabled cheats")
+    p.set_defaults(func=cmd_show)
+
+    p = sub.add_parser("convert", help="convert between Game Genie and raw codes")
+    p.add_argument("codes", nargs="+")
+    p.set_defaults(func=cmd_convert)
+
+    args = parser.parse_args()
+    try:
+        sys.exit(args.func(args))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+NumPy model of the SNES CIC lock/key seed streams (cic/mangle.c).
+
+Each side keeps a 15 nibble seed (index 1-15, index 0 unused as in
+mangle.c). Every round the lock sends bit 0 of lock seed nibbles
+restart..15 while the key sends the same nibbles of its own seed, then
+both seeds are mangled three times. The next round starts at nibble
+key[7] (1 if that is 0), and bit 0 of key[7] swaps the direction of the
+two data lines (snescic-lock.asm: btfsc 0x37, 0 / goto swap). The lock
+picks one of 16 streams by sending key[1] first (bit order 3-0-1-2).
+
+mangle() runs the routine for every row of an (N, 16) seed array at
+once: the data-dependent skip at nibble 3 becomes a per-lane offset,
+the carry-driven repeat (key[15] + 1 passes) a per-lane active mask.
+streams() runs whole rounds the same way, so all 16 stream ids times
+thousands of seeds and rounds are one array pass per step.
+mangle_ref() is a line by line port of the C routine for checking.
+
+The initial seeds are the ones in mangle.c and snescic-lock.asm. Note
+that cic/d411-seeds.txt names them from the D411's side: its "key
+seed" is LOCK_SEED here and its "lck seed" (_ = stream id) is KEY_SEED.
+
+check compares the vectorized model with mangle_ref() on random seeds
+and, when a C compiler is available (or --mangle names a built binary),
+with the D0/D1 lines mangle.c prints for every stream id.
+
+Usage:
+    cicstream.py streams [--stream 0xe] [--rounds 16] [--format compact|mangle]
+    cicstream.py streams --all --rounds 1000 -o streams.txt
+    cicstream.py check [--seeds 10000] [--rounds 64] [--mangle ./mangle]
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+MANGLE_C = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cic", "mangle.c")
+
+LOCK_SEED = (0x0, 0xB, 0x1, 0x4, 0xF, 0x4, 0xB, 0x5, 0x7, 0xF, 0xD, 0x6, 0x1, 0xE, 0x9, 0x8)
+KEY_SEED = (0x0, 0x0, 0x9, 0xA, 0x1, 0x8, 0x5, 0xF, 0x1, 0x1, 0xE, 0x1, 0x0, 0xD, 0xE, 0xC)
+
+MANGLES_PER_ROUND = 3
+RESTART_NIBBLE = 7
+
+LABELS = ("LockOutKeyIn", "LockInKeyOut")
+
+
+def parse_seed(text, stream=0):
+    """16-entry seed from 15 hex nibbles ('_' is the stream id)."""
+    text = text.strip().replace(" ", "")
+    if len(text) != 15:
+        raise ValueError(f"seed '{text}' is not 15 nibbles")
+    return [0] + [stream if c == "_" else int(c, 16) for c in text]
+
+
+def mangle_ref(data):
+    """cic/mangle.c mangle(), one seed (list of 16 nibbles), in place."""
+    a = data[0xF]
+    while True:
+        x = a
+        offset = 1
+        a = (a + data[offset] + 1) & 0xFF
+        data[offset] = a & 0xF
+        a = data[offset]
+        offset += 1
+        a = (a + data[offset] + 1) & 0xFF
+        a = ~a & 0xF
+        a, data[offset] = data[offset], a
+        offset += 1
+        a = (a + data[offset] + 1) & 0xFF
+        if a < 0x10:
+            a, data[offset] = data[offset], a & 0xF
+            offset += 1
+        a = (a + data[offset]) & 0xFF
+        data[offset] = a & 0xF
+        a = data[offset]
+        offset += 1
+        t = (a + data[offset]) & 0xFF
+        a, data[offset] = data[offset], t & 0xF
+        offset += 1
+        a += 8
+        if a < 0x10:
+            a = (a + data[offset]) & 0xFF
+        a, data[offset] = data[offset], a & 0xF
+        offset += 1
+        while offset < 0x10:
+            a = (a + 1 + data[offset]) & 0xFF
+            data[offset] = a & 0xF
+            a = data[offset]
+            offset += 1
+        a = x + 0xF
+        if a <= 0xF:
+            return data
+        a &= 0xF
+
+
+def mangle(seeds):
+    """mangle() on every row of an (N, 16) nibble array. Returns a new array."""
+    data = np.array(seeds, dtype=np.int16)
+    n = len(data)
+    rows = np.arange(n)
+    a = data[:, 0xF].copy()
+    active = np.ones(n, dtype=bool)
+    while active.any():
+        d = data.copy()
+        x = a
+        a = (x + d[:, 1] + 1) & 0xF
+        d[:, 1] = a
+        t = ~(a + d[:, 2] + 1) & 0xF
+        a = data[:, 2]
+        d[:, 2] = t
+        a = a + d[:, 3] + 1
+        small = a < 0x10
+        d[:, 3] = np.where(small, a & 0xF, d[:, 3])
+        a = np.where(small, data[:, 3], a)
+        off = np.where(small, 4, 3)
+
+        a = (a + d[rows, off]) & 0xF
+        d[rows, off] = a
+        off = off + 1
+        v = d[rows, off]
+        d[rows, off] = (a + v) & 0xF
+        a = v + 8
+        off = off + 1
+        v = d[rows, off]
+        d[rows, off] = np.where(a < 0x10, a + v, a) & 0xF
+        a = v
+        # the last nibble written was 5 or 6, the rest is one pass over 6-15
+        for pos in range(6, 0x10):
+            nxt = (a + 1 + d[:, pos]) & 0xF
+            if pos == 6:
+                nxt = np.where(off < 6, nxt, d[:, 6])
+                d[:, 6] = nxt
+                a = np.where(off < 6, nxt, a)
+                continue
+            d[:, pos] = nxt
+            a = nxt
+
+        data = np.where(active[:, None], d, data)
+        carry = x + 0xF > 0xF
+        a = np.where(active, (x + 0xF) & 0xF, a)
+        active &= carry
+    return data.astype(np.uint8)
+
+
+def streams(lock, key, rounds):
+    """Simulate rounds of the exchange for every lane of (N, 16) lock/key seeds.
+
+    Returns (restart, swap, lock_bits, key_bits): restart and swap are
+    (N, rounds); the bit arrays are (N, rounds, 16) with -1 for nibbles
+    before restart (and for index 0).
+    """
+    lock = np.array(lock, dtype=np.uint8)
+    key = np.array(key, dtype=np.uint8)
+    n = len(lock)
+    restart = np.ones((n, rounds), dtype=np.uint8)
+    swap = np.zeros((n, rounds), dtype=bool)
+    lock_bits = np.empty((n, rounds, 16), dtype=np.int8)
+    key_bits = np.empty((n, rounds, 16), dtype=np.int8)
+    pos = np.arange(16)
+    cur_restart = np.ones(n, dtype=np.uint8)
+    cur_swap = np.zeros(n, dtype=bool)
+    for r in range(rounds):
+        sent = pos[None, :] >= cur_restart[:, None]
+        restart[:, r] = cur_restart
+        swap[:, r] = cur_swap
+        lock_bits[:, r] = np.where(sent, lock & 1, -1)
+        key_bits[:, r] = np.where(sent, key & 1, -1)
+        both = np.vstack((lock, key))
+        for _ in range(MANGLES_PER_ROUND):
+            both = mangle(both)
+        lock, key = both[:n], both[n:]
+        nxt = key[:, RESTART_NIBBLE]
+        cur_swap = (nxt & 1).astype(bool)
+        cur_restart = np.where(nxt == 0, 1, nxt).astype(np.uint8)
+    return restart, swap, lock_bits, key_bits
+
+
+def stream_lanes(ids, lock_seed=LOCK_SEED, key_seed=KEY_SEED):
+    """(lock, key) arrays with one lane per stream id."""
+    lock = np.tile(np.array(lock_seed, dtype=np.uint8), (len(ids), 1))
+    key = np.tile(np.array(key_seed, dtype=np.uint8), (len(ids), 1))
+    key[:, 1] = ids
+    return lock, key
+
+
+def _bits(row, sep=""):
+    return sep.join(str(b) for b in row if b >= 0)
+
+
+def format_mangle(restart, swap, lock_bits, key_bits):
+    """The D0/D1 lines mangle.c prints for one lane."""
+    lines = []
+    for r in range(len(restart)):
+        d0, d1 = (key_bits[r], lock_bits[r]) if swap[r] else (lock_bits[r], key_bits[r])
+        labels = LABELS[::-1] if swap[r] else LABELS
+        lines.append(f"D0[{labels[0]}]: {_bits(d0, ' ')} ")
+        lines.append(f"D1[{labels[1]}]: {_bits(d1, ' ')} ")
+    return lines
+
+
+def format_compact(stream, restart, swap, lock_bits, key_bits):
+    """One line per round: stream round restart direction lock-bits key-bits."""
+    return [f"{stream:X} {r:5d} {restart[r]:X} {'S' if swap[r] else '-'} {_bits(lock_bits[r])} {_bits(key_bits[r])}"
+            for r in range(len(restart))]
+
+
+def run_mangle_c(binary, stream, rounds):
+    """D0/D1 lines from a mangle.c binary (it never stops, so it is killed after enough)."""
+    proc = subprocess.Popen([binary, str(stream)], stdout=subprocess.PIPE, text=True)
+    lines = []
+    try:
+        for line in proc.stdout:
+            if line.startswith(("D0[", "D1[")):
+                lines.append(line.rstrip("\n"))
+                if len(lines) == 2 * rounds:
+                    break
+    finally:
+        proc.kill()
+        proc.wait()
+    return lines
+
+
+def build_mangle_c(tmpdir):
+    """Compile cic/mangle.c, or return None without a compiler."""
+    cc = shutil.which("cc") or shutil.which("gcc") or shutil.which("clang")
+    if cc is None:
+        return None
+    out = os.path.join(tmpdir, "mangle")
+    # mangle.c predates C99 (no stdlib.h for strtol, unsigned char labels)
+    res = subprocess.run([cc, "-w", "-include", "stdlib.h", "-o", out, MANGLE_C], capture_output=True)
+    if res.returncode != 0:
+        res = subprocess.run([cc, "-w", "-fpermissive", "-include", "stdlib.h", "-o", out, MANGLE_C],
+                             capture_output=True)
+    return out if res.returncode == 0 else None
+
+
+def check(n_seeds, rounds, binary=None, seed=1):
+    """Cross-check the model. Returns a list of problems (empty when all agree)."""
+    problems = []
+    rng = np.random.default_rng(seed)
+    seeds = rng.integers(0, 16, (n_seeds, 16), dtype=np.uint8)
+    seeds[:, 0] = 0
+    t0 = time.perf_counter()
+    vec = mangle(seeds)
+    elapsed = time.perf_counter() - t0
+    for i in range(n_seeds):
+        ref = mangle_ref([int(v) for v in seeds[i]])
+        if list(vec[i]) != ref:
+            problems.append(f"mangle differs for seed {''.join(f'{v:x}' for v in seeds[i][1:])}")
+            if len(problems) >= 10:
+                break
+    print(f"mangle: {n_seeds} random seeds, {n_seeds / max(elapsed, 1e-9):.0f} seeds/s vectorized")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        binary = binary or build_mangle_c(tmp)
+        if binary is None:
+            print("no C compiler, mangle.c stream comparison skipped")
+            return problems
+        ids = np.arange(16)
+        res = streams(*stream_lanes(ids), rounds)
+        for sid in ids:
+            expect = run_mangle_c(binary, int(sid), rounds)
+            got = format_mangle(*(arr[sid] for arr in res))
+            if [l.rstrip() for l in expect] != [l.rstrip() for l in got]:
+                first = next(i for i, (e, g) in enumerate(zip(expect, got)) if e.rstrip() != g.rstrip())
+                problems.append(f"stream {sid:X}: mangle.c differs at round {first // 2}")
+        print(f"mangle.c: 16 streams x {rounds} rounds compared")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized CIC seed stream model.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("streams", help="print the expected D0/D1 bit streams")
+    p.add_argument("--stream", type=lambda s: int(s, 0), default=0, help="stream id sent by the lock (0-15)")
+    p.add_argument("--all", action="store_true", help="all 16 stream ids")
+    p.add_argument("--rounds", type=int, default=16)
+    p.add_argument("--lock", help="lock seed, 15 hex nibbles")
+    p.add_argument("--key", help="key seed, 15 hex nibbles ('_' for the stream id)")
+    p.add_argument("--format", choices=("compact", "mangle"), default="compact")
+    p.add_argument("-o", "--output", help="write to a file instead of stdout")
+    p = sub.add_parser("check", help="cross-check against mangle_ref() and mangle.c")
+    p.add_argument("--seeds", type=int, default=10000, help="random seeds for the mangle check")
+    p.add_argument("--rounds", type=int, default=64)
+    p.add_argument("--mangle", help="mangle.c binary (default: compile cic/mangle.c)")
+    args = parser.parse_args()
+
+    if args.cmd == "check":
+        problems = check(args.seeds, args.rounds, args.mangle)
+        for line in problems:
+            print(f"  {line}")
+        print("OK" if not problems else f"{len(problems)} mismatches")
+        sys.exit(1 if problems else 0)
+
+    if not 0 <= args.stream <= 15:
+        parser.error("stream id must be 0-15")
+    ids = np.arange(16) if args.all else np.array([args.stream])
+    try:
+        lock_seed = parse_seed(args.lock) if args.lock else LOCK_SEED
+        key_seed = parse_seed(args.key) if args.key else KEY_SEED
+    except ValueError as e:
+        parser.error(str(e))
+    t0 = time.perf_counter()
+    res = streams(*stream_lanes(ids, lock_seed, key_seed), args.rounds)
+    elapsed = time.perf_counter() - t0
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for lane, sid in enumerate(ids):
+            lane_res = [arr[lane] for arr in res]
+            lines = format_mangle(*lane_res) if args.format == "mangle" else format_compact(int(sid), *lane_res)
+            out.write("\n".join(lines) + "\n")
+    finally:
+        if args.output:
+            out.close()
+    print(f"{len(ids)} streams x {args.rounds} rounds in {elapsed:.3f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Structured 65816 decoding and code discovery on top of compare_wram's
+opcode table.
+
+compare_wram.disasm_line() produces text for side-by-side diffs; the
+analysis tools need the decoded fields instead (mode, operand value,
+M/X width at that point) and need to know which bytes are actually
+reachable code. explore() follows branches, jumps and calls from a set of
+root offsets, tracking REP/SEP and PHP/PLP, and returns every decoded
+instruction plus the basic block leaders.
+
+Usage:
+    disasm65.py menu.bin [--labels snes-64tass/menu.labels] [--map menu] [--from SYMBOL]
+                         [--regions regions.json]
+"""
+
+import argparse
+from collections import namedtuple
+
+from compare_wram import OPCODES as _OPCODES
+
+# compare_wram lists STX/LDX dp,Y as dp,X
+OPCODES = dict(_OPCODES)
+OPCODES[0x96] = ("STX", 2, "dpy")
+OPCODES[0xB6] = ("LDX", 2, "dpy")
+
+# (mnemonic, mode) -> opcode
+FORMS = {(mnem, mode): op for op, (mnem, size, mode) in OPCODES.items()}
+
+A_IMM = frozenset((0x09, 0x29, 0x49, 0x69, 0x89, 0xA9, 0xC9, 0xE9))
+X_IMM = frozenset((0xA0, 0xA2, 0xC0, 0xE0))
+
+COND_BRANCHES = frozenset((0x10, 0x30, 0x50, 0x70, 0x90, 0xB0, 0xD0, 0xF0))
+BRANCHES = COND_BRANCHES | {0x80, 0x82}
+JUMPS = frozenset((0x4C, 0x5C))                  # JMP abs, JML long
+INDIRECT_JUMPS = frozenset((0x6C, 0x7C, 0xDC))   # JMP (abs), JMP (abs,X), JML [abs]
+CALLS = frozenset((0x20, 0x22))                  # JSR abs, JSL long
+INDIRECT_CALLS = frozenset((0xFC,))              # JSR (abs,X)
+RETURNS = frozenset((0x40, 0x60, 0x6B))          # RTI, RTS, RTL
+STOPS = frozenset((0x00, 0x02, 0x42, 0xDB))      # BRK, COP, WDM, STP
+
+# instructions after which execution does not fall through
+TERMINATORS = (BRANCHES - COND_BRANCHES) | JUMPS | INDIRECT_JUMPS | RETURNS | STOPS
+
+Insn = namedtuple("Insn", "offset opcode mnem mode size operand m_flag x_flag")
+
+
+def decode(data, offset, m_flag=True, x_flag=True):
+    """Decode one instruction. Returns an Insn, or None past the end of data."""
+    if offset >= len(data):
+        return None
+    opcode = data[offset]
+    mnem, size, mode = OPCODES[opcode]
+    if (opcode in A_IMM and not m_flag) or (opcode in X_IMM and not x_flag):
+        size = 3
+    if offset + size > len(data):
+        return None
+    operand = 0
+    for i in range(size - 1, 0, -1):
+        operand = (operand << 8) | data[offset + i]
+    return Insn(offset, opcode, mnem, mode, size, operand, m_flag, x_flag)
+
+
+def next_flags(insn, m_flag, x_flag):
+    """M/X flags after a REP/SEP (other instructions leave them alone)."""
+    if insn.opcode == 0xC2:
+        m_flag = m_flag and not (insn.operand & 0x20)
+        x_flag = x_flag and not (insn.operand & 0x10)
+    elif insn.opcode == 0xE2:
+        m_flag = m_flag or bool(insn.operand & 0x20)
+        x_flag = x_flag or bool(insn.operand & 0x10)
+    return m_flag, x_flag
+
+
+def linear_sweep(data, start, end, m_flag=True, x_flag=True):
+    """Decode start..end in order, tracking REP/SEP like disasm_block()."""
+    insns = []
+    pos = start
+    while pos < end:
+        insn = decode(data, pos, m_flag, x_flag)
+        if insn is None:
+            break
+        insns.append(insn)
+        m_flag, x_flag = next_flags(insn, m_flag, x_flag)
+        pos += insn.size
+    return insns
+
+
+def branch_target(insn, pc):
+    """Target address of a relative branch at address pc."""
+    if insn.mode == "rel8":
+        rel = insn.operand - 0x100 if insn.operand & 0x80 else insn.operand
+        return (pc & 0xFF0000) | ((pc + 2 + rel) & 0xFFFF)
+    rel = insn.operand - 0x10000 if insn.operand & 0x8000 else insn.operand
+    return (pc & 0xFF0000) | ((pc + 3 + rel) & 0xFFFF)
+
+
+def flow_targets(insn, pc):
+    """Statically known control-flow target address (branch/jump/call), or None."""
+    if insn.opcode in BRANCHES:
+        return branch_target(insn, pc)
+    if insn.opcode in (0x4C, 0x20):
+        return (pc & 0xFF0000) | insn.operand
+    if insn.opcode in (0x5C, 0x22):
+        return insn.operand
+    return None
+
+
+def text(insn, pc=None):
+    """Assembler text for an instruction (branch targets need pc)."""
+    m, mode, v = insn.mnem, insn.mode, insn.operand
+    if insn.size == 1:
+        return m if mode != "acc" else f"{m} A"
+    if mode in ("rel8", "rel16"):
+        return f"{m} ${branch_target(insn, pc or 0):06X}" if pc is not None else f"{m} *{v:+d}"
+    if mode == "blockmv":
+        # WDC byte order is dst, src; 64tass syntax is src, dst
+        return f"{m} ${v >> 8:02X}, ${v & 0xFF:02X}"
+    if mode in ("imm", "imm8"):
+        return f"{m} #${v:0{2 * (insn.size - 1)}X}"
+    digits = 2 * (insn.size - 1)
+    fmt = {
+        "dp": "${:0%dX}", "abs": "${:0%dX}", "long": "${:0%dX}",
+        "dpx": "${:0%dX},X", "dpy": "${:0%dX},Y", "absx": "${:0%dX},X",
+        "absy": "${:0%dX},Y", "longx": "${:0%dX},X", "sr": "${:0%dX},S",
+        "dpi": "(${:0%dX})", "dpxi": "(${:0%dX},X)", "dpiy": "(${:0%dX}),Y",
+        "dpil": "[${:0%dX}]", "dpily": "[${:0%dX}],Y", "sriy": "(${:0%dX},S),Y",
+        "absi": "(${:0%dX})", "absxi": "(${:0%dX},X)", "absil": "[${:0%dX}]",
+    }.get(mode, "${:0%dX}") % digits
+    return f"{m} " + fmt.format(v)
+
+
+class CodeMap:
+    """Result of explore(): decoded instructions keyed by image offset."""
+
+    def __init__(self):
+        self.insns = {}
+        self.leaders = set()
+        self.calls = {}          # call site offset -> target offset
+        self.edges = {}          # block leader -> set of successor leaders
+        self.conflicts = set()   # offsets reached with different M/X flags
+
+    def blocks(self):
+        """Yield (leader, [Insn, ...]) for each basic block in offset order."""
+        for leader in sorted(self.leaders):
+            if leader not in self.insns:
+                continue
+            block = []
+            pos = leader
+            while pos in self.insns:
+                insn = self.insns[pos]
+                block.append(insn)
+                pos += insn.size
+                if insn.opcode in TERMINATORS or insn.opcode in COND_BRANCHES or pos in self.leaders:
+                    break
+            yield leader, block
+
+
+def explore(data, roots, mapper, m_flag=True, x_flag=False, follow_calls=True):
+    """Recursive-descent code discovery.
+
+    roots are image offsets (or (offset, m_flag, x_flag) tuples). mapper
+    is a snesmap mapper used to turn offsets into PCs and targets back
+    into offsets; targets outside the image are ignored. Decoding stops
+    at BRK/COP/WDM/STP, which usually means a data label was taken for
+    code. Calls are assumed to preserve M/X.
+    """
+    cm = CodeMap()
+    # roots are taken in order, each one only after everything reachable
+    # from the previous ones, so flags propagated along real control flow
+    # win over the defaults a bare label root gets
+    seeds = [(r, m_flag, x_flag, ()) if isinstance(r, int) else (r[0], r[1], r[2], ())
+             for r in reversed(list(roots))]
+    work = []
+    seen = {}
+    size = len(data)
+
+    def target_offset(addr):
+        off = int(mapper.to_offset(addr))
+        return off if 0 <= off < size else None
+
+    while work or seeds:
+        pos, m, x, pstack = work.pop() if work else seeds.pop()
+        if pos in seen:
+            if seen[pos] != (m, x):
+                cm.conflicts.add(pos)
+            continue
+        cm.leaders.add(pos)
+        while True:
+            if pos in seen:
+                if seen[pos] != (m, x):
+                    cm.conflicts.add(pos)
+                cm.leaders.add(pos)
+                break
+            insn = decode(data, pos, m, x)
+            if insn is None or insn.opcode in STOPS:
+                break
+            seen[pos] = (m, x)
+            cm.insns[pos] = insn
+            op = insn.opcode
+            if op == 0x08:
+                pstack = pstack + ((m, x),)
+            elif op == 0x28:
+                if pstack:
+                    (m, x), pstack = pstack[-1], pstack[:-1]
+            else:
+                m, x = next_flags(insn, m, x)
+            target = None
+            if op in BRANCHES or op in JUMPS or op in CALLS:
+                pc = int(mapper.to_address(pos))
+                target = flow_targets(insn, pc) if pc >= 0 else None
+            if op in CALLS:
+                toff = target_offset(target) if target is not None else None
+                if toff is not None:
+                    cm.calls[pos] = toff
+                    if follow_calls:
+                        work.append((toff, m, x, ()))
+            elif target is not None:
+                toff = target_offset(target)
+                if toff is not None:
+                    work.append((toff, m, x, pstack))
+                    cm.leaders.add(toff)
+            nxt = pos + insn.size
+            if op in TERMINATORS:
+                break
+            if op in COND_BRANCHES:
+                work.append((nxt, m, x, pstack))
+                cm.leaders.add(nxt)
+                break
+            pos = nxt
+    cm.edges = _block_edges(cm, mapper, size)
+    return cm
+
+
+def _block_edges(cm, mapper, size):
+    edges = {}
+    for leader, block in cm.blocks():
+        last = block[-1]
+        succ = set()
+        nxt = last.offset + last.size
+        if last.opcode not in TERMINATORS and nxt in cm.insns:
+            succ.add(nxt)
+        pc = int(mapper.to_address(last.offset))
+        target = flow_targets(last, pc) if pc >= 0 and last.opcode not in CALLS else None
+        if target is not None:
+            toff = int(mapper.to_offset(target))
+            if 0 <= toff < size and toff in cm.insns:
+                succ.add(toff)
+        edges[leader] = succ
+    return edges
+
+
+def routine_extent(cm, start):
+    """(start, end) of the code reachable from start without following calls."""
+    end = start
+    todo = [start]
+    done = set()
+    while todo:
+        leader = todo.pop()
+        if leader in done or leader not in cm.insns:
+            continue
+        done.add(leader)
+        pos = leader
+        while pos in cm.insns:
+            insn = cm.insns[pos]
+            end = max(end, pos + insn.size)
+            pos += insn.size
+            if insn.opcode in TERMINATORS or insn.opcode in COND_BRANCHES or pos in cm.leaders:
+                break
+        todo.extend(cm.edges.get(leader, ()))
+    return start, end
+
+
+def image_roots(data, mapper, symbols=None):
+    """Default roots: native/emulation vectors (8-bit M/X) plus every ROM symbol."""
+    roots = []
+    vec_base = int(mapper.to_offset(0x00FFE4))
+    if 0 <= vec_base and vec_base + 0x1C <= len(data):
+        for i in range(0, 0x1C, 2):
+            vec = data[vec_base + i] | (data[vec_base + i + 1] << 8)
+            off = int(mapper.to_offset(vec))
+            if vec >= 0x8000 and 0 <= off < len(data):
+                roots.append((off, True, True))
+    if symbols is not None:
+        roots += [int(o) for o in symbols.offsets[symbols.primary()]]
+    return roots
+
+
+def main():
+    import snesmap
+    from menulabels import load_symbols
+
+    parser = argparse.ArgumentParser(description="Disassemble reachable 65816 code in an image.")
+    parser.add_argument("image")
+    parser.add_argument("--labels", help="64tass label file")
+    parser.add_argument("--map", default="menu")
+    parser.add_argument("--from", dest="start", help="only show code reachable from this symbol")
+    parser.add_argument("--regions", help="regionmap.py map: no roots inside fill/packed regions")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        data = f.read()
+    mapper = snesmap.get_mapper(args.map)
+    symbols = load_symbols(args.labels, mapper, len(data)) if args.labels else None
+    roots = image_roots(data, mapper, symbols)
+    if args.regions:
+        from regionmap import load_regions, region_mask
+        skip = region_mask(load_regions(args.regions), len(data))
+        roots = [r for r in roots if not skip[r[0] if isinstance(r, tuple) else r]]
+    if args.start:
+        roots = [symbols.offset(args.start)]
+    cm = explore(data, roots, mapper)
+    for leader, block in cm.blocks():
+        if symbols is not None:
+            name, start = symbols.lookup(leader)
+            if start == leader:
+                print(f"\n{name}:")
+        for insn in block:
+            pc = int(mapper.to_address(insn.offset))
+            raw = " ".join(f"{b:02X}" for b in data[insn.offset:insn.offset + insn.size])
+            print(f"  ${pc:06X}  {raw:<12} {text(insn, pc)}")
+    print(f"\n{len(cm.insns)} instructions, {len(cm.leaders)} blocks, {len(cm.conflicts)} M/X conflicts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,629 @@
+#!/usr/bin/env python3
+"""
+Recover every DMA/HDMA channel setup and MVN/MVP block move in a 65816
+image by constant propagation over the reachable code.
+
+compare_wram.py and compare2.py find DMA sizes by matching STX $4375 and
+peeking a few bytes back for an immediate load, which misses anything set
+up through another path. Here disasm65.explore() finds the code and a
+forward dataflow pass tracks A/X/Y (per byte), carry, DBR, D, the stack
+and constant stores through every basic block, joining states at block
+entries until nothing changes. A write to $420B/$420C then gives one
+transfer per enabled channel from the tracked $43x0-$43x6 and $2181-$2183
+values. Values that are not constant print as "?".
+
+Routines are assumed to start with DBR=$00 and D=$0000 (the menu
+convention, see --dbr/--dp). Calls clobber A/X/Y, carry and tracked
+memory; DBR, D and the stack are assumed to survive them.
+
+Copies whose source lands in the image are checked against what they
+copy: the code reachable from the source must fit ("short" otherwise)
+and the copy should stop at the next label after that code ("overrun").
+Copies into the menu's relocated WRAM routines are also checked against
+the neighbouring slots ("clobbers").
+
+Usage:
+    dmaextract.py menu.bin [--labels snes-64tass/menu.labels] [--map menu]
+    dmaextract.py game.sfc --map lorom [--dbr 80] [--from SYMBOL]
+"""
+
+import argparse
+from collections import namedtuple
+
+import disasm65
+import snesmap
+
+MDMAEN = 0x420B
+HDMAEN = 0x420C
+WMADD = 0x2181            # $2181-$2183: WRAM address for WMDATA
+WMDATA = 0x80             # B-bus address of $2180
+DMA_REGS = range(0x4300, 0x4380)
+
+# DMA modes that only ever write the first B-bus register
+SINGLE_REG_MODES = (0, 2, 6)
+
+Transfer = namedtuple("Transfer", "site offset kind channel mode bbus source size dest")
+
+_REGS = ("a", "b", "xl", "xh", "yl", "yh", "c", "dm", "dbr", "d")
+
+
+def _canon(addr):
+    """Fold register and low WRAM mirrors onto one address."""
+    addr &= 0xFFFFFF
+    bank, low = addr >> 16, addr & 0xFFFF
+    if not bank & 0x40:
+        if low < 0x2000:
+            return 0x7E0000 | low
+        if low < 0x8000:
+            return low
+    return addr
+
+
+def _readable(addr):
+    return 0x7E0000 <= addr < 0x800000 or addr in DMA_REGS
+
+
+class State:
+    """Abstract CPU state at one point; None means "not a known constant"."""
+
+    def __init__(self, dbr=0, d=0):
+        self.r = dict.fromkeys(_REGS)
+        self.r["dm"] = 0
+        self.r["dbr"] = dbr
+        self.r["d"] = d
+        self.stack = ()
+        self.mem = {}
+
+    def copy(self):
+        st = State.__new__(State)
+        st.r = dict(self.r)
+        st.stack = self.stack
+        st.mem = dict(self.mem)
+        return st
+
+    def __eq__(self, other):
+        return self.r == other.r and self.stack == other.stack and self.mem == other.mem
+
+    def join(self, other):
+        st = self.copy()
+        for k in _REGS:
+            if st.r[k] != other.r[k]:
+                st.r[k] = None
+        if len(self.stack) == len(other.stack):
+            st.stack = tuple(a if a == b else None for a, b in zip(self.stack, other.stack))
+        else:
+            st.stack = ()
+        st.mem = {k: v for k, v in self.mem.items() if other.mem.get(k) == v}
+        return st
+
+    # registers
+
+    def acc(self, wide):
+        a, b = self.r["a"], self.r["b"]
+        if not wide:
+            return a
+        return None if a is None or b is None else a | (b << 8)
+
+    def set_acc(self, value, wide):
+        self.r["a"] = None if value is None else value & 0xFF
+        if wide:
+            self.r["b"] = None if value is None else (value >> 8) & 0xFF
+
+    def index(self, reg, wide):
+        lo, hi = self.r[reg + "l"], self.r[reg + "h"]
+        if not wide:
+            return lo
+        return None if lo is None or hi is None else lo | (hi << 8)
+
+    def set_index(self, reg, value, wide):
+        if value is not None:
+            value &= 0xFFFF if wide else 0xFF
+        self.r[reg + "l"] = None if value is None else value & 0xFF
+        self.r[reg + "h"] = None if value is None else value >> 8
+
+    # memory
+
+    def load(self, addr, size, cpu=True):
+        """Tracked little-endian value; cpu=False also reads back write-only registers."""
+        value = 0
+        for i in range(size):
+            a = _canon(addr + i)
+            if (cpu and not _readable(a)) or a not in self.mem:
+                return None
+            value |= self.mem[a] << (8 * i)
+        return value
+
+    def store(self, addr, value, size):
+        """Store and return the canonical addresses written."""
+        written = []
+        for i in range(size):
+            a = _canon(addr + i)
+            if value is None:
+                self.mem.pop(a, None)
+            else:
+                self.mem[a] = (value >> (8 * i)) & 0xFF
+            written.append(a)
+        return written
+
+    def forget(self, lo, hi):
+        self.mem = {k: v for k, v in self.mem.items() if not lo <= k < hi}
+
+    # stack
+
+    def push(self, value, size):
+        for i in range(size - 1, -1, -1):
+            self.stack += (None if value is None else (value >> (8 * i)) & 0xFF,)
+
+    def pull(self, size):
+        value = 0
+        for i in range(size):
+            if not self.stack:
+                return None
+            byte, self.stack = self.stack[-1], self.stack[:-1]
+            if byte is None or value is None:
+                value = None
+            else:
+                value |= byte << (8 * i)
+        return value
+
+
+def _address(st, insn):
+    """Effective address of a direct memory operand, or None."""
+    mode, op = insn.mode, insn.operand
+    wx = not insn.x_flag
+    if mode in ("abs", "absx", "absy"):
+        if st.r["dbr"] is None:
+            return None
+        base = (st.r["dbr"] << 16) | op
+    elif mode in ("long", "longx"):
+        base = op
+    elif mode in ("dp", "dpx", "dpy"):
+        if st.r["d"] is None:
+            return None
+        base = st.r["d"] + op
+    else:
+        return None
+    if mode[-1] in "xy":
+        idx = st.index(mode[-1], wx)
+        if idx is None:
+            return None
+        base += idx
+    if mode.startswith("dp"):
+        base &= 0xFFFF
+    return base
+
+
+def _operand(st, insn, wide):
+    if insn.mode == "imm":
+        return insn.operand
+    addr = _address(st, insn)
+    return st.load(addr, 2 if wide else 1) if addr is not None else None
+
+
+def _clobber(st, insn):
+    """Forget what a store with an unresolved address may have hit."""
+    mode = insn.mode
+    if mode in ("absx", "absy", "longx") and (mode == "longx" or st.r["dbr"] is not None):
+        base = insn.operand if mode == "longx" else (st.r["dbr"] << 16) | insn.operand
+        if base >> 16 & 0x40:
+            st.forget(base, base + 0x10000)
+        else:
+            st.mem.clear()      # system area: registers and WRAM mirror
+    elif mode in ("dpi", "dpiy", "dpil", "dpily", "dpxi", "sr", "sriy"):
+        # pointer stores: assume they target WRAM buffers, not registers
+        st.forget(0x7E0000, 0x800000)
+    else:
+        st.mem.clear()
+
+
+def _store(st, insn, value, size, emit):
+    addr = _address(st, insn)
+    if addr is None:
+        _clobber(st, insn)
+        return
+    for a in st.store(addr, value, size):
+        if a == MDMAEN:
+            _start_dma(st, insn, st.mem.get(a), emit)
+        elif a == HDMAEN:
+            _start_hdma(st, insn, st.mem.get(a), emit)
+
+
+def _channel(st, ch):
+    base = 0x4300 + (ch << 4)
+    mode = st.mem.get(base)
+    bbus = st.mem.get(base + 1)
+    source = st.load(base + 2, 3)
+    return base, mode, bbus, source
+
+
+def _start_dma(st, insn, value, emit):
+    if value is None:
+        emit(insn, "dma", None, None, None, None, None, None)
+        st.forget(0x4300, 0x4380)
+        st.forget(WMADD, WMADD + 3)
+        return
+    for ch in range(8):
+        if not value & (1 << ch):
+            continue
+        base, mode, bbus, source = _channel(st, ch)
+        size = st.load(base + 5, 2)
+        if size is not None:
+            size = size or 0x10000
+        wram = st.load(WMADD, 3, cpu=False)
+        to_wram = bbus == WMDATA and mode is not None and (mode & 7) in SINGLE_REG_MODES
+        dest = 0x7E0000 | (wram & 0x1FFFF) if to_wram and wram is not None else None
+        emit(insn, "dma", ch, mode, bbus, source, size, dest)
+        # the size register counts down to 0, A1T and WMADD follow the transfer
+        st.store(base + 5, 0, 2)
+        if source is None or size is None or mode is None:
+            st.forget(base + 2, base + 4)
+        elif not mode & 0x08:
+            step = -size if mode & 0x10 else size
+            st.store(base + 2, (source + step) & 0xFFFF, 2)
+        if bbus is None or bbus == WMDATA:
+            if dest is not None and size is not None:
+                st.store(WMADD, ((wram & 0x1FFFF) + size) & 0x1FFFF, 3)
+            else:
+                st.forget(WMADD, WMADD + 3)
+
+
+def _start_hdma(st, insn, value, emit):
+    if value is None:
+        emit(insn, "hdma", None, None, None, None, None, None)
+        return
+    for ch in range(8):
+        if value & (1 << ch):
+            _, mode, bbus, source = _channel(st, ch)
+            emit(insn, "hdma", ch, mode, bbus, source, None, None)
+
+
+def _block_move(st, insn, emit):
+    dst_bank, src_bank = insn.operand & 0xFF, insn.operand >> 8
+    wx = not insn.x_flag
+    count = st.acc(True)
+    count = None if count is None else count + 1
+    x, y = st.index("x", wx), st.index("y", wx)
+    source = None if x is None else (src_bank << 16) | x
+    dest = None if y is None else (dst_bank << 16) | y
+    emit(insn, insn.mnem.lower(), None, None, None, source, count, dest)
+    if dest is not None and count is not None:
+        st.forget(_canon(dest), _canon(dest) + count)
+    else:
+        st.forget(0x7E0000, 0x800000)
+    st.set_acc(0xFFFF, True)
+    step = count if insn.mnem == "MVN" else None if count is None else -count
+    st.set_index("x", None if x is None or step is None else x + step, wx)
+    st.set_index("y", None if y is None or step is None else y + step, wx)
+    st.r["dbr"] = dst_bank
+
+
+def _alu(st, insn, wa):
+    mn = insn.mnem
+    val = _operand(st, insn, wa)
+    acc = st.acc(wa)
+    mask = 0xFFFF if wa else 0xFF
+    c = st.r["c"]
+    if mn in ("AND", "ORA", "EOR"):
+        if acc is not None and val is not None:
+            st.set_acc({"AND": acc & val, "ORA": acc | val, "EOR": acc ^ val}[mn], wa)
+        else:
+            st.set_acc(None, wa)
+        return
+    if acc is None or val is None or c is None or st.r["dm"] != 0:
+        st.set_acc(None, wa)
+        st.r["c"] = None
+        return
+    if mn == "SBC":
+        val ^= mask
+    res = acc + val + c
+    st.set_acc(res & mask, wa)
+    st.r["c"] = int(res > mask)
+
+
+def _shift(st, insn, wa):
+    mn = insn.mnem
+    if insn.mode != "acc":
+        addr = _address(st, insn)
+        if addr is None:
+            _clobber(st, insn)
+        else:
+            st.store(addr, None, 2 if wa else 1)
+        st.r["c"] = None
+        return
+    acc = st.acc(wa)
+    c = st.r["c"]
+    top = 0x8000 if wa else 0x80
+    if acc is None or (mn in ("ROL", "ROR") and c is None):
+        st.set_acc(None, wa)
+        st.r["c"] = None
+        return
+    if mn in ("ASL", "ROL"):
+        res = (acc << 1) | (c if mn == "ROL" else 0)
+        st.r["c"] = int(bool(acc & top))
+    else:
+        res = (acc >> 1) | (top if mn == "ROR" and c else 0)
+        st.r["c"] = acc & 1
+    st.set_acc(res & (top * 2 - 1), wa)
+
+
+def step(st, insn, pc, emit):
+    """Apply one instruction to st. emit(insn, kind, ...) gets transfers."""
+    mn, mode, op = insn.mnem, insn.mode, insn.operand
+    wa, wx = not insn.m_flag, not insn.x_flag
+    if mn == "LDA":
+        st.set_acc(_operand(st, insn, wa), wa)
+    elif mn in ("LDX", "LDY"):
+        st.set_index(mn[2].lower(), _operand(st, insn, wx), wx)
+    elif mn == "STA":
+        _store(st, insn, st.acc(wa), 2 if wa else 1, emit)
+    elif mn in ("STX", "STY"):
+        _store(st, insn, st.index(mn[2].lower(), wx), 2 if wx else 1, emit)
+    elif mn == "STZ":
+        _store(st, insn, 0, 2 if wa else 1, emit)
+    elif mn in ("TAX", "TAY"):
+        st.set_index(mn[2].lower(), st.acc(True) if wx else st.r["a"], wx)
+    elif mn in ("TXA", "TYA"):
+        st.set_acc(st.index(mn[1].lower(), wx), wa)
+    elif mn in ("TXY", "TYX"):
+        st.set_index(mn[2].lower(), st.index(mn[1].lower(), wx), wx)
+    elif mn in ("TSX", "TSC"):
+        if mn == "TSX":
+            st.set_index("x", None, wx)
+        else:
+            st.set_acc(None, True)
+    elif mn == "TCD":
+        st.r["d"] = st.acc(True)
+    elif mn == "TDC":
+        st.set_acc(st.r["d"], True)
+    elif mn == "XBA":
+        st.r["a"], st.r["b"] = st.r["b"], st.r["a"]
+    elif mn in ("INC", "DEC") and mode == "acc":
+        acc = st.acc(wa)
+        st.set_acc(None if acc is None else acc + (1 if mn == "INC" else -1), wa)
+    elif mn in ("INX", "INY", "DEX", "DEY"):
+        reg = mn[2].lower()
+        val = st.index(reg, wx)
+        st.set_index(reg, None if val is None else val + (1 if mn[0] == "I" else -1), wx)
+    elif mn in ("INC", "DEC", "TSB", "TRB"):
+        addr = _address(st, insn)
+        if addr is None:
+            _clobber(st, insn)
+        else:
+            st.store(addr, None, 2 if wa else 1)
+    elif mn in ("ASL", "LSR", "ROL", "ROR"):
+        _shift(st, insn, wa)
+    elif mn in ("AND", "ORA", "EOR", "ADC", "SBC"):
+        _alu(st, insn, wa)
+    elif mn in ("CMP", "CPX", "CPY"):
+        wide = wa if mn == "CMP" else wx
+        reg = st.acc(wa) if mn == "CMP" else st.index(mn[2].lower(), wx)
+        val = _operand(st, insn, wide)
+        st.r["c"] = None if reg is None or val is None else int(reg >= val)
+    elif mn in ("CLC", "SEC"):
+        st.r["c"] = int(mn == "SEC")
+    elif mn in ("CLD", "SED"):
+        st.r["dm"] = int(mn == "SED")
+    elif mn in ("REP", "SEP"):
+        bit = int(mn == "SEP")
+        if op & 0x01:
+            st.r["c"] = bit
+        if op & 0x08:
+            st.r["dm"] = bit
+        if bit and op & 0x10:
+            st.r["xh"] = st.r["yh"] = 0
+    elif mn == "XCE":
+        st.r["c"] = None
+    elif mn == "PHA":
+        st.push(st.acc(wa), 2 if wa else 1)
+    elif mn in ("PHX", "PHY"):
+        st.push(st.index(mn[2].lower(), wx), 2 if wx else 1)
+    elif mn == "PHB":
+        st.push(st.r["dbr"], 1)
+    elif mn == "PHK":
+        st.push(None if pc < 0 else pc >> 16, 1)
+    elif mn == "PHD":
+        st.push(st.r["d"], 2)
+    elif mn == "PHP":
+        st.push(None, 1)
+    elif mn == "PEA":
+        st.push(op, 2)
+    elif mn == "PEI":
+        addr = _address(st, insn)
+        st.push(st.load(addr, 2) if addr is not None else None, 2)
+    elif mn == "PER":
+        st.push(None if pc < 0 else disasm65.branch_target(insn, pc) & 0xFFFF, 2)
+    elif mn == "PLA":
+        st.set_acc(st.pull(2 if wa else 1), wa)
+    elif mn in ("PLX", "PLY"):
+        st.set_index(mn[2].lower(), st.pull(2 if wx else 1), wx)
+    elif mn == "PLB":
+        st.r["dbr"] = st.pull(1)
+    elif mn == "PLD":
+        st.r["d"] = st.pull(2)
+    elif mn == "PLP":
+        st.pull(1)
+        st.r["c"] = st.r["dm"] = None
+    elif mn in ("MVN", "MVP"):
+        _block_move(st, insn, emit)
+    elif mn in ("JSR", "JSL"):
+        for k in ("a", "b", "xl", "xh", "yl", "yh", "c"):
+            st.r[k] = None
+        st.mem.clear()
+
+
+def _pc(mapper, off):
+    """Address an image offset executes at (WRAM run address if relocated)."""
+    run = getattr(mapper, "run_address", None)
+    if run is not None:
+        addr = int(run(off))
+        if addr >= 0:
+            return addr
+    return int(mapper.to_address(off))
+
+
+def _ignore(*args):
+    pass
+
+
+def propagate(cm, mapper, entries, dbr=0, d=0):
+    """Fixpoint of the block entry states. Returns {leader: State}.
+
+    Blocks with no predecessor, and the entries (call targets, vectors),
+    start from the default state; every other block gets the join of
+    its predecessors' exit states.
+    """
+    blocks = dict(cm.blocks())
+    preds = {}
+    for src, succs in cm.edges.items():
+        for s in succs:
+            preds.setdefault(s, []).append(src)
+    state_in = {}
+    work = []
+    for leader in blocks:
+        if leader not in preds or leader in entries:
+            state_in[leader] = State(dbr, d)
+            work.append(leader)
+    pending = sorted(blocks)
+    while True:
+        while work:
+            leader = work.pop()
+            st = state_in[leader].copy()
+            for insn in blocks[leader]:
+                step(st, insn, _pc(mapper, insn.offset), _ignore)
+            for s in cm.edges.get(leader, ()):
+                if s not in blocks:
+                    continue
+                old = state_in.get(s)
+                new = st if old is None else old.join(st)
+                if old is None or new != old:
+                    state_in[s] = new
+                    work.append(s)
+        # loops only entered through blocks we never reached
+        while pending and pending[-1] in state_in:
+            pending.pop()
+        if not pending:
+            return state_in
+        leader = pending.pop()
+        state_in[leader] = State(dbr, d)
+        work.append(leader)
+
+
+def extract(data, mapper, roots, dbr=0, d=0):
+    """Return (CodeMap, [Transfer, ...]) for the code reachable from roots."""
+    cm = disasm65.explore(data, roots, mapper)
+    entries = set(cm.calls.values())
+    entries.update(r if isinstance(r, int) else r[0] for r in roots)
+    state_in = propagate(cm, mapper, entries, dbr, d)
+    transfers = []
+
+    def emit(insn, kind, channel, mode, bbus, source, size, dest):
+        site = _pc(mapper, insn.offset)
+        transfers.append(Transfer(site, insn.offset, kind, channel, mode, bbus, source, size, dest))
+
+    for leader, block in cm.blocks():
+        st = state_in[leader].copy()
+        for insn in block:
+            step(st, insn, _pc(mapper, insn.offset), emit)
+    return cm, transfers
+
+
+def check_copy(t, data, cm, mapper, symbols=None):
+    """Check a transfer's source against the routine/data it copies.
+
+    Returns (status, source offset, code end, label limit) or None when
+    the source is not in the image or the transfer is not a plain copy.
+    status is "ok", "short", "overrun" or "clobbers $xxxxxx".
+    """
+    if t.source is None or t.size is None:
+        return None
+    if t.kind == "dma" and (t.mode is None or t.mode & 0x88):
+        return None         # B->A or fixed-source fill
+    if t.kind == "hdma":
+        return None
+    off = int(mapper.to_offset(t.source))
+    if not 0 <= off < len(data):
+        return None
+    code_end = disasm65.routine_extent(cm, off)[1] if off in cm.insns else None
+    limit = None
+    if symbols is not None and len(symbols):
+        if code_end is not None:
+            i = int(symbols.offsets.searchsorted(code_end, side="left"))
+            limit = int(symbols.offsets[i]) if i < len(symbols) else symbols.image_size
+        else:
+            i = symbols.resolve(off)
+            limit = int(symbols.ends[i]) if i >= 0 else None
+    end = off + t.size
+    status = "ok"
+    if code_end is not None and end < code_end:
+        status = "short"
+    elif limit is not None and end > limit:
+        status = "overrun"
+    if t.dest is not None:
+        for start, stop, _ in getattr(mapper, "relocations", ()):
+            if t.dest < stop and t.dest + t.size > start and not start <= t.dest < stop:
+                status = f"clobbers ${start:06X}"
+    return status, off, code_end, limit
+
+
+def _fmt(value, digits):
+    return "?" if value is None else f"${value:0{digits}X}"
+
+
+def describe(t):
+    """One-line text for a transfer."""
+    if t.kind in ("mvn", "mvp"):
+        return f"{t.kind.upper()}     {_fmt(t.source, 6)} -> {_fmt(t.dest, 6)}  size {_fmt(t.size, 4)}"
+    name = t.kind.upper() + ("?" if t.channel is None else str(t.channel))
+    if t.channel is None:
+        return f"{name:<7} enable value unknown"
+    text = f"{name:<7} mode {_fmt(t.mode, 2)} B $21{_fmt(t.bbus, 2)[1:]}"
+    if t.kind == "hdma":
+        return text + f"  table {_fmt(t.source, 6)}"
+    text += f"  src {_fmt(t.source, 6)}  size {_fmt(t.size, 4)}"
+    if t.dest is not None:
+        text += f" -> {_fmt(t.dest, 6)}"
+    return text
+
+
+def main():
+    from menulabels import label_widths, load_labels, rom_symbols
+
+    parser = argparse.ArgumentParser(description="List DMA/HDMA setups and block moves in 65816 images.")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--labels", help="64tass label file")
+    parser.add_argument("--map", default="menu", help="memory map (" + ", ".join(snesmap.MAPPERS) + ")")
+    parser.add_argument("--dbr", type=lambda s: int(s, 16), default=0, help="DBR at routine entry (hex)")
+    parser.add_argument("--dp", type=lambda s: int(s, 16), default=0, help="D at routine entry (hex)")
+    parser.add_argument("--from", dest="start", help="only follow code reachable from this symbol")
+    args = parser.parse_args()
+
+    labels = load_labels(args.labels) if args.labels else {}
+    mapper = snesmap.get_mapper(args.map, labels)
+    for path in args.images:
+        with open(path, "rb") as f:
+            data = f.read()
+        symbols = rom_symbols(labels, mapper, len(data), label_widths(args.labels)) if labels else None
+        if args.start:
+            roots = [symbols.offset(args.start)]
+        else:
+            roots = disasm65.image_roots(data, mapper, symbols)
+        cm, transfers = extract(data, mapper, roots, args.dbr, args.dp)
+
+        print(f"{path}: {len(cm.insns)} instructions, {len(transfers)} transfers")
+        for t in transfers:
+            where = symbols.format(t.offset) if symbols is not None else f"${t.offset:06X}"
+            print(f"  ${t.site:06X}  {where:<32} {describe(t)}")
+            check = check_copy(t, data, cm, mapper, symbols)
+            if check is not None:
+                status, off, code_end, limit = check
+                what = symbols.format(off) if symbols is not None else f"${off:06X}"
+                sizes = []
+                if code_end is not None:
+                    sizes.append(f"code ${code_end - off:X}")
+                if limit is not None:
+                    sizes.append(f"label ${limit - off:X}")
+                print(f"          copies {what} ({', '.join(sizes) or 'no extent'}): {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Suggest which WRAM variables should live in direct page.
+
+With D = $0000 the menu reaches $0000-$00FF with dp addressing, which is
+a byte shorter and a cycle faster than absolute (two of each against
+long): compare3.py's LDX $31 for cur_bright against the original
+LDX $041C. Direct page is full of labels already (bar_wl, dirent_bank,
+recent_sel, ...), so moving something in usually means moving something
+out.
+
+Every decoded instruction (disasm65.explore, or the insns of an
+analysisdb.py build) that addresses low WRAM is attributed to the
+variable label it falls in (4-digit labels and $7E0000-$7E1FFF). A
+variable's value is what its sites gain in direct page over the
+absolute form: bytes per site, cycles per execution. With --trace the
+cycles are weighted by how often each site ran (traceprof.py's PC
+counts), otherwise every site counts once. Variables used through a dp
+mode with no absolute form ((dp),Y, [dp], STX dp,Y, ...) and direct
+page labels no decoded code touches stay where they are.
+
+The rest are chosen by a 0/1 knapsack over the free direct page bytes,
+best --objective first, then kept at their current address where they
+already are and placed first-fit otherwise. Sizes come from the widest
+access (indexed variables: the distance to the next label, up to
+--max-size). Variables already in direct page never extend past $FF.
+
+Indexed reads with an 8-bit index are counted as cycle-neutral
+(abs,X only costs more on a page crossing), and absolute operands
+are assumed to reach WRAM (DB in $00-$3F/$7E).
+
+Usage:
+    dpalloc.py menu.bin [--labels snes-64tass/menu.labels] [--trace trace.log.gz] [--objective cycles|bytes]
+    dpalloc.py menu.bin --db analysis.db [--reserve 00-0f] [--pin stringbuf] [--max-size 32] [--all]
+"""
+
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+import disasm65
+import snesmap
+from analysisdb import WRITES, run_addresses
+from menulabels import DEFAULT_LABELS, label_widths, load_labels, rom_symbols
+
+DP_SIZE = 0x100
+LOW_WRAM = 0x2000
+LAST_GAP = 0x100
+
+# absolute <-> direct page forms of the same instruction
+_MODE_PAIRS = {"abs": "dp", "absx": "dpx", "absy": "dpy", "long": "dp", "longx": "dpx",
+               "dp": "abs", "dpx": "absx", "dpy": "absy"}
+_NOT_DATA = frozenset(("JMP", "JML", "JSR", "JSL", "PEA"))
+COUNTERPART = {op: disasm65.FORMS[(mnem, _MODE_PAIRS[mode])] for op, (mnem, size, mode) in disasm65.OPCODES.items()
+               if mode in _MODE_PAIRS and mnem not in _NOT_DATA and (mnem, _MODE_PAIRS[mode]) in disasm65.FORMS}
+DP_MODES = frozenset(("dp", "dpx", "dpy", "dpi", "dpxi", "dpiy", "dpil", "dpily"))
+ABS_MODES = frozenset(("abs", "absx", "absy", "long", "longx"))
+POINTER_WIDTHS = {"dpi": 2, "dpxi": 2, "dpiy": 2, "dpil": 3, "dpily": 3}
+INDEX_REGS = frozenset(("LDX", "LDY", "STX", "STY", "CPX", "CPY"))
+
+Site = namedtuple("Site", "offset address opcode mnem mode operand m_flag x_flag")
+Variable = namedtuple("Variable", "name address size current sites pinned gain_bytes gain_cycles")
+
+
+def code_sites(data, mapper, symbols=None):
+    """Decoded instructions of an image as Sites (recursive descent from vectors and symbols)."""
+    cm = disasm65.explore(data, disasm65.image_roots(data, mapper, symbols), mapper)
+    offsets = sorted(cm.insns)
+    addresses = run_addresses(mapper, offsets)
+    sites = []
+    for off, addr in zip(offsets, addresses):
+        insn = cm.insns[off]
+        sites.append(Site(off, int(addr), insn.opcode, insn.mnem, insn.mode, insn.operand,
+                          insn.m_flag, insn.x_flag))
+    return sites
+
+
+def db_sites(db, key):
+    """Sites from the insns table of a build stored by analysisdb.py."""
+    rows = db.conn.execute("SELECT offset, address, opcode, operand, m_flag, x_flag FROM insns "
+                           "WHERE image_id = ? ORDER BY offset", (db.image_id(key),)).fetchall()
+    return [Site(off, addr, op, disasm65.OPCODES[op][0], disasm65.OPCODES[op][2], operand, bool(m), bool(x))
+            for off, addr, op, operand, m, x in rows]
+
+
+def wram_target(site):
+    """Low WRAM address a data access reaches (D = $0000), or None."""
+    if site.mnem in _NOT_DATA:
+        return None
+    if site.mode in DP_MODES:
+        return site.operand & 0xFF
+    if site.mode in ("abs", "absx", "absy"):
+        addr = site.operand
+    elif site.mode in ("long", "longx"):
+        bank = site.operand >> 16
+        if not (bank == 0x7E or (bank & 0x7F) < 0x40):
+            return None
+        addr = site.operand & 0xFFFF
+    else:
+        return None
+    return addr if addr < LOW_WRAM else None
+
+
+def site_gain(site):
+    """(bytes, cycles) the site is cheaper at when its variable is in direct page; None if it must stay there."""
+    if site.opcode not in COUNTERPART:
+        return None if site.mode in DP_MODES else (0, 0)
+    mode = site.mode if site.mode in ABS_MODES else _MODE_PAIRS[site.mode]
+    if mode in ("long", "longx"):
+        return 2, 2 if mode == "long" else 1
+    if mode == "abs":
+        return 1, 1
+    # abs,X / abs,Y: one more cycle than dp,X for stores, read-modify-write and 16-bit index registers
+    return 1, int(site.mnem in WRITES or not site.x_flag)
+
+
+def access_width(site):
+    if site.mode in POINTER_WIDTHS:
+        return POINTER_WIDTHS[site.mode]
+    flag = site.x_flag if site.mnem in INDEX_REGS else site.m_flag
+    return 1 if flag else 2
+
+
+def wram_variables(labels, widths):
+    """Sorted [(address, name)] of low WRAM variable labels."""
+    out = []
+    for name, value in labels.items():
+        width = widths.get(name)
+        if width == 4 and value < LOW_WRAM:
+            out.append((value, name))
+        elif width == 6 and 0x7E0000 <= value < 0x7E0000 + LOW_WRAM:
+            out.append((value & 0xFFFF, name))
+    out.sort()
+    # one name per address, the first in sort order
+    return [v for i, v in enumerate(out) if i == 0 or v[0] != out[i - 1][0]]
+
+
+def collect(sites, variables, counts=None, max_size=32, pinned_names=()):
+    """Variables with the direct page gain of their sites.
+
+    counts maps image offsets to execution counts; without it every site
+    counts once.
+    """
+    starts = np.array([a for a, _ in variables] + [variables[-1][0] + LAST_GAP], dtype=np.int64)
+    per_var = {}
+    for site in sites:
+        addr = wram_target(site)
+        if addr is None:
+            continue
+        i = int(np.searchsorted(starts, addr, side="right")) - 1
+        if i < 0 or i >= len(variables):
+            continue
+        per_var.setdefault(i, []).append((site, addr - int(starts[i])))
+
+    out = []
+    for i, (start, name) in enumerate(variables):
+        gap = int(starts[i + 1]) - start
+        current = start < DP_SIZE
+        used = per_var.get(i, [])
+        pinned = name in pinned_names or (current and not used)
+        indexed = False
+        extent = 0
+        gain_bytes = gain_cycles = 0
+        for site, rel in used:
+            extent = max(extent, rel + access_width(site))
+            gain = site_gain(site)
+            if gain is None:
+                pinned = True
+                continue
+            indexed |= site.mode in ("absx", "absy", "longx", "dpx", "dpy")
+            runs = 1 if counts is None else counts.get(site.offset, 0)
+            gain_bytes += gain[0]
+            gain_cycles += gain[1] * runs
+        size = gap if indexed or not used else min(gap, extent)
+        if current:
+            size = min(size, DP_SIZE - start)
+        if not current and size > max_size:
+            continue
+        if used or current:
+            out.append(Variable(name, start, size, current, len(used), pinned, gain_bytes, gain_cycles))
+    return out
+
+
+def knapsack(items, capacity, value):
+    """Indices of items (with .size) maximising value(item) within capacity."""
+    best = [0] * (capacity + 1)
+    take = []
+    for item in items:
+        v, w = value(item), item.size
+        row = bytearray(capacity + 1)
+        if v > 0 and w <= capacity:
+            for c in range(capacity, w - 1, -1):
+                if best[c - w] + v > best[c]:
+                    best[c] = best[c - w] + v
+                    row[c] = 1
+        take.append(row)
+    chosen, c = [], capacity
+    for i in range(len(items) - 1, -1, -1):
+        if take[i][c]:
+            chosen.append(i)
+            c -= items[i].size
+    return sorted(chosen)
+
+
+def _free_spans(used, budget):
+    taken = bytearray(budget)
+    for start, size in used:
+        for pos in range(start, min(budget, start + size)):
+            taken[pos] = 1
+    spans, pos = [], 0
+    while pos < budget:
+        if taken[pos]:
+            pos += 1
+            continue
+        end = pos
+        while end < budget and not taken[end]:
+            end += 1
+        spans.append([pos, end])
+        pos = end
+    return spans
+
+
+def _first_fit(spans, items):
+    placed = {}
+    for var in sorted(items, key=lambda v: (-v.size, v.address)):
+        for span in spans:
+            if span[1] - span[0] >= var.size:
+                placed[var.name] = span[0]
+                span[0] += var.size
+                break
+        else:
+            return None
+    return placed
+
+
+def layout(fixed, chosen, budget=DP_SIZE, reserved=()):
+    """{name: direct page address} for the chosen variables around the fixed ones.
+
+    Chosen variables already in direct page keep their address when the
+    newcomers still fit around them; otherwise all of them are repacked.
+    Returns (placement, variables that did not fit).
+    """
+    base = [(v.address, v.size) for v in fixed] + list(reserved)
+    keep = [v for v in chosen if v.current]
+    new = [v for v in chosen if not v.current]
+    dropped = []
+    while True:
+        placed = _first_fit(_free_spans(base + [(v.address, v.size) for v in keep], budget), new)
+        if placed is not None:
+            placed.update((v.name, v.address) for v in keep + fixed)
+            return placed, dropped
+        placed = _first_fit(_free_spans(base, budget), keep + new)
+        if placed is not None:
+            placed.update((v.name, v.address) for v in fixed)
+            return placed, dropped
+        # fragmented: give up the newcomer worth least per byte
+        worst = min(new or keep, key=lambda v: (v.gain_cycles / v.size, v.gain_bytes / v.size))
+        dropped.append(worst)
+        (new if worst in new else keep).remove(worst)
+
+
+def advise(variables, objective="cycles", budget=DP_SIZE, reserved=()):
+    """(placement, moved in, moved out, dropped) for a set of collected variables."""
+    fixed = [v for v in variables if v.pinned and v.current]
+    free = budget - sum(size for _, size in reserved) - sum(v.size for v in fixed)
+    if free < 0:
+        raise ValueError(f"pinned variables and reserved bytes need {budget - free} of {budget} bytes")
+    movable = [v for v in variables if not v.pinned]
+    total_b = sum(v.gain_bytes for v in movable) + 1
+    total_c = sum(v.gain_cycles for v in movable) + 1
+
+    def value(v):
+        # ties go to the variable already in direct page, so nothing moves for no gain
+        primary, secondary = (v.gain_cycles, v.gain_bytes) if objective == "cycles" else (v.gain_bytes, v.gain_cycles)
+        second_total = total_b if objective == "cycles" else total_c
+        return ((primary * second_total + secondary) * 2 + v.current) if primary or secondary else 0
+
+    chosen = [movable[i] for i in knapsack(movable, free, value)]
+    placement, dropped = layout(fixed, chosen, budget, reserved)
+    names = set(placement)
+    moved_in = [v for v in chosen if not v.current and v.name in names]
+    moved_out = [v for v in movable if v.current and v.name not in names]
+    moved_in.sort(key=lambda v: -v.gain_cycles)
+    return placement, moved_in, moved_out, dropped
+
+
+def parse_range(text):
+    lo, _, hi = text.partition("-")
+    lo = int(lo.lstrip("$"), 16)
+    hi = int(hi.lstrip("$"), 16) if hi else lo
+    if not 0 <= lo <= hi < DP_SIZE:
+        raise argparse.ArgumentTypeError(f"bad direct page range '{text}'")
+    return lo, hi - lo + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend direct page placement of WRAM variables.")
+    parser.add_argument("image", help="menu.bin (or a build key when --db is given)")
+    parser.add_argument("--labels", default=DEFAULT_LABELS)
+    parser.add_argument("--map", default="menu", help="memory map (" + ", ".join(snesmap.MAPPERS) + ")")
+    parser.add_argument("--db", help="take the instructions from this analysisdb.py database")
+    parser.add_argument("--trace", help="emulator trace log: weight cycles by execution counts")
+    parser.add_argument("--objective", choices=("cycles", "bytes"), default="cycles")
+    parser.add_argument("--reserve", type=parse_range, action="append", default=[],
+                        help="direct page bytes to keep free, e.g. 00-0f")
+    parser.add_argument("--pin", action="append", default=[], help="variable that must not move")
+    parser.add_argument("--max-size", type=int, default=32, help="largest variable to move into direct page")
+    parser.add_argument("--all", action="store_true", help="list every variable, not just the moves")
+    args = parser.parse_args()
+
+    labels = load_labels(args.labels)
+    widths = label_widths(args.labels)
+    mapper = snesmap.get_mapper(args.map, labels)
+    if args.db:
+        from analysisdb import AnalysisDB
+        db = AnalysisDB(args.db)
+        try:
+            sites = db_sites(db, args.image)
+        except KeyError as e:
+            parser.error(str(e))
+        finally:
+            db.close()
+    else:
+        with open(args.image, "rb") as f:
+            data = f.read()
+        sites = code_sites(data, mapper, rom_symbols(labels, mapper, len(data), widths))
+
+    counts = None
+    if args.trace:
+        import traceprof
+        counts = {}
+        for pc, n in traceprof.pc_counts(args.trace).items():
+            off = int(mapper.to_offset(pc))
+            counts[off] = counts.get(off, 0) + n
+
+    variables = wram_variables(labels, widths)
+    if not variables:
+        parser.error(f"{args.labels}: no WRAM variable labels")
+    found = collect(sites, variables, counts, args.max_size, set(args.pin))
+    try:
+        placement, moved_in, moved_out, dropped = advise(found, args.objective, DP_SIZE, args.reserve)
+    except ValueError as e:
+        parser.error(str(e))
+
+    unit = "cycles over the trace" if counts is not None else "cycles per pass"
+    current = [v for v in found if v.current]
+    print(f"{len(sites)} instructions, {len(found)} WRAM variables referenced or in direct page")
+    print(f"direct page now: {sum(v.size for v in current)} bytes in {len(current)} variables, "
+          f"{sum(v.pinned for v in current)} pinned")
+    gain_b = sum(v.gain_bytes for v in moved_in) - sum(v.gain_bytes for v in moved_out)
+    gain_c = sum(v.gain_cycles for v in moved_in) - sum(v.gain_cycles for v in moved_out)
+    print(f"proposal: {len(moved_in)} in, {len(moved_out)} out; saves {gain_b} bytes, {gain_c} {unit}")
+
+    if moved_in:
+        print("\nmove into direct page:")
+        for v in sorted(moved_in, key=lambda v: -v.gain_cycles):
+            print(f"  ${v.address:04X} -> ${placement[v.name]:02X}  {v.size:3d} bytes {v.sites:4d} sites  "
+                  f"-{v.gain_bytes:4d} bytes -{v.gain_cycles:8d} cycles  {v.name}")
+    if moved_out:
+        print("\nmove out of direct page:")
+        for v in sorted(moved_out, key=lambda v: v.address):
+            print(f"  ${v.address:04X}         {v.size:3d} bytes {v.sites:4d} sites  "
+                  f"+{v.gain_bytes:4d} bytes +{v.gain_cycles:8d} cycles  {v.name}")
+    if dropped:
+        print("\nchosen but no contiguous room: " + ", ".join(v.name for v in dropped))
+    if args.all:
+        print("\nall variables:")
+        for v in sorted(found, key=lambda v: v.address):
+            where = f"${placement[v.name]:02X}" if v.name in placement else "  -"
+            flag = "pinned" if v.pinned else ""
+            print(f"  ${v.address:04X} {where:>4} {v.size:4d} bytes {v.sites:4d} sites "
+                  f"{v.gain_bytes:5d} bytes {v.gain_cycles:8d} cycles  {v.name} {flag}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Menu graphics pipeline: palette remap, planar conversion, tile
+deduplication and assembler output in one cached step.
+
+Replaces the utils/ chain for the gfx/ assets:
+    palremap    remap colour indices through the menu palette layout
+    chili2chr   chunky 8x8 tiles (.chi, 64 bytes per tile) -> SNES planar
+    gentilemap  tilemap words for the converted tiles
+    bin2asm     .byt listing for snescom (or .byte for 64tass)
+
+Input is chunky tiles (.chi; the 20-byte trailer is ignored) or a linear
+8 bpp bitmap with --width. Conversion is whole-array: pixels are split
+into bit planes with np.unpackbits and repacked a row at a time.
+
+Tiles that are identical, or identical after an H, V or H+V flip, are
+stored once; the tilemap carries the flip bits (H = bit 14, V = bit 15)
+and tile numbers from --base (256 for the logo, as gentilemap). With
+--no-flips only exact duplicates are merged (sprites cannot flip per
+tile); with --no-dedupe the tilemap is sequential as gentilemap's.
+
+Results are cached in .gfxcache/ under the SHA-1 of the input and the
+options; an unchanged asset is copied from the cache, and outputs whose
+contents already match are left untouched so make sees no change.
+
+A manifest (JSON list of {"input", "output", options...}, paths relative
+to the manifest) builds every asset, skipping the unchanged ones:
+    [{"input": "logo.chi", "output": "../snes/logo", "remap": true, "base": 256,
+      "asm": "snescom", "label": "logo"}]
+
+Usage:
+    gfxasset.py convert gfx/logo.chi -o out/logo [--remap] [--depth 8] [--base 256] [--asm snescom]
+    gfxasset.py convert pic.bin --width 256 -o out/pic [--no-flips] [--palette-bits 1]
+    gfxasset.py build gfx/assets.json [--cache .gfxcache]
+    gfxasset.py asm gfx/sd2snes.pal [--label palette]        (bin2asm)
+    gfxasset.py stats snes/logo.a65 [--depth 8]              (what dedup would save)
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+CACHE_DIR = ".gfxcache"
+CACHE_VERSION = 1
+CHI_TRAILER = 20
+MAX_TILES = 1024
+
+# palremap.c map_idx: logo colours 0-119 around the 4 bpp palettes
+REMAP = np.zeros(256, dtype=np.uint8)
+REMAP[:120] = np.concatenate((
+    np.arange(0x24, 0x30), np.arange(0x34, 0x40), np.arange(0x44, 0x50),
+    np.arange(0x54, 0x60), np.arange(0x64, 0x70), np.arange(0x74, 0x80),
+    np.arange(0x80, 0xB0)))
+
+DEFAULTS = {"layout": "chunky", "width": None, "remap": False, "depth": 8, "dedupe": True,
+            "flips": True, "base": 0, "palette": 0, "priority": False, "asm": None, "label": None}
+
+
+def read_tiles(data, layout="chunky", width=None):
+    """(n, 8, 8) chunky tiles from .chi tile data or a linear bitmap."""
+    arr = np.frombuffer(data, dtype=np.uint8)
+    if layout == "chunky":
+        if len(arr) % 64 == CHI_TRAILER:
+            arr = arr[:-CHI_TRAILER]
+        return arr[:len(arr) // 64 * 64].reshape(-1, 8, 8)
+    if not width or width % 8:
+        raise ValueError("linear bitmaps need --width (a multiple of 8)")
+    rows = len(arr) // width // 8 * 8
+    return arr[:rows * width].reshape(rows // 8, 8, width // 8, 8).transpose(0, 2, 1, 3).reshape(-1, 8, 8)
+
+
+def to_planar(tiles, depth=8):
+    """(n, 8, 8) pixels -> (n, 8 * depth) SNES planar tile bytes.
+
+    Planes 2k and 2k+1 of each row are a byte pair, and each pair of
+    planes is a 16-byte block (chili2chr's layout).
+    """
+    n = len(tiles)
+    bits = np.unpackbits(tiles[..., None], axis=-1, bitorder="little")[..., :depth]
+    planes = np.packbits(bits, axis=2, bitorder="big")[:, :, 0, :]
+    return planes.reshape(n, 8, depth // 2, 2).transpose(0, 2, 1, 3).reshape(n, 8 * depth)
+
+
+def from_planar(data, depth=8):
+    """SNES planar tile bytes -> (n, 8, 8) pixels."""
+    arr = np.frombuffer(data, dtype=np.uint8)
+    n = len(arr) // (8 * depth)
+    planes = arr[:n * 8 * depth].reshape(n, depth // 2, 8, 2).transpose(0, 2, 1, 3).reshape(n, 8, depth)
+    bits = np.unpackbits(planes[..., None], axis=-1, bitorder="big")
+    weights = (1 << np.arange(depth, dtype=np.uint16))[None, None, :, None]
+    return (bits * weights).sum(axis=2).astype(np.uint8)
+
+
+def dedupe(tiles, flips=True):
+    """(unique tiles, tile index per input tile, flip bits per input tile).
+
+    Unique tiles keep the orientation of their first occurrence; flip bit 0
+    is H and bit 1 is V, relative to that tile.
+    """
+    n = len(tiles)
+    variants = [tiles]
+    if flips:
+        variants += [tiles[:, :, ::-1], tiles[:, ::-1, :], tiles[:, ::-1, ::-1]]
+    stacked = np.ascontiguousarray(np.concatenate(variants).reshape(-1, 64))
+    # rank every orientation of every tile; a tile's class is its smallest rank
+    _, ranks = np.unique(stacked.view(np.dtype((np.void, 64))).ravel(), return_inverse=True)
+    ranks = ranks.reshape(len(variants), n)
+    orient = ranks.argmin(axis=0)
+    key = ranks.min(axis=0)
+    _, first, group = np.unique(key, return_index=True, return_inverse=True)
+    # number classes in order of first appearance
+    order = np.argsort(first, kind="stable")
+    number = np.empty_like(order)
+    number[order] = np.arange(len(order))
+    index = number[group]
+    flip = orient ^ orient[first[group]]
+    return tiles[np.sort(first)], index, flip
+
+
+def tilemap(index, flip, base=0, palette=0, priority=False):
+    """Little-endian BG tilemap words."""
+    tile = index + base
+    if len(tile) and tile.max() >= MAX_TILES:
+        raise ValueError(f"tile number ${int(tile.max()):X} does not fit the tilemap's 10 bits")
+    words = tile | (palette << 10) | (int(priority) << 13) | ((flip & 1) << 14) | ((flip >> 1) << 15)
+    return words.astype("<u2").tobytes()
+
+
+def asm_listing(data, label, syntax="snescom"):
+    """bin2asm-style listing: the label, then 8 bytes per directive line."""
+    directive = ".byte" if syntax == "64tass" else ".byt"
+    lines = [label]
+    for i in range(0, len(data), 8):
+        lines.append(f"  {directive} " + ", ".join(f"${b:02x}" for b in data[i:i + 8]))
+    return "\n".join(lines) + "\n"
+
+
+def read_asm_bytes(path, label=None):
+    """Bytes of the .byt/.byte lines in an assembler file (after label, if given)."""
+    out = bytearray()
+    active = label is None
+    with open(path, "r") as f:
+        for line in f:
+            if not active:
+                active = line.split(";")[0].strip() == label
+                continue
+            m = re.match(r"\s*\.byte?\s+(.*)", line.split(";")[0])
+            if m:
+                out += bytes(int(v.strip().lstrip("$"), 16) for v in m.group(1).split(","))
+            elif line.strip() and not line[0].isspace() and label is not None:
+                break
+    return bytes(out)
+
+
+def convert(data, opts):
+    """({suffix: bytes} for ".chr", ".map" and maybe ".a65", tiles in, tiles out)."""
+    opts = dict(DEFAULTS, **opts)
+    tiles = read_tiles(data, opts["layout"], opts["width"])
+    if opts["remap"]:
+        tiles = REMAP[tiles]
+    tiles = tiles & np.uint8((1 << opts["depth"]) - 1)
+    if opts["dedupe"]:
+        unique, index, flip = dedupe(tiles, opts["flips"])
+    else:
+        unique, index, flip = tiles, np.arange(len(tiles)), np.zeros(len(tiles), dtype=np.int64)
+    out = {
+        ".chr": to_planar(unique, opts["depth"]).tobytes(),
+        ".map": tilemap(index, flip, opts["base"], opts["palette"], opts["priority"]),
+    }
+    if opts["asm"]:
+        label = opts["label"] or "chgme"
+        out[".a65"] = (asm_listing(out[".chr"], label, opts["asm"])
+                       + asm_listing(out[".map"], label + "_map", opts["asm"]))
+    return out, len(tiles), len(unique)
+
+
+def cache_key(data, opts):
+    text = json.dumps(dict(DEFAULTS, **opts), sort_keys=True)
+    return hashlib.sha1(f"{CACHE_VERSION}:{text}:".encode() + data).hexdigest()
+
+
+def _write_if_changed(path, content):
+    if isinstance(content, str):
+        content = content.encode()
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            if f.read() == content:
+                return False
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return True
+
+
+def build_asset(src, output, opts, cache=CACHE_DIR):
+    """Convert src to output + suffixes through the cache.
+
+    Returns (status, tiles in, tiles out); status is "built", "cached" or
+    "unchanged" (cached and the outputs already match).
+    """
+    with open(src, "rb") as f:
+        data = f.read()
+    key = cache_key(data, opts)
+    entry = os.path.join(cache, key[:2], key) if cache else None
+    if entry and os.path.exists(os.path.join(entry, "info.json")):
+        with open(os.path.join(entry, "info.json")) as f:
+            info = json.load(f)
+        changed = False
+        for suffix in info["outputs"]:
+            with open(os.path.join(entry, "out" + suffix), "rb") as f:
+                changed |= _write_if_changed(output + suffix, f.read())
+        return ("cached" if changed else "unchanged"), info["tiles"], info["unique"]
+    outputs, count, unique = convert(data, opts)
+    for suffix, content in outputs.items():
+        _write_if_changed(output + suffix, content)
+    if entry:
+        os.makedirs(entry, exist_ok=True)
+        for suffix, content in outputs.items():
+            _write_if_changed(os.path.join(entry, "out" + suffix), content)
+        with open(os.path.join(entry, "info.json"), "w") as f:
+            json.dump({"source": src, "outputs": sorted(outputs), "tiles": count, "unique": unique}, f)
+    return "built", count, unique
+
+
+def build_manifest(path, cache=CACHE_DIR):
+    """[(input, status, tiles in, tiles out, depth)] for every asset in a manifest."""
+    with open(path, "r") as f:
+        assets = json.load(f)
+    root = os.path.dirname(path)
+    jobs = []
+    for asset in assets:
+        opts = {k: v for k, v in asset.items() if k not in ("input", "output")}
+        unknown = set(opts) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"{asset['input']}: unknown option(s) {', '.join(sorted(unknown))}")
+        jobs.append((asset["input"], asset["output"], opts))
+    results = []
+    for src, output, opts in jobs:
+        status = build_asset(os.path.join(root, src), os.path.join(root, output), opts, cache)
+        results.append((src,) + status + (opts.get("depth", DEFAULTS["depth"]),))
+    return results
+
+
+def _report(name, status, count, unique, depth=8):
+    saved = (count - unique) * 8 * depth
+    print(f"  {status:9s} {name}: {count} tiles -> {unique} ({saved} bytes of VRAM/ROM saved)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert, deduplicate and cache SNES menu graphics.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("convert")
+    p.add_argument("input")
+    p.add_argument("-o", "--output", required=True, help="output path prefix (.chr, .map, .a65 appended)")
+    p.add_argument("--width", type=int, help="input is a linear 8 bpp bitmap this wide")
+    p.add_argument("--remap", action="store_true", help="apply the palremap colour mapping")
+    p.add_argument("--depth", type=int, choices=(2, 4, 8), default=8)
+    p.add_argument("--no-dedupe", action="store_true", help="keep every tile, sequential tilemap")
+    p.add_argument("--no-flips", action="store_true", help="only merge exact duplicates")
+    p.add_argument("--base", type=int, default=0, help="first tile number in the tilemap")
+    p.add_argument("--palette-bits", type=int, default=0, help="tilemap palette number (0-7)")
+    p.add_argument("--priority", action="store_true", help="set the tilemap priority bit")
+    p.add_argument("--asm", choices=("snescom", "64tass"), help="also write an assembler listing")
+    p.add_argument("--label", help="label for the listing (map gets _map appended)")
+    p = sub.add_parser("build")
+    p.add_argument("manifest")
+    for p in sub.choices.values():
+        p.add_argument("--cache", default=CACHE_DIR, help="cache directory ('' to disable)")
+    p = sub.add_parser("asm")
+    p.add_argument("input")
+    p.add_argument("--label", default="chgme")
+    p.add_argument("--syntax", choices=("snescom", "64tass"), default="snescom")
+    p = sub.add_parser("stats")
+    p.add_argument("input", help=".chr binary or an assembler listing of planar tiles")
+    p.add_argument("--label", help="listing label to read from")
+    p.add_argument("--depth", type=int, choices=(2, 4, 8), default=8)
+    args = parser.parse_args()
+
+    if args.cmd == "asm":
+        with open(args.input, "rb") as f:
+            print(asm_listing(f.read(), args.label, args.syntax), end="")
+    elif args.cmd == "stats":
+        if args.input.endswith((".a65", ".asm", ".s")):
+            data = read_asm_bytes(args.input, args.label)
+        else:
+            with open(args.input, "rb") as f:
+                data = f.read()
+        tiles = from_planar(data, args.depth)
+        exact = len(dedupe(tiles, flips=False)[0])
+        flipped = len(dedupe(tiles)[0])
+        tile_bytes = 8 * args.depth
+        print(f"{args.input}: {len(tiles)} tiles")
+        print(f"  {exact} distinct, {(len(tiles) - exact) * tile_bytes} bytes saved")
+        print(f"  {flipped} distinct with flips, {(len(tiles) - flipped) * tile_bytes} bytes saved")
+    elif args.cmd == "build":
+        try:
+            for name, status, count, unique, depth in build_manifest(args.manifest, args.cache):
+                _report(name, status, count, unique, depth)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        opts = {"layout": "linear" if args.width else "chunky", "width": args.width,
+                "remap": args.remap, "depth": args.depth, "dedupe": not args.no_dedupe,
+                "flips": not args.no_flips, "base": args.base, "palette": args.palette_bits,
+                "priority": args.priority, "asm": args.asm, "label": args.label}
+        try:
+            status, count, unique = build_asset(args.input, args.output, opts, args.cache)
+        except ValueError as e:
+            parser.error(str(e))
+        _report(args.input, status, count, unique, args.depth)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Side-by-side hex diff of two images, paged instead of dumped.
+
+The diff index (which 16-byte rows differ, grouped into hunks) is built
+once with numpy; rows are only formatted when they are on screen, with
+bytes.hex(' ') for the row and per-byte highlighting only on rows that
+differ. 8 MB pairs open instantly.
+
+Interactive keys (curses):
+    j/k, arrows     scroll one row          space/b, PgDn/PgUp  scroll a page
+    n/N             next/previous hunk      s/S                 next/previous symbol
+    g/G             start/end               /                   go to offset or symbol
+    q               quit
+
+Without a terminal, or with --pager, the rows are streamed to $PAGER
+(less -R) as it reads them; --hunks limits that to the differing rows
+plus --context rows around them.
+
+Usage:
+    hexdiff.py orig.bin port.bin [--labels snes-64tass/menu.labels] [--map menu]
+    hexdiff.py orig.bin port.bin --pager [--hunks] [--context 2]
+"""
+
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+
+import numpy as np
+
+import snesmap
+
+ROW = 16
+HIGHLIGHT = "\x1b[7m"
+RESET = "\x1b[0m"
+
+
+class DiffIndex:
+    """Row-level diff of two byte strings, computed once."""
+
+    def __init__(self, a, b):
+        self.a, self.b = bytes(a), bytes(b)
+        self.size = max(len(a), len(b))
+        self.rows = (self.size + ROW - 1) // ROW
+        n = min(len(a), len(b))
+        neq = np.frombuffer(self.a, dtype=np.uint8, count=n) != np.frombuffer(self.b, dtype=np.uint8, count=n)
+        pad = self.rows * ROW - n
+        # bytes past the end of the shorter image count as different
+        neq = np.concatenate((neq, np.ones(pad, dtype=bool)))
+        if self.size % ROW:
+            neq[self.size:] = False
+        self.changed = neq.reshape(-1, ROW)
+        self.diff_rows = np.flatnonzero(self.changed.any(axis=1))
+        self.diff_bytes = int(neq.sum())
+        if len(self.diff_rows):
+            split = np.flatnonzero(np.diff(self.diff_rows) > 1) + 1
+            self.hunks = [(int(g[0]), int(g[-1]) + 1) for g in np.split(self.diff_rows, split)]
+        else:
+            self.hunks = []
+        self.hunk_starts = np.array([h[0] for h in self.hunks], dtype=np.int64)
+
+    def row_differs(self, row):
+        i = np.searchsorted(self.diff_rows, row)
+        return i < len(self.diff_rows) and self.diff_rows[i] == row
+
+    def next_hunk(self, row, forward=True):
+        """Start row of the next/previous hunk from row, or None."""
+        if forward:
+            i = np.searchsorted(self.hunk_starts, row, side="right")
+            return int(self.hunk_starts[i]) if i < len(self.hunk_starts) else None
+        i = np.searchsorted(self.hunk_starts, row, side="left") - 1
+        return int(self.hunk_starts[i]) if i >= 0 else None
+
+    def hunk_number(self, row):
+        return int(np.searchsorted(self.hunk_starts, row, side="right"))
+
+
+class RowFormatter:
+    """Formats rows as lists of (text, highlighted) segments."""
+
+    def __init__(self, index, symbols=None, mapper=None):
+        self.index = index
+        self.symbols = symbols
+        self.mapper = mapper
+        if symbols is not None and len(symbols):
+            self.sym_rows = np.unique(symbols.offsets // ROW)
+        else:
+            self.sym_rows = np.zeros(0, dtype=np.int64)
+
+    def _address(self, off):
+        if self.mapper is None:
+            return f"{off:06X}"
+        addr = int(self.mapper.to_address(off))
+        return f"{addr:06X}" if addr >= 0 else f"{off:06X}"
+
+    def _label(self, row):
+        if self.symbols is None:
+            return ""
+        i = np.searchsorted(self.sym_rows, row)
+        if i >= len(self.sym_rows) or self.sym_rows[i] != row:
+            return ""
+        lo = np.searchsorted(self.symbols.offsets, row * ROW)
+        hi = np.searchsorted(self.symbols.offsets, (row + 1) * ROW)
+        return "  " + " ".join(self.symbols.names[lo:hi])
+
+    @staticmethod
+    def _side(data, off):
+        chunk = data[off:off + ROW]
+        return chunk.hex(" ").upper().ljust(3 * ROW - 1)
+
+    def segments(self, row):
+        idx = self.index
+        off = row * ROW
+        head = f"  ${self._address(off)}  "
+        label = self._label(row)
+        if not idx.row_differs(row):
+            return [(head + self._side(idx.a, off) + " | " + self._side(idx.b, off) + label, False)]
+        changed = idx.changed[row]
+        segs = [(head, False)]
+        for data in (idx.a, idx.b):
+            chunk = data[off:off + ROW]
+            for i in range(ROW):
+                sep = " " if i < ROW - 1 else ""
+                text = f"{chunk[i]:02X}" if i < len(chunk) else "  "
+                segs.append((text, bool(changed[i]) and i < len(chunk)))
+                segs.append((sep, False))
+            if data is idx.a:
+                segs.append((" | ", False))
+        segs.append((label + "  <", False))
+        return segs
+
+    def ansi(self, row):
+        return "".join(HIGHLIGHT + t + RESET if hl else t for t, hl in self.segments(row))
+
+
+def pager_rows(index, hunks_only=False, context=2):
+    """Rows to stream to the pager, with None marking a skipped gap."""
+    if not hunks_only:
+        yield from range(index.rows)
+        return
+    last = -1
+    for start, end in index.hunks:
+        lo, hi = max(start - context, last + 1), min(end + context, index.rows)
+        if last >= 0 and lo > last + 1:
+            yield None
+        yield from range(lo, hi)
+        last = hi - 1
+
+
+def page(fmt, rows, header):
+    """Stream rows to $PAGER (less -R by default)."""
+    cmd = os.environ.get("PAGER", "less -R")
+    proc = subprocess.Popen(shlex.split(cmd), stdin=subprocess.PIPE, encoding="utf-8")
+    try:
+        proc.stdin.write(header + "\n")
+        for row in rows:
+            proc.stdin.write(("  ..." if row is None else fmt.ansi(row)) + "\n")
+        proc.stdin.close()
+    except BrokenPipeError:
+        pass
+    proc.wait()
+
+
+class Viewer:
+    """curses front end; only the rows on screen are formatted."""
+
+    def __init__(self, fmt, names):
+        self.fmt = fmt
+        self.index = fmt.index
+        self.names = names
+        self.top = 0
+        self.message = ""
+
+    def _goto(self, text):
+        text = text.strip()
+        syms = self.fmt.symbols
+        if syms is not None and text in syms:
+            return syms.offset(text) // ROW
+        try:
+            value = int(text.lstrip("$"), 16)
+        except ValueError:
+            self.message = f"unknown offset/symbol '{text}'"
+            return self.top
+        if self.fmt.mapper is not None and value >= self.index.size:
+            value = int(self.fmt.mapper.to_offset(value))
+        if not 0 <= value < self.index.size:
+            self.message = f"${value:X} is outside the images"
+            return self.top
+        return value // ROW
+
+    def _next_symbol(self, forward):
+        rows = self.fmt.sym_rows
+        if forward:
+            i = np.searchsorted(rows, self.top, side="right")
+            return int(rows[i]) if i < len(rows) else None
+        i = np.searchsorted(rows, self.top, side="left") - 1
+        return int(rows[i]) if i >= 0 else None
+
+    def draw(self, scr):
+        import curses
+        height, width = scr.getmaxyx()
+        body = height - 1
+        scr.erase()
+        for y in range(body):
+            row = self.top + y
+            if row >= self.index.rows:
+                break
+            x = 0
+            for text, hl in self.fmt.segments(row):
+                if x >= width - 1:
+                    break
+                text = text[:width - 1 - x]
+                scr.addstr(y, x, text, curses.A_REVERSE if hl else curses.A_NORMAL)
+                x += len(text)
+        idx = self.index
+        status = (f" {self.names[0]} | {self.names[1]}  row ${self.top * ROW:06X}"
+                  f"  hunk {idx.hunk_number(self.top)}/{len(idx.hunks)}  {idx.diff_bytes} bytes differ"
+                  f"  {self.message}")
+        scr.addstr(height - 1, 0, status[:width - 1].ljust(width - 1), curses.A_REVERSE)
+        scr.refresh()
+
+    def run(self, scr):
+        import curses
+        curses.curs_set(0)
+        while True:
+            self.draw(scr)
+            height = scr.getmaxyx()[0] - 1
+            key = scr.getch()
+            self.message = ""
+            target = self.top
+            if key in (ord("q"), 27):
+                return
+            elif key in (ord("j"), curses.KEY_DOWN):
+                target += 1
+            elif key in (ord("k"), curses.KEY_UP):
+                target -= 1
+            elif key in (ord(" "), curses.KEY_NPAGE):
+                target += height
+            elif key in (ord("b"), curses.KEY_PPAGE):
+                target -= height
+            elif key in (ord("g"), curses.KEY_HOME):
+                target = 0
+            elif key in (ord("G"), curses.KEY_END):
+                target = self.index.rows - height
+            elif key in (ord("n"), ord("N")):
+                found = self.index.next_hunk(self.top, key == ord("n"))
+                if found is None:
+                    self.message = "no more hunks"
+                else:
+                    target = found
+            elif key in (ord("s"), ord("S")):
+                found = self._next_symbol(key == ord("s"))
+                if found is None:
+                    self.message = "no more symbols"
+                else:
+                    target = found
+            elif key == ord("/"):
+                scr.addstr(height, 0, "goto: ".ljust(scr.getmaxyx()[1] - 1))
+                curses.echo()
+                curses.curs_set(1)
+                text = scr.getstr(height, 6).decode(errors="replace")
+                curses.noecho()
+                curses.curs_set(0)
+                target = self._goto(text)
+            self.top = max(0, min(target, self.index.rows - 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Paged side-by-side hex diff of two images.")
+    parser.add_argument("orig")
+    parser.add_argument("port")
+    parser.add_argument("--labels", help="64tass label file for symbol names and jumps")
+    parser.add_argument("--map", help="memory map for addresses (" + ", ".join(snesmap.MAPPERS) + ")")
+    parser.add_argument("--pager", action="store_true", help="stream to $PAGER instead of curses")
+    parser.add_argument("--hunks", action="store_true", help="pager: only rows around differences")
+    parser.add_argument("--context", type=int, default=2, help="pager: rows of context with --hunks")
+    args = parser.parse_args()
+
+    with open(args.orig, "rb") as f:
+        a = f.read()
+    with open(args.port, "rb") as f:
+        b = f.read()
+    index = DiffIndex(a, b)
+
+    labels = {}
+    if args.labels:
+        from menulabels import load_labels
+        labels = load_labels(args.labels)
+    mapper = snesmap.get_mapper(args.map or "menu", labels) if (args.map or labels) else None
+    symbols = None
+    if labels:
+        from menulabels import label_widths, rom_symbols
+        symbols = rom_symbols(labels, mapper, index.size, label_widths(args.labels))
+    fmt = RowFormatter(index, symbols, mapper)
+
+    if args.pager or not sys.stdout.isatty():
+        header = (f"{args.orig} | {args.port}: {index.diff_bytes} bytes differ "
+                  f"in {len(index.hunks)} hunks")
+        rows = pager_rows(index, args.hunks, args.context)
+        if sys.stdout.isatty():
+            page(fmt, rows, header)
+        else:
+            try:
+                print(header)
+                for row in rows:
+                    print("  ..." if row is None else "".join(t for t, _ in fmt.segments(row)))
+            except BrokenPipeError:
+                # reader went away (head, less q): keep exit-time flush quiet
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    import curses
+    curses.wrapper(Viewer(fmt, (args.orig, args.port)).run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Read, write and compare FPGA memory initialisation files.
+
+Three formats are in the tree:
+    .coe            Xilinx: memory_initialization_radix / _vector (2, 10 or 16)
+    .mif (Xilinx)   one binary word per line (ipcore_dir/*.mif)
+    .mif (Quartus)  DEPTH/WIDTH/ADDRESS_RADIX/DATA_RADIX header, CONTENT BEGIN,
+                    "addr : value;" and "[lo..hi] : value;" entries
+
+Files are parsed line by line into packed numpy arrays (uint8 up to
+uint64 by width), so large images never sit in memory as text. Words
+missing from a file read as 0, which is what both toolchains initialise
+them to (a Quartus .mif without a CONTENT block is all zeros). Words
+wider than 64 bits are rejected with an error naming the file.
+
+diff compares the values, not the text: a regenerated .coe and the
+committed Quartus .mif of the same table are equal when their words are.
+check walks a tree and diffs, per core, every group of files that share a
+name (dec_table.mif, ipcore_dir/dec_table.coe, ipcore_dir/dec_table.mif).
+
+Usage:
+    memimage.py show verilog/sd2snes_sa1/dec_table.mif
+    memimage.py diff new.coe verilog/sd2snes_sa1/dec_table.mif [--limit 20]
+    memimage.py convert in.coe out.mif [--format quartus] [--radix 16]
+    memimage.py check [verilog]
+"""
+
+import argparse
+import os
+import re
+from array import array
+
+import numpy as np
+
+FORMATS = ("coe", "xilinx", "quartus")
+CHUNK_WORDS = 4096
+
+_RADIX_NAMES = {"BIN": 2, "OCT": 8, "DEC": 10, "HEX": 16, "UNS": 10}
+_DIGIT_BITS = {2: 1, 8: 3, 16: 4}
+
+
+class MemImage:
+    """Words of a memory image: values (numpy array), width in bits."""
+
+    def __init__(self, values, width, radix=16):
+        self.width = width
+        self.values = np.asarray(values, dtype=dtype_for(width))
+        self.radix = radix
+
+    @property
+    def depth(self):
+        return len(self.values)
+
+
+def dtype_for(width):
+    for bits, dtype in ((8, np.uint8), (16, np.uint16), (32, np.uint32), (64, np.uint64)):
+        if width <= bits:
+            return dtype
+    raise ValueError(f"{width}-bit words are wider than 64 bits")
+
+
+def _digits_width(token, radix):
+    if radix in _DIGIT_BITS:
+        return len(token) * _DIGIT_BITS[radix]
+    return int(token).bit_length()
+
+
+def detect_format(path):
+    if path.lower().endswith(".coe"):
+        return "coe"
+    with open(path, "r") as f:
+        for line in f:
+            text = line.strip()
+            if not text or text.startswith(("--", "%")):
+                continue
+            return "xilinx" if re.fullmatch(r"[01]+", text) else "quartus"
+    return "xilinx"
+
+
+def _read_coe(f):
+    radix = 10
+    words = array("Q")
+    width = 0
+    in_vector = False
+    for line in f:
+        text = line.strip()
+        if not in_vector:
+            if not text or text.startswith(";"):
+                continue
+            key, _, value = text.partition("=")
+            key = key.strip().lower()
+            if key == "memory_initialization_radix":
+                radix = int(value.strip().rstrip(";"))
+            if key != "memory_initialization_vector":
+                continue
+            in_vector = True
+            text = value
+        text, end, _ = text.partition(";")
+        for tok in re.split(r"[,\s]+", text.strip()):
+            if tok:
+                width = max(width, _digits_width(tok, radix))
+                dtype_for(width)
+                words.append(int(tok, radix))
+        if end:
+            break
+    return words, width, radix
+
+
+def _read_xilinx(f):
+    words = array("Q")
+    width = 0
+    for line in f:
+        tok = line.strip()
+        if tok:
+            width = max(width, len(tok))
+            dtype_for(width)
+            words.append(int(tok, 2))
+    return words, width, 2
+
+
+def _read_quartus(f):
+    header = {}
+    values = None
+    addr_radix = data_radix = 16
+    in_comment = False
+    in_content = False
+    for line in f:
+        # strip % ... % block comments (may span lines) and -- line comments
+        out = []
+        for i, part in enumerate(line.split("%")):
+            if i:
+                in_comment = not in_comment
+            if not in_comment:
+                out.append(part)
+        text = "".join(out).split("--", 1)[0].strip()
+        if not text:
+            continue
+        if not in_content:
+            upper = text.upper()
+            if upper.startswith("CONTENT"):
+                in_content = True
+                values = _quartus_zeros(header)
+                addr_radix = _RADIX_NAMES[header.get("ADDRESS_RADIX", "HEX").upper()]
+                data_radix = _RADIX_NAMES[header.get("DATA_RADIX", "HEX").upper()]
+                continue
+            key, _, value = text.rstrip(";").partition("=")
+            header[key.strip().upper()] = value.strip()
+            continue
+        upper = text.upper()
+        if upper.startswith("BEGIN"):
+            continue
+        if upper.startswith("END"):
+            break
+        for entry in text.split(";"):
+            if ":" not in entry:
+                continue
+            addr, _, data = entry.partition(":")
+            addr = addr.strip()
+            data = [int(tok, data_radix) for tok in data.split()]
+            if addr.startswith("["):
+                lo, hi = (int(a, addr_radix) for a in addr.strip("[]").split(".."))
+                if len(data) == 1:
+                    values[lo:hi + 1] = data[0]
+                else:
+                    # repeating pattern over the range
+                    reps = (hi - lo + len(data)) // len(data)
+                    values[lo:hi + 1] = np.tile(np.array(data, dtype=values.dtype), reps)[:hi - lo + 1]
+            else:
+                start = int(addr, addr_radix)
+                values[start:start + len(data)] = data
+    if values is None:
+        values = _quartus_zeros(header)
+    return values, int(header.get("WIDTH", 0)), data_radix
+
+
+def _quartus_zeros(header):
+    if "DEPTH" not in header:
+        raise ValueError("no DEPTH in the .mif header")
+    return np.zeros(int(header["DEPTH"]), dtype=dtype_for(int(header.get("WIDTH", 0)) or 64))
+
+
+def read(path, fmt=None):
+    """Parse a .coe or .mif into a MemImage."""
+    fmt = fmt or detect_format(path)
+    with open(path, "r") as f:
+        try:
+            if fmt == "coe":
+                words, width, radix = _read_coe(f)
+            elif fmt == "xilinx":
+                words, width, radix = _read_xilinx(f)
+            else:
+                words, width, radix = _read_quartus(f)
+        except (ValueError, OverflowError) as e:
+            raise ValueError(f"{path}: {e}") from None
+    width = max(width, 1)
+    values = np.frombuffer(words, dtype=np.uint64) if isinstance(words, array) else words
+    return MemImage(values.astype(dtype_for(width), copy=False), width, radix)
+
+
+def _word_format(width, radix):
+    if radix == 2:
+        return "{:0%db}" % width
+    if radix == 16:
+        return "{:0%dx}" % ((width + 3) // 4)
+    if radix == 8:
+        return "{:0%do}" % ((width + 2) // 3)
+    return "{:d}"
+
+
+def _chunks(values):
+    for start in range(0, len(values), CHUNK_WORDS):
+        yield start, values[start:start + CHUNK_WORDS].tolist()
+
+
+def write(path, img, fmt=None, radix=None):
+    """Write a MemImage; fmt defaults from the extension (.coe or Quartus .mif)."""
+    fmt = fmt or ("coe" if path.lower().endswith(".coe") else "quartus")
+    radix = radix or img.radix
+    with open(path, "w") as f:
+        if fmt == "coe":
+            word = _word_format(img.width, radix)
+            f.write(f"; depth={img.depth}, width={img.width}\n")
+            f.write(f"memory_initialization_radix={radix};\n")
+            f.write("memory_initialization_vector=\n")
+            for start, chunk in _chunks(img.values):
+                sep = ",\n" if start else ""
+                f.write(sep + ",\n".join(word.format(v) for v in chunk))
+            f.write(";\n")
+        elif fmt == "xilinx":
+            word = _word_format(img.width, 2)
+            for _, chunk in _chunks(img.values):
+                f.write("".join(word.format(v) + "\n" for v in chunk))
+        else:
+            word = _word_format(img.width, radix)
+            name = {2: "BIN", 8: "OCT", 10: "UNS", 16: "HEX"}[radix]
+            f.write(f"DEPTH = {img.depth};\nWIDTH = {img.width};\n")
+            f.write(f"ADDRESS_RADIX = HEX;\nDATA_RADIX = {name};\n\nCONTENT\nBEGIN\n")
+            for lo, hi, v in _runs(img.values):
+                if hi > lo:
+                    f.write(f"[{lo:x}..{hi:x}] : {word.format(v)};\n")
+                else:
+                    f.write(f"{lo:>10x}: {word.format(v)};\n")
+            f.write("END;\n")
+
+
+def _runs(values):
+    """(lo, hi, value) for runs of equal words (hi inclusive)."""
+    if len(values) == 0:
+        return
+    starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+    ends = np.append(starts[1:], len(values)) - 1
+    for lo, hi in zip(starts.tolist(), ends.tolist()):
+        yield lo, hi, int(values[lo])
+
+
+def diff(a, b):
+    """Compare two images by value.
+
+    Returns (addresses that differ, a words, b words, OR of all differing
+    bits). The shorter image is padded with zeros.
+    """
+    depth = max(a.depth, b.depth)
+    va = np.zeros(depth, dtype=np.uint64)
+    vb = np.zeros(depth, dtype=np.uint64)
+    va[:a.depth] = a.values
+    vb[:b.depth] = b.values
+    addrs = np.flatnonzero(va != vb)
+    bits = int(np.bitwise_or.reduce(va[addrs] ^ vb[addrs])) if len(addrs) else 0
+    return addrs, va[addrs], vb[addrs], bits
+
+
+def print_diff(a, b, name_a, name_b, limit=20):
+    addrs, wa, wb, bits = diff(a, b)
+    if a.width != b.width:
+        print(f"  width {a.width} vs {b.width}")
+    if a.depth != b.depth:
+        print(f"  depth {a.depth} vs {b.depth}")
+    if len(addrs) == 0:
+        print(f"  {name_a} == {name_b} ({a.depth} words)")
+        return True
+    digits = (max(a.width, b.width) + 3) // 4
+    print(f"  {len(addrs)} of {max(a.depth, b.depth)} words differ, changed bits mask {bits:0{digits}x}")
+    for addr, x, y in list(zip(addrs.tolist(), wa.tolist(), wb.tolist()))[:limit]:
+        print(f"    {addr:6x}: {x:0{digits}x} -> {y:0{digits}x}  (^{x ^ y:0{digits}x})")
+    if len(addrs) > limit:
+        print(f"    ... {len(addrs) - limit} more")
+    return False
+
+
+def find_groups(root):
+    """{core/stem: [paths]} for memory files of one core that share a name
+    (a core's ipcore_dir counts as the core directory)."""
+    groups = {}
+    for dirpath, _, files in os.walk(root):
+        core = dirpath[:-len("ipcore_dir")].rstrip(os.sep) if dirpath.endswith("ipcore_dir") else dirpath
+        for name in files:
+            if name.lower().endswith((".coe", ".mif")):
+                key = os.path.join(core, os.path.splitext(name)[0])
+                groups.setdefault(key, []).append(os.path.join(dirpath, name))
+    return {k: sorted(v) for k, v in sorted(groups.items())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read, write and compare .coe/.mif memory images.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("show")
+    p.add_argument("file")
+    p.add_argument("--format", choices=FORMATS)
+    p = sub.add_parser("diff")
+    p.add_argument("a")
+    p.add_argument("b")
+    p.add_argument("--limit", type=int, default=20)
+    p = sub.add_parser("convert")
+    p.add_argument("input")
+    p.add_argument("output")
+    p.add_argument("--format", choices=FORMATS, help="output format (default from extension)")
+    p.add_argument("--radix", type=int, choices=(2, 8, 10, 16))
+    p = sub.add_parser("check", help="diff files with the same name across a tree")
+    p.add_argument("root", nargs="?", default="verilog")
+    p.add_argument("--limit", type=int, default=5)
+    args = parser.parse_args()
+
+    try:
+        run(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def run(args):
+    if args.cmd == "show":
+        img = read(args.file, args.format)
+        print(f"{args.file}: {img.depth} words x {img.width} bits (radix {img.radix})")
+        word = _word_format(img.width, 16)
+        for lo, hi, v in _runs(img.values):
+            span = f"{lo:x}..{hi:x}" if hi > lo else f"{lo:x}"
+            print(f"  {span:>12}: {word.format(v)}")
+    elif args.cmd == "diff":
+        same = print_diff(read(args.a), read(args.b), args.a, args.b, args.limit)
+        raise SystemExit(0 if same else 1)
+    elif args.cmd == "convert":
+        write(args.output, read(args.input), args.format, args.radix)
+    else:
+        failed = 0
+        for stem, paths in find_groups(args.root).items():
+            if len(paths) < 2:
+                continue
+            print(f"{stem}:")
+            ref = read(paths[0])
+            for path in paths[1:]:
+                print(f"  {paths[0]} vs {path}")
+                if not print_diff(ref, read(path), paths[0], path, args.limit):
+                    failed += 1
+        raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Load 64tass label files (snes-64tass/menu.labels) and resolve image offsets
+back to symbols.
+
+Label lines look like "name\t= $c01379" (addresses) or "name= 16712090"
+(decimal constants). Labels that map into the ROM image through a
+snesmap mapper become symbols; each symbol's extent runs to the next symbol
+in the image, which is how routine sizes are derived for the comparison
+and size tools.
+
+Usage:
+    menulabels.py snes-64tass/menu.labels [--map menu] [--size 65536]
+"""
+
+import argparse
+import bisect
+import re
+
+import numpy as np
+
+import snesmap
+
+DEFAULT_LABELS = "snes-64tass/menu.labels"
+
+_LABEL_RE = re.compile(r"^\s*([A-Za-z_][\w.]*)\s*=\s*(\$[0-9A-Fa-f]+|%[01]+|-?\d+)\s*$")
+
+
+def parse_value(text):
+    """Parse a 64tass number ($hex, %bin or decimal)."""
+    if text.startswith("$"):
+        return int(text[1:], 16)
+    if text.startswith("%"):
+        return int(text[1:], 2)
+    return int(text)
+
+
+def load_labels(path=DEFAULT_LABELS):
+    """Return {name: value} for every label in a 64tass label file."""
+    labels = {}
+    with open(path, "r") as f:
+        for line in f:
+            m = _LABEL_RE.match(line)
+            if m:
+                labels[m.group(1)] = parse_value(m.group(2))
+    return labels
+
+
+def label_widths(path=DEFAULT_LABELS):
+    """Return {name: digit count} for $hex labels ($00dc -> 4, $c01379 -> 6).
+
+    64tass writes zero page/absolute/long labels with 2/4/6 digits, which
+    tells WRAM variables from ROM addresses that happen to be small.
+    """
+    widths = {}
+    with open(path, "r") as f:
+        for line in f:
+            m = _LABEL_RE.match(line)
+            if m and m.group(2).startswith("$"):
+                widths[m.group(1)] = len(m.group(2)) - 1
+    return widths
+
+
+class SymbolTable:
+    """Sorted ROM symbols with interval lookup.
+
+    names/offsets/ends are parallel, sorted by offset. Aliases (several
+    labels at one offset) share the extent; the first name in sort order
+    is the primary one.
+    """
+
+    def __init__(self, entries, image_size):
+        entries = sorted(entries, key=lambda e: (e[0], e[1]))
+        self.image_size = image_size
+        self.offsets = np.array([e[0] for e in entries], dtype=np.int64)
+        self.names = [e[1] for e in entries]
+        self.addresses = [e[2] for e in entries]
+        uniq = np.unique(self.offsets)
+        nxt = np.append(uniq[1:], image_size)
+        self.ends = nxt[np.searchsorted(uniq, self.offsets)]
+        self._by_name = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def offset(self, name):
+        return int(self.offsets[self._by_name[name]])
+
+    def extent(self, name):
+        """(start, end) image offsets of a symbol."""
+        i = self._by_name[name]
+        return int(self.offsets[i]), int(self.ends[i])
+
+    def primary(self):
+        """Indices of the first symbol at each distinct offset."""
+        keep = np.ones(len(self.offsets), dtype=bool)
+        keep[1:] = self.offsets[1:] != self.offsets[:-1]
+        return np.flatnonzero(keep)
+
+    def lookup(self, offset):
+        """Return (name, start) of the symbol containing offset, or (None, None)."""
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        if i < 0:
+            return None, None
+        start = int(self.offsets[i])
+        while i > 0 and self.offsets[i-1] == start:
+            i -= 1
+        return self.names[i], start
+
+    def resolve(self, offsets):
+        """Vectorized lookup: symbol index for each offset (-1 if before the first)."""
+        offsets = np.asarray(offsets, dtype=np.int64)
+        prim = self.primary()
+        idx = np.searchsorted(self.offsets[prim], offsets, side="right") - 1
+        return np.where(idx >= 0, prim[np.maximum(idx, 0)], -1)
+
+    def format(self, offset):
+        """'name+$xx' for an image offset."""
+        name, start = self.lookup(offset)
+        if name is None:
+            return f"${offset:06X}"
+        return name if offset == start else f"{name}+${offset - start:X}"
+
+
+def rom_symbols(labels, mapper, image_size, widths=None):
+    """Build a SymbolTable of the labels that land inside the image.
+
+    Labels written with fewer than 6 hex digits are WRAM/register
+    equates, not ROM addresses, and are skipped when widths is given.
+    """
+    names = [n for n in labels if widths is None or widths.get(n, 0) >= 6]
+    values = np.array([labels[n] for n in names], dtype=np.int64)
+    offsets = mapper.to_offset(values) if len(names) else values
+    entries = [(int(off), name, int(val)) for name, val, off in zip(names, values, offsets)
+               if 0 <= off < image_size]
+    return SymbolTable(entries, image_size)
+
+
+def load_symbols(path=DEFAULT_LABELS, mapper=None, image_size=0x10000):
+    """Load a label file straight into a SymbolTable (menu map by default)."""
+    mapper = mapper or snesmap.get_mapper("menu")
+    return rom_symbols(load_labels(path), mapper, image_size, label_widths(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List ROM symbols and extents from a 64tass label file.")
+    parser.add_argument("labels", nargs="?", default=DEFAULT_LABELS)
+    parser.add_argument("--map", default="menu", help="memory map (" + ", ".join(snesmap.MAPPERS) + ")")
+    parser.add_argument("--size", type=lambda s: int(s, 0), default=0x10000, help="image size")
+    args = parser.parse_args()
+
+    syms = load_symbols(args.labels, snesmap.get_mapper(args.map), args.size)
+    for i in range(len(syms)):
+        start, end = int(syms.offsets[i]), int(syms.ends[i])
+        print(f"  ${start:06X}-${end:06X} {end - start:6d}  ${syms.addresses[i]:06X}  {syms.names[i]}")
+
+
+if __name__ == "__main__":
+    main()
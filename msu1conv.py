@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Convert a TGA frame sequence to an MSU-1 video data file (out.msu), like
+snes/msu1/msu1conv.c but on whole frames at once.
+
+Frames are 224x144, 8 bpp colour-mapped TGAs named 00000000.tga,
+00000001.tga, ... (numbering may start at 1). Each frame becomes 28x18
+8 bpp tiles placed by the same tile map as msu1conv.c (two 16-tile rows
+per pair of tile rows, 504 of 508 tile slots used; the unused ones are
+zero) followed by its BGR555 palette. The bit-plane scatter is
+np.unpackbits/np.packbits over every tile of a batch of frames, and the
+palette is one shift-and-mask over all 256 colours.
+
+Batches of frames are converted by a process pool and written in order as
+they come back, so the output streams straight into the file while later
+batches are still converting.
+
+File layout (what snes/msu1/msu1.a65 reads from $2001):
+    0   frame count + 1, 16-bit little endian (msu1loop counts it down
+        and stops at zero before showing a frame, so msu1conv.c writes
+        one more than the frames it found)
+    2   standard frame duration in fields
+    3   alternate frame duration
+    4   alternate duration frequency (every n-th frame)
+    5   frames: 32512 bytes of tiles + 512 bytes of palette each
+
+Usage:
+    msu1conv.py [frames/] [-o out.msu] [--duration 2] [--alt-duration 3 --alt-freq 2] [-j 8]
+"""
+
+import argparse
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+WIDTH, HEIGHT = 224, 144
+TILES_X, TILES_Y = WIDTH // 8, HEIGHT // 8
+TILE_SLOTS = 508
+TILE_BYTES = TILE_SLOTS * 64
+PALETTE_BYTES = 512
+FRAME_BYTES = TILE_BYTES + PALETTE_BYTES
+HEADER_BYTES = 5
+PATTERN = "%08d.tga"
+
+
+def tile_map():
+    """Tile slot of each (tile row, tile column), as msu1conv.c preparetilemap()."""
+    tiles = np.zeros((TILES_Y, TILES_X), dtype=np.int64)
+    count = 0
+    for y in range(0, TILES_Y, 2):
+        for x in range(TILES_X):
+            tiles[y, x] = count
+            tiles[y + 1, x] = count + 0x10
+            count += 1
+            if not count & 0xF:
+                count += 0x10
+    return tiles
+
+
+TILE_MAP = tile_map().ravel()
+
+
+def read_tga(path):
+    """(pixels (144, 224) uint8 top row first, palette (256, 3) uint8 B, G, R)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    id_len, cmap_type, image_type = data[0], data[1], data[2]
+    cmap_start = int.from_bytes(data[3:5], "little")
+    cmap_len = int.from_bytes(data[5:7], "little")
+    cmap_bits = data[7]
+    width = int.from_bytes(data[12:14], "little")
+    height = int.from_bytes(data[14:16], "little")
+    bpp, descriptor = data[16], data[17]
+    if cmap_type != 1 or image_type != 1 or bpp != 8 or cmap_bits != 24:
+        raise ValueError(f"{path}: not an uncompressed 8 bpp colour-mapped TGA with a 24-bit palette")
+    if (width, height) != (WIDTH, HEIGHT):
+        raise ValueError(f"{path}: {width}x{height}, expected {WIDTH}x{HEIGHT}")
+    if cmap_start + cmap_len > 256:
+        raise ValueError(f"{path}: colour map runs past 256 entries")
+    pal_off = 18 + id_len
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    palette[cmap_start:cmap_start + cmap_len] = np.frombuffer(
+        data, dtype=np.uint8, count=cmap_len * 3, offset=pal_off).reshape(-1, 3)
+    pixels = np.frombuffer(data, dtype=np.uint8, count=WIDTH * HEIGHT,
+                           offset=pal_off + cmap_len * 3).reshape(HEIGHT, WIDTH)
+    if not descriptor & 0x20:
+        # bottom-up, the TGA default
+        pixels = pixels[::-1]
+    return pixels, palette
+
+
+def convert_tiles(pixels):
+    """(frames, 144, 224) pixels -> (frames, 32512) bytes of tiles in tile map order."""
+    frames = len(pixels)
+    # (frame, tile row, py, tile col, px) -> (frame, tile, py, px)
+    tiles = pixels.reshape(frames, TILES_Y, 8, TILES_X, 8).transpose(0, 1, 3, 2, 4)
+    tiles = tiles.reshape(frames, TILES_Y * TILES_X, 8, 8)
+    # bit p of each pixel, least significant first: (frame, tile, py, px, plane)
+    bits = np.unpackbits(tiles[..., None], axis=-1, bitorder="little")
+    # one byte per (plane, row), leftmost pixel in bit 7
+    planes = np.packbits(bits, axis=3, bitorder="big")[:, :, :, 0, :]
+    # planes 2n and 2n+1 interleave per row in the n-th 16-byte block
+    planes = planes.reshape(frames, -1, 8, 4, 2).transpose(0, 1, 3, 2, 4).reshape(frames, -1, 64)
+    out = np.zeros((frames, TILE_SLOTS, 64), dtype=np.uint8)
+    out[:, TILE_MAP] = planes
+    return out.reshape(frames, TILE_BYTES)
+
+
+def convert_palettes(palettes):
+    """(frames, 256, 3) B, G, R -> (frames, 512) bytes of little-endian BGR555."""
+    pal = palettes.astype(np.uint16) & 0xF8
+    colour = (pal[..., 0] << 7) | (pal[..., 1] << 2) | (pal[..., 2] >> 3)
+    return colour.astype("<u2").view(np.uint8).reshape(len(palettes), PALETTE_BYTES)
+
+
+def convert_frames(pixels, palettes):
+    """Whole frames in the MSU-1 layout: (frames, 33024) bytes."""
+    return np.concatenate((convert_tiles(pixels), convert_palettes(palettes)), axis=1)
+
+
+def _convert_batch(paths):
+    frames = [read_tga(p) for p in paths]
+    pixels = np.stack([f[0] for f in frames])
+    palettes = np.stack([f[1] for f in frames])
+    return convert_frames(pixels, palettes).tobytes()
+
+
+def frame_paths(directory=".", pattern=PATTERN):
+    """Consecutive frame files from number 0 (or 1), stopping at the first gap."""
+    paths = []
+    number = 0 if os.path.exists(os.path.join(directory, pattern % 0)) else 1
+    while True:
+        path = os.path.join(directory, pattern % number)
+        if not os.path.exists(path):
+            return paths
+        paths.append(path)
+        number += 1
+
+
+def header(frames, duration=2, alt_duration=0, alt_freq=0):
+    count = frames + 1
+    if count > 0xFFFF:
+        raise ValueError(f"{frames} frames do not fit the 16-bit frame count")
+    return bytes((count & 0xFF, count >> 8, duration, alt_duration, alt_freq))
+
+
+def convert(paths, out, duration=2, alt_duration=0, alt_freq=0, jobs=None, batch=32):
+    """Convert frame files into the file object out; returns the number of frames."""
+    out.write(header(len(paths), duration, alt_duration, alt_freq))
+    batches = [paths[i:i + batch] for i in range(0, len(paths), batch)]
+    if jobs == 1:
+        for b in batches:
+            out.write(_convert_batch(b))
+    else:
+        with Pool(jobs) as pool:
+            for data in pool.imap(_convert_batch, batches):
+                out.write(data)
+    return len(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert 224x144 TGA frames to an MSU-1 video file.")
+    parser.add_argument("directory", nargs="?", default=".", help="directory with the numbered frames")
+    parser.add_argument("-o", "--output", default="out.msu")
+    parser.add_argument("--pattern", default=PATTERN, help="frame file name pattern")
+    parser.add_argument("--duration", type=int, default=2, help="fields per frame")
+    parser.add_argument("--alt-duration", type=int, default=0, help="fields for every --alt-freq-th frame")
+    parser.add_argument("--alt-freq", type=int, default=0, help="use --alt-duration every n frames")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--batch", type=int, default=32, help="frames per task")
+    args = parser.parse_args()
+
+    paths = frame_paths(args.directory, args.pattern)
+    if not paths:
+        parser.error(f"no frames matching {args.pattern} in {args.directory}")
+    t0 = time.perf_counter()
+    with open(args.output, "wb") as out:
+        count = convert(paths, out, args.duration, args.alt_duration, args.alt_freq, args.jobs, args.batch)
+    elapsed = time.perf_counter() - t0
+    print(f"{count} images processed in {elapsed:.1f}s ({count / elapsed:.0f} frames/s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Bank-parallel disassembly and image comparison.
+
+The image (or both images for a comparison) is copied once into
+multiprocessing.shared_memory and a process pool works on it in ranges:
+64 KB banks by default, or one range per label with --labels. Workers
+attach to the shared block instead of receiving the bytes, and results
+come back in range order, so the output is identical to --jobs 1 (which
+runs in-process) whatever the pool size.
+
+Each range is swept linearly with disasm65 (like compare_wram's
+disasm_block), starting with the given M/X flags. Comparison finds the
+differing bytes with numpy, groups them into hunks and disassembles only
+the instructions that overlap a hunk, on both sides.
+
+Usage:
+    pardisasm.py disasm menu.bin [--map menu] [--labels menu.labels] [-j 8] [--chunk 10000]
+    pardisasm.py compare orig.bin port.bin [--map lorom] [-j 8] [--context 8]
+"""
+
+import argparse
+import bisect
+import time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+import disasm65
+import snesmap
+
+BANK_SIZE = 0x10000
+
+# per-worker state set up by _init_worker()
+_images = []
+_mapper = None
+_flags = (True, True)
+
+
+def _init_worker(specs, mapper, flags):
+    global _mapper, _flags
+    _mapper = mapper
+    _flags = flags
+    for name, size in specs:
+        shm = shared_memory.SharedMemory(name=name)
+        _images.append((shm, shm.buf[:size]))
+
+
+def _views():
+    return [view for _, view in _images]
+
+
+def bank_ranges(size, chunk=BANK_SIZE):
+    return [(start, min(start + chunk, size)) for start in range(0, size, chunk)]
+
+
+def symbol_ranges(symbols, size):
+    """One range per distinct label offset, plus whatever comes before the first."""
+    prim = symbols.primary()
+    starts = [int(o) for o in symbols.offsets[prim]]
+    if not starts or starts[0] > 0:
+        starts.insert(0, 0)
+    ends = starts[1:] + [size]
+    return [(s, e) for s, e in zip(starts, ends) if s < e]
+
+
+def _format(data, insns, mapper):
+    if not insns:
+        return []
+    pcs = mapper.to_address(np.array([i.offset for i in insns], dtype=np.int64))
+    lines = []
+    for insn, pc in zip(insns, pcs):
+        raw = bytes(data[insn.offset:insn.offset + insn.size]).hex(" ").upper()
+        lines.append(f"  ${pc:06X}  {raw:<12} {disasm65.text(insn, int(pc))}")
+    return lines
+
+
+def _disasm_range(rng):
+    start, end = rng
+    data = _views()[0]
+    insns = disasm65.linear_sweep(data, start, end, *_flags)
+    return start, "\n".join(_format(data, insns, _mapper))
+
+
+def _hunks(a, b, start, end, context):
+    """[(lo, hi, differing bytes)] over a[start:end] vs b[start:end]."""
+    diff = np.flatnonzero(np.frombuffer(a[start:end], dtype=np.uint8)
+                          != np.frombuffer(b[start:end], dtype=np.uint8))
+    if len(diff) == 0:
+        return []
+    split = np.flatnonzero(np.diff(diff) > 2 * context) + 1
+    hunks = []
+    for group in np.split(diff, split):
+        lo = max(start, start + int(group[0]) - context)
+        hi = min(end, start + int(group[-1]) + 1 + context)
+        hunks.append((lo, hi, len(group)))
+    return hunks
+
+
+def _overlapping(insns, starts, lo, hi):
+    i = max(bisect.bisect_right(starts, lo) - 1, 0)
+    out = []
+    while i < len(insns) and insns[i].offset < hi:
+        if insns[i].offset + insns[i].size > lo:
+            out.append(insns[i])
+        i += 1
+    return out
+
+
+def _compare_range(rng, context):
+    start, end = rng
+    a, b = _views()
+    hunks = _hunks(a, b, start, end, context)
+    if not hunks:
+        return start, 0, ""
+    out = []
+    sides = []
+    for data in (a, b):
+        insns = disasm65.linear_sweep(data, start, end, *_flags)
+        sides.append((insns, [i.offset for i in insns]))
+    for lo, hi, count in hunks:
+        pc_lo, pc_hi = int(_mapper.to_address(lo)), int(_mapper.to_address(hi - 1))
+        out.append(f"@@ ${pc_lo:06X}-${pc_hi:06X}  {count} byte(s) differ")
+        left = _format(a, _overlapping(*sides[0], lo, hi), _mapper)
+        right = _format(b, _overlapping(*sides[1], lo, hi), _mapper)
+        for i in range(max(len(left), len(right))):
+            l = left[i] if i < len(left) else ""
+            r = right[i] if i < len(right) else ""
+            mark = "" if l == r else "  <<<"
+            out.append(f"{l:<44} | {r.strip():<40}{mark}")
+    return start, sum(h[2] for h in hunks), "\n".join(out)
+
+
+def _compare_task(args):
+    return _compare_range(*args)
+
+
+def run(images, ranges, func, mapper, flags=(True, True), jobs=None):
+    """Run func over ranges with images in shared memory. Results are in range order.
+
+    jobs=1 runs in this process (same code path, no pool).
+    """
+    blocks = []
+    try:
+        specs = []
+        for data in images:
+            shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+            shm.buf[:len(data)] = data
+            blocks.append(shm)
+            specs.append((shm.name, len(data)))
+        if jobs == 1:
+            _init_worker(specs, mapper, flags)
+            try:
+                return [func(r) for r in ranges]
+            finally:
+                _release()
+        with Pool(jobs, initializer=_init_worker, initargs=(specs, mapper, flags)) as pool:
+            return pool.map(func, ranges, chunksize=max(1, len(ranges) // (4 * (jobs or 8))))
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+def _release():
+    global _images
+    for shm, view in _images:
+        view.release()
+        shm.close()
+    _images = []
+
+
+def disassemble(data, mapper, ranges=None, flags=(True, True), jobs=None):
+    """[(range start, listing text)] for each range (64 KB banks by default)."""
+    ranges = ranges or bank_ranges(len(data))
+    return run([data], ranges, _disasm_range, mapper, flags, jobs)
+
+
+def compare(orig, port, mapper, ranges=None, flags=(True, True), jobs=None, context=8):
+    """[(range start, differing bytes, hunk text)] over the common length."""
+    size = min(len(orig), len(port))
+    ranges = ranges or bank_ranges(size)
+    tasks = [(r, context) for r in ranges]
+    return run([orig[:size], port[:size]], tasks, _compare_task, mapper, flags, jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Disassemble or compare images in parallel over shared memory.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("disasm")
+    p.add_argument("image")
+    p = sub.add_parser("compare")
+    p.add_argument("orig")
+    p.add_argument("port")
+    p.add_argument("--context", type=int, default=8, help="bytes of context around differences")
+    for p in sub.choices.values():
+        p.add_argument("--map", default="lorom", help="memory map (" + ", ".join(snesmap.MAPPERS) + ")")
+        p.add_argument("--labels", help="64tass label file: one range per label instead of per bank")
+        p.add_argument("--chunk", type=lambda s: int(s, 16), default=BANK_SIZE, help="range size (hex)")
+        p.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+        p.add_argument("--m16", action="store_true", help="start each range with 16-bit A")
+        p.add_argument("--x8", action="store_true", help="start each range with 8-bit X/Y")
+    args = parser.parse_args()
+
+    labels = {}
+    if args.labels:
+        from menulabels import load_labels
+        labels = load_labels(args.labels)
+    mapper = snesmap.get_mapper(args.map, labels)
+    flags = (not args.m16, args.x8)
+
+    paths = [args.image] if args.cmd == "disasm" else [args.orig, args.port]
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+    size = min(len(d) for d in images)
+    if labels:
+        from menulabels import label_widths, rom_symbols
+        ranges = symbol_ranges(rom_symbols(labels, mapper, size, label_widths(args.labels)), size)
+    else:
+        ranges = bank_ranges(size, args.chunk)
+
+    t0 = time.perf_counter()
+    if args.cmd == "disasm":
+        for _, listing in disassemble(images[0], mapper, ranges, flags, args.jobs):
+            if listing:
+                print(listing)
+    else:
+        total = 0
+        for _, count, listing in compare(images[0], images[1], mapper, ranges, flags, args.jobs, args.context):
+            total += count
+            if listing:
+                print(listing)
+        if len(images[0]) != len(images[1]):
+            print(f"sizes differ: {len(images[0])} vs {len(images[1])} bytes, compared {size}")
+        print(f"{total} byte(s) differ")
+    elapsed = time.perf_counter() - t0
+    print(f"{len(ranges)} ranges in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Find addressing-mode and REP/SEP peepholes across the menu image.
+
+64tass picks the operand size from what it knows about the data bank and
+direct page; after ".databank ?" every access is assembled long
+(compare3.py: STA $0002B6 where STA $02B6 would do). This walks the
+recursive-descent disassembly (disasm65.explore) block by block and
+infers, along the control flow, the data bank (PHK/PHA/PHX/PEA ... PLB,
+PHB/PLB pairs, MVN/MVP), the direct page (PEA/TCD ... PLD) and the M/X
+widths, then reports:
+
+    long -> dp / abs    the long operand reaches the same byte through
+                        direct page (bank 0) or the current data bank
+    abs -> dp           the absolute operand falls inside direct page
+    REP/SEP             a REP/SEP that changes nothing, or a REP/SEP pair
+                        with nothing width-dependent in between
+
+REP/SEP checks only compare the flags the instruction names (M for $20,
+X for $10), so SEP #$20 is judged with X unknown. Sites in blocks that
+explore() reached with conflicting M/X are not checked; their count is
+printed with the summary.
+
+Banks $00-$3F/$80-$BF are taken to mirror each other below $6000 (low
+WRAM, registers) and $7E to mirror them below $2000. Routines entered
+only through vectors, pointer tables or labels start from --databank
+(unknown by default) and --direct (the menu keeps D = $0000) with
+unknown M/X; called routines get the meet of their callers. Calls are
+assumed to keep DB, D and M/X and to clobber A/X/Y.
+
+Savings are bytes per site and cycles per execution, weighted by
+--trace execution counts when given, and add up per routine
+(menu.labels symbol).
+
+Usage:
+    peephole.py menu.bin [--labels snes-64tass/menu.labels] [--map menu] [--databank 00] [--direct 0000]
+    peephole.py menu.bin --trace trace.log.gz [--detail] [--only rep]
+"""
+
+import argparse
+from collections import namedtuple
+
+import disasm65
+import snesmap
+from analysisdb import WRITES, run_addresses
+from menulabels import DEFAULT_LABELS, label_widths, load_labels, rom_symbols
+
+STACK_DEPTH = 8
+REP, SEP = 0xC2, 0xE2
+WIDTH_BITS = 0x30
+
+# instructions whose effect does not depend on M or X
+WIDTH_FREE = frozenset(("NOP", "CLC", "SEC", "CLI", "SEI", "CLD", "SED", "CLV", "PHK", "PHB", "PLB",
+                        "PHD", "PLD", "PEA", "PEI", "PER", "TCD", "TDC", "TCS", "TSC", "XBA", "WDM"))
+A_WRITERS = frozenset(("LDA", "ADC", "SBC", "AND", "ORA", "EOR", "TSC"))
+SHIFTS = frozenset(("ASL", "LSR", "ROL", "ROR", "INC", "DEC"))
+
+State = namedtuple("State", "db d m x a b xr yr stack")
+Finding = namedtuple("Finding", "offset address kind text suggestion bytes cycles note")
+
+
+def _meet(s, t):
+    if s is None:
+        return t
+    vals = [u if u == v else None for u, v in zip(s[:-1], t[:-1])]
+    if len(s.stack) == len(t.stack):
+        stack = tuple(u if u == v else None for u, v in zip(s.stack, t.stack))
+    else:
+        stack = ()
+    return State(*vals, stack)
+
+
+def _push(stack, *values):
+    stack = stack + values
+    return stack[-STACK_DEPTH:]
+
+
+def _pop(stack):
+    return (stack[-1], stack[:-1]) if stack else (None, ())
+
+
+def _word(lo, hi):
+    return None if lo is None or hi is None else (hi << 8) | lo
+
+
+def step(st, insn, bank):
+    """State after one instruction; bank is the program bank it runs in."""
+    mn, v = insn.mnem, insn.operand
+    m8, x8 = insn.m_flag, insn.x_flag
+    s = st.stack
+    if insn.opcode == REP:
+        return st._replace(m=False if v & 0x20 else st.m, x=False if v & 0x10 else st.x)
+    if insn.opcode == SEP:
+        st = st._replace(m=True if v & 0x20 else st.m)
+        if v & 0x10:
+            # 8-bit index registers lose their high byte
+            st = st._replace(x=True, xr=None if st.xr is None else st.xr & 0xFF,
+                             yr=None if st.yr is None else st.yr & 0xFF)
+        return st
+    if mn == "LDA" and insn.mode == "imm":
+        return st._replace(a=v & 0xFF) if m8 else st._replace(a=v & 0xFF, b=v >> 8)
+    if mn in ("LDX", "LDY") and insn.mode == "imm":
+        return st._replace(**{"xr" if mn == "LDX" else "yr": v})
+    if mn == "PHA":
+        return st._replace(stack=_push(s, st.a) if m8 else _push(s, st.b, st.a))
+    if mn in ("PHX", "PHY"):
+        r = st.xr if mn == "PHX" else st.yr
+        if x8:
+            return st._replace(stack=_push(s, r))
+        return st._replace(stack=_push(s, None if r is None else r >> 8, None if r is None else r & 0xFF))
+    if mn == "PEA":
+        return st._replace(stack=_push(s, v >> 8, v & 0xFF))
+    if mn == "PHK":
+        return st._replace(stack=_push(s, bank))
+    if mn == "PHB":
+        return st._replace(stack=_push(s, st.db))
+    if mn == "PHD":
+        return st._replace(stack=_push(s, None if st.d is None else st.d >> 8,
+                                       None if st.d is None else st.d & 0xFF))
+    if mn in ("PHP",):
+        return st._replace(stack=_push(s, None))
+    if mn in ("PEI", "PER"):
+        return st._replace(stack=_push(s, None, None))
+    if mn == "PLB":
+        db, s = _pop(s)
+        return st._replace(db=db, stack=s)
+    if mn == "PLD":
+        lo, s = _pop(s)
+        hi, s = _pop(s)
+        return st._replace(d=_word(lo, hi), stack=s)
+    if mn == "PLA":
+        lo, s = _pop(s)
+        if m8:
+            return st._replace(a=lo, stack=s)
+        hi, s = _pop(s)
+        return st._replace(a=lo, b=hi, stack=s)
+    if mn in ("PLX", "PLY"):
+        lo, s = _pop(s)
+        r = lo
+        if not x8:
+            hi, s = _pop(s)
+            r = _word(lo, hi)
+        return st._replace(stack=s, **{"xr" if mn == "PLX" else "yr": r})
+    if mn == "PLP":
+        _, s = _pop(s)
+        return st._replace(m=None, x=None, stack=s)
+    if mn == "TCD":
+        return st._replace(d=_word(st.a, st.b))
+    if mn == "TDC":
+        return st._replace(a=None if st.d is None else st.d & 0xFF, b=None if st.d is None else st.d >> 8)
+    if mn == "XBA":
+        return st._replace(a=st.b, b=st.a)
+    if mn in ("TAX", "TAY"):
+        r = st.a if x8 else _word(st.a, st.b)
+        return st._replace(**{"xr" if mn == "TAX" else "yr": r})
+    if mn in ("TXA", "TYA"):
+        r = st.xr if mn == "TXA" else st.yr
+        lo = None if r is None else r & 0xFF
+        hi = None if r is None else r >> 8
+        return st._replace(a=lo) if m8 else st._replace(a=lo, b=hi)
+    if mn in ("TXY", "TYX"):
+        return st._replace(yr=st.xr) if mn == "TXY" else st._replace(xr=st.yr)
+    if mn in ("INX", "DEX", "INY", "DEY"):
+        reg = "xr" if mn[2] == "X" else "yr"
+        r = getattr(st, reg)
+        if r is not None:
+            r = (r + (1 if mn[0] == "I" else -1)) & (0xFF if x8 else 0xFFFF)
+        return st._replace(**{reg: r})
+    if mn in ("MVN", "MVP"):
+        return st._replace(db=v & 0xFF, a=0xFF, b=0xFF, xr=None, yr=None)
+    if insn.opcode in disasm65.CALLS or insn.opcode in disasm65.INDIRECT_CALLS:
+        return st._replace(a=None, b=None, xr=None, yr=None)
+    if mn in ("TCS", "TXS"):
+        return st._replace(stack=())
+    if mn in A_WRITERS or (mn in SHIFTS and insn.mode == "acc"):
+        return st._replace(a=None) if m8 else st._replace(a=None, b=None)
+    if mn in ("LDX", "TSX"):
+        return st._replace(xr=None)
+    if mn == "LDY":
+        return st._replace(yr=None)
+    return st
+
+
+def _system_bank(bank):
+    return (bank & 0x7F) < 0x40
+
+
+def same_byte(bank, addr, other):
+    """True if bank:addr and other:addr are the same byte."""
+    if bank == other:
+        return True
+    if other is None:
+        return False
+    banks = (bank, other)
+    if all(_system_bank(b) for b in banks):
+        return addr < 0x6000
+    if 0x7E in banks and addr < 0x2000:
+        return _system_bank(bank if bank != 0x7E else other)
+    return False
+
+
+def _cycles_to_dp(insn, d):
+    if insn.mode == "long":
+        saved = 2
+    elif insn.mode == "longx":
+        saved = 1
+    elif insn.mode == "abs":
+        saved = 1
+    else:
+        saved = int(insn.mnem in WRITES or not insn.x_flag)
+    return max(0, saved - (1 if d & 0xFF else 0))
+
+
+def addressing(insn, st):
+    """(kind, new opcode, new operand, bytes, cycles, note) for an operand that can be shortened, or None."""
+    if insn.mode not in ("long", "longx", "abs", "absx", "absy") or insn.mnem in ("JMP", "JML", "JSR", "JSL", "PEA"):
+        return None
+    is_long = insn.mode.startswith("long")
+    bank = insn.operand >> 16 if is_long else st.db
+    addr = insn.operand & 0xFFFF
+    if bank is None:
+        return None
+    dp_mode = {"long": "dp", "longx": "dpx", "abs": "dp", "absx": "dpx", "absy": "dpy"}[insn.mode]
+    op = disasm65.FORMS.get((insn.mnem, dp_mode))
+    if op is not None and st.d is not None and 0 <= addr - st.d < 0x100 and same_byte(bank, addr, 0):
+        return ("long>dp" if is_long else "abs>dp", op, addr - st.d, insn.size - 2,
+                _cycles_to_dp(insn, st.d), f"D=${st.d:04X}")
+    if is_long and st.db is not None and same_byte(bank, addr, st.db):
+        op = disasm65.FORMS.get((insn.mnem, "abs" if insn.mode == "long" else "absx"))
+        if op is not None:
+            cycles = 1 if insn.mode == "long" else int(insn.mnem not in WRITES and insn.x_flag)
+            return "long>abs", op, addr, 1, cycles, f"DB=${st.db:02X}"
+    return None
+
+
+def width_dependent(insn):
+    return insn.mnem not in WIDTH_FREE and insn.opcode not in (REP, SEP)
+
+
+def _touched(*insns):
+    """Indices into (m, x) of the width flags a set of REP/SEP instructions changes."""
+    bits = 0
+    for insn in insns:
+        bits |= insn.operand
+    return [i for i, bit in enumerate((0x20, 0x10)) if bits & bit]
+
+
+def _same(before, after, which):
+    """True if the flags in which are known before and unchanged after."""
+    return bool(which) and all(before[i] is not None and before[i] == after[i] for i in which)
+
+
+def _flag_text(m, x):
+    return f"M{'?' if m is None else 8 if m else 16} X{'?' if x is None else 8 if x else 16}"
+
+
+class Analysis:
+    """Data bank / direct page / M/X inference over an explored image."""
+
+    def __init__(self, data, mapper, symbols=None, databank=None, direct=0):
+        self.data, self.mapper = data, mapper
+        self.cm = disasm65.explore(data, disasm65.image_roots(data, mapper, symbols), mapper)
+        self.blocks = dict(self.cm.blocks())
+        self.entry = State(databank, direct, None, None, None, None, None, None, ())
+        offsets = sorted(self.cm.insns)
+        self.pc = dict(zip(offsets, (int(a) for a in run_addresses(mapper, offsets))))
+        self.states = self._solve()
+        self.skipped = 0
+
+    def _block_states(self, leader, st):
+        """Yield (insn, state before it) through a block; returns the state after it."""
+        for insn in self.blocks[leader]:
+            yield insn, st
+            st = step(st, insn, self.pc[insn.offset] >> 16)
+
+    def _solve(self):
+        cm = self.cm
+        targets = set()
+        for succ in cm.edges.values():
+            targets |= succ
+        targets |= set(cm.calls.values())
+        states = {}
+        pending = [leader for leader in sorted(self.blocks) if leader not in targets]
+        seeded = set(pending)
+        while True:
+            for leader in pending:
+                states[leader] = self.entry
+            work = list(pending)
+            while work:
+                leader = work.pop()
+                st = states[leader]
+                for insn, st in self._block_states(leader, st):
+                    if insn.offset in cm.calls:
+                        ret = 3 if insn.opcode == 0x22 else 2
+                        work += self._join(states, cm.calls[insn.offset],
+                                           st._replace(stack=_push(st.stack, *([None] * ret))))
+                last = self.blocks[leader][-1]
+                st = step(st, last, self.pc[last.offset] >> 16)
+                for succ in cm.edges.get(leader, ()):
+                    work += self._join(states, succ, st)
+            # blocks only reachable from code nobody reaches (loops, dead code) start fresh
+            pending = [leader for leader in sorted(self.blocks) if leader not in states and leader not in seeded]
+            if not pending:
+                return states
+            seeded.update(pending)
+
+    def _join(self, states, leader, st):
+        if leader not in self.blocks:
+            return []
+        new = _meet(states.get(leader), st)
+        if new == states.get(leader):
+            return []
+        states[leader] = new
+        return [leader]
+
+    def findings(self):
+        out = []
+        self.skipped = 0
+        conflicts = self.cm.conflicts
+        for leader in sorted(self.blocks):
+            if leader not in self.states:
+                continue
+            pairs = list(self._block_states(leader, self.states[leader]))
+            used = set()
+            for i, (insn, st) in enumerate(pairs):
+                addr = self.pc[insn.offset]
+                hit = addressing(insn, st)
+                if hit:
+                    kind, op, operand, nbytes, cycles, note = hit
+                    mnem, size, mode = disasm65.OPCODES[op]
+                    new = disasm65.Insn(insn.offset, op, mnem, mode, size, operand, insn.m_flag, insn.x_flag)
+                    out.append(Finding(insn.offset, addr, kind, disasm65.text(insn, addr),
+                                       disasm65.text(new, addr), nbytes, cycles, note))
+                if insn.opcode not in (REP, SEP) or insn.operand & ~WIDTH_BITS or i in used:
+                    continue
+                if leader in conflicts or insn.offset in conflicts:
+                    self.skipped += 1
+                    continue
+                after = step(st, insn, addr >> 16)
+                before_flags, after_flags = (st.m, st.x), (after.m, after.x)
+                if _same(before_flags, after_flags, _touched(insn)):
+                    out.append(Finding(insn.offset, addr, "rep/sep", disasm65.text(insn, addr), "(remove)",
+                                       2, 3, _flag_text(*before_flags)))
+                    continue
+                for j in range(i + 1, len(pairs)):
+                    other, _ = pairs[j]
+                    if other.opcode in (REP, SEP) and not other.operand & ~WIDTH_BITS:
+                        undo = step(pairs[j][1], other, addr >> 16)
+                        if _same(before_flags, (undo.m, undo.x), _touched(insn, other)):
+                            used.add(j)
+                            out.append(Finding(insn.offset, addr, "rep/sep pair",
+                                               f"{disasm65.text(insn, addr)} .. {disasm65.text(other, addr)}",
+                                               "(remove both)", 4, 6, _flag_text(*before_flags)))
+                        break
+                    if width_dependent(other):
+                        break
+        return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find addressing-mode and REP/SEP peepholes in 65816 code.")
+    parser.add_argument("image")
+    parser.add_argument("--labels", default=DEFAULT_LABELS)
+    parser.add_argument("--map", default="menu", help="memory map (" + ", ".join(snesmap.MAPPERS) + ")")
+    parser.add_argument("--databank", type=lambda s: int(s.lstrip("$"), 16),
+                        help="data bank at routines with no known caller (hex; default unknown)")
+    parser.add_argument("--direct", type=lambda s: int(s.lstrip("$"), 16), default=0,
+                        help="direct page at routines with no known caller (hex, default 0000)")
+    parser.add_argument("--trace", help="emulator trace log: weight cycles by execution counts")
+    parser.add_argument("--only", choices=("addr", "rep"), help="only addressing or only REP/SEP findings")
+    parser.add_argument("--detail", action="store_true", help="list every finding")
+    parser.add_argument("--top", type=int, default=30, help="routines to list (0: all)")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        data = f.read()
+    labels = load_labels(args.labels)
+    mapper = snesmap.get_mapper(args.map, labels)
+    symbols = rom_symbols(labels, mapper, len(data), label_widths(args.labels))
+    analysis = Analysis(data, mapper, symbols, args.databank, args.direct)
+    found = analysis.findings()
+    if args.only:
+        found = [f for f in found if f.kind.startswith("rep") == (args.only == "rep")]
+
+    counts = None
+    if args.trace:
+        import traceprof
+        counts = {}
+        for pc, n in traceprof.pc_counts(args.trace).items():
+            off = int(mapper.to_offset(pc))
+            counts[off] = counts.get(off, 0) + n
+
+    def cycles(f):
+        return f.cycles if counts is None else f.cycles * counts.get(f.offset, 0)
+
+    routines = {}
+    for f in found:
+        name, _ = symbols.lookup(f.offset)
+        row = routines.setdefault(name or "?", [0, 0, 0])
+        row[0] += 1
+        row[1] += f.bytes
+        row[2] += cycles(f)
+    unit = "cycles over the trace" if counts is not None else "cycles per pass"
+    kinds = {}
+    for f in found:
+        kinds[f.kind] = kinds.get(f.kind, 0) + 1
+    print(f"{len(found)} findings ({', '.join(f'{n} {k}' for k, n in sorted(kinds.items())) or 'none'}): "
+          f"{sum(f.bytes for f in found)} bytes, {sum(cycles(f) for f in found)} {unit}")
+    if analysis.skipped:
+        print(f"{analysis.skipped} REP/SEP sites not checked (blocks reached with conflicting M/X)")
+    if routines:
+        print(f"\n  {'sites':>5} {'bytes':>6} {'cycles':>10}  routine")
+        ranked = sorted(routines.items(), key=lambda kv: (-kv[1][1], -kv[1][2], kv[0]))
+        for name, (n, nbytes, ncycles) in ranked[:args.top or None]:
+            print(f"  {n:5d} {nbytes:6d} {ncycles:10d}  {name}")
+    if args.detail:
+        print()
+        for f in sorted(found, key=lambda f: f.offset):
+            print(f"  {symbols.format(f.offset):<32} ${f.address:06X}  {f.text:<22} -> {f.suggestion:<16} "
+                  f"-{f.bytes} bytes -{cycles(f)} cycles  {f.kind} ({f.note})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Map an image into fill, RLE-friendly, plain and already-packed regions.
+
+The image is cut into --step byte blocks. Each block is judged by the
+--window bytes centred on it: byte entropy (with the Miller-Madow
+correction, so small windows of random data still read close to 8
+bits/byte), the share of bytes in runs of 4 or more, and the size the
+optimal src/rle.c encoding (rle.run_cost) would take for those bytes.
+All of it comes from one bincount of (block, byte) pairs and cumulative
+sums over the blocks and the per-byte RLE cost, so a 4 MB ROM is a
+single NumPy pass.
+
+Islands shorter than a window between two blocks of one class take that
+class, then adjacent blocks of the same class are merged into regions:
+
+    fill    RLE gain >= 75% (erased flash, padding, cleared tables)
+    rle     RLE gain >= --min-gain, worth compressing with rle.py
+    sparse  entropy < 4 bits/byte (tilemaps, fonts, low colour graphics)
+    mixed   everything else: code and ordinary tables
+    packed  corrected entropy >= 7.4 bits/byte, already compressed
+
+Region statistics are recomputed over the merged range. With --labels
+each region is annotated with the symbols it starts and ends in. -o
+writes the map as JSON; load_regions()/region_mask() read it back.
+disasm65.py --regions uses it to keep symbol roots out of fill and packed
+data, and rle.py stats --regions measures the rle and fill regions as
+separate assets. gfxasset.py does not read it.
+
+Usage:
+    regionmap.py menu.bin [--labels snes-64tass/menu.labels] [--map menu] [-o regions.json]
+    regionmap.py rom.sfc --map hirom [--window 1024] [--step 256] [--min-gain 0.1]
+"""
+
+import argparse
+import json
+from collections import namedtuple
+
+import numpy as np
+
+import snesmap
+from menulabels import load_symbols
+from rle import _SPECIAL_LUT, find_runs, run_cost
+
+CLASSES = ("fill", "rle", "sparse", "mixed", "packed")
+SKIP_CLASSES = ("fill", "packed")
+
+FILL_GAIN = 0.75
+MIN_GAIN = 0.10
+SPARSE_ENTROPY = 4.0
+PACKED_ENTROPY = 7.4
+LONG_RUN = 4
+
+Region = namedtuple("Region", "start end cls entropy rle_gain run_share start_sym end_sym")
+
+
+def _entropy(counts):
+    """Miller-Madow corrected byte entropy of each row of a (n, 256) count array."""
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum(axis=1)
+    p = counts / np.maximum(total, 1)[:, None]
+    h = -(p * np.log2(np.where(p > 0, p, 1))).sum(axis=1)
+    distinct = (counts > 0).sum(axis=1)
+    h += (distinct - 1) / (2 * np.log(2) * np.maximum(total, 1))
+    return np.minimum(h, 8.0)
+
+
+class ImageStats:
+    """Block histograms plus prefix sums of RLE cost and long-run bytes."""
+
+    def __init__(self, data, step):
+        a = np.frombuffer(bytes(data), dtype=np.uint8)
+        self.size = len(a)
+        self.step = step
+        nblocks = max(1, -(-self.size // step))
+        block = np.arange(self.size, dtype=np.int64) // step
+        counts = np.bincount(block * 256 + a, minlength=nblocks * 256).reshape(nblocks, 256)
+        self.cum_counts = np.vstack((np.zeros((1, 256), dtype=np.int64),
+                                     np.cumsum(counts, axis=0, dtype=np.int64)))
+
+        starts, lengths, values = find_runs(a)
+        cost = run_cost(lengths, _SPECIAL_LUT[values]) if len(lengths) else lengths
+        self.cum_cost = np.concatenate(([0.0], np.cumsum(np.repeat(cost / np.maximum(lengths, 1), lengths))))
+        self.cum_long = np.concatenate(([0], np.cumsum(np.repeat(lengths >= LONG_RUN, lengths))))
+
+    @property
+    def nblocks(self):
+        return len(self.cum_counts) - 1
+
+    def _span(self, lo, hi):
+        """Byte range of blocks lo..hi-1 (arrays)."""
+        return lo * self.step, np.minimum(hi * self.step, self.size)
+
+    def measure(self, lo, hi):
+        """(entropy, rle_gain, run_share) arrays for block ranges [lo, hi)."""
+        lo = np.asarray(lo, dtype=np.int64)
+        hi = np.asarray(hi, dtype=np.int64)
+        start, end = self._span(lo, hi)
+        nbytes = np.maximum(end - start, 1)
+        entropy = _entropy(self.cum_counts[hi] - self.cum_counts[lo])
+        gain = 1.0 - (self.cum_cost[end] - self.cum_cost[start]) / nbytes
+        share = (self.cum_long[end] - self.cum_long[start]) / nbytes
+        return entropy, gain, share
+
+    def block_windows(self, window):
+        """Window statistics centred on every block."""
+        k = max(1, window // self.step)
+        j = np.arange(self.nblocks)
+        lo = np.clip(j - (k - 1) // 2, 0, max(self.nblocks - k, 0))
+        hi = np.minimum(lo + k, self.nblocks)
+        return self.measure(lo, hi)
+
+
+def classify(entropy, gain, min_gain=MIN_GAIN):
+    """Class index (into CLASSES) for each window."""
+    cls = np.full(len(entropy), CLASSES.index("mixed"), dtype=np.int64)
+    cls[entropy < SPARSE_ENTROPY] = CLASSES.index("sparse")
+    cls[entropy >= PACKED_ENTROPY] = CLASSES.index("packed")
+    cls[gain >= min_gain] = CLASSES.index("rle")
+    cls[gain >= FILL_GAIN] = CLASSES.index("fill")
+    return cls
+
+
+def smooth(cls, k):
+    """Relabel runs of fewer than k blocks that sit between two runs of one class."""
+    change = np.flatnonzero(cls[1:] != cls[:-1]) + 1
+    lo = np.concatenate(([0], change))
+    hi = np.append(change, len(cls))
+    cls = cls.copy()
+    for i in range(1, len(lo) - 1):
+        if hi[i] - lo[i] < k and cls[lo[i-1]] == cls[hi[i]]:
+            cls[lo[i]:hi[i]] = cls[hi[i]]
+    return cls
+
+
+def region_map(data, window=256, step=64, min_gain=MIN_GAIN, symbols=None):
+    """Return the merged list of Regions for an image."""
+    if step <= 0 or window < step:
+        raise ValueError("need 0 < step <= window")
+    stats = ImageStats(data, step)
+    entropy, gain, _ = stats.block_windows(window)
+    cls = smooth(classify(entropy, gain, min_gain), max(1, window // step))
+    change = np.flatnonzero(cls[1:] != cls[:-1]) + 1
+    lo = np.concatenate(([0], change))
+    hi = np.append(change, len(cls))
+    r_entropy, r_gain, r_share = stats.measure(lo, hi)
+    regions = []
+    for i in range(len(lo)):
+        start, end = int(lo[i] * step), int(min(hi[i] * step, stats.size))
+        if start >= end:
+            continue
+        start_sym = symbols.format(start) if symbols is not None else None
+        end_sym = symbols.format(end - 1) if symbols is not None else None
+        regions.append(Region(start, end, CLASSES[cls[lo[i]]], float(r_entropy[i]), float(r_gain[i]),
+                              float(r_share[i]), start_sym, end_sym))
+    return regions
+
+
+def save_regions(path, regions, size, window, step, map_name):
+    doc = {
+        "size": size, "window": window, "step": step, "map": map_name,
+        "regions": [
+            {"start": r.start, "end": r.end, "class": r.cls,
+             "entropy": round(r.entropy, 3), "rle_gain": round(r.rle_gain, 3),
+             "run_share": round(r.run_share, 3), "from": r.start_sym, "to": r.end_sym}
+            for r in regions
+        ],
+    }
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=1)
+
+
+def load_regions(path):
+    """Read a map written by save_regions() back into Regions."""
+    with open(path, "r") as f:
+        doc = json.load(f)
+    return [Region(r["start"], r["end"], r["class"], r["entropy"], r["rle_gain"],
+                   r["run_share"], r.get("from"), r.get("to")) for r in doc["regions"]]
+
+
+def region_mask(regions, size, classes=SKIP_CLASSES):
+    """Boolean array over image offsets: True inside regions of the given classes."""
+    mask = np.zeros(size, dtype=bool)
+    for r in regions:
+        if r.cls in classes:
+            mask[r.start:min(r.end, size)] = True
+    return mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entropy and RLE compressibility map of an image.")
+    parser.add_argument("image")
+    parser.add_argument("--labels", help="64tass label file to annotate regions with")
+    parser.add_argument("--map", default="menu", help="memory map (" + ", ".join(snesmap.MAPPERS) + ")")
+    parser.add_argument("--window", type=lambda s: int(s, 0), default=256, help="bytes per entropy window")
+    parser.add_argument("--step", type=lambda s: int(s, 0), default=64, help="region granularity in bytes")
+    parser.add_argument("--min-gain", type=float, default=MIN_GAIN,
+                        help="RLE gain (fraction of bytes saved) to call a region compressible")
+    parser.add_argument("-o", "--output", help="write the region map as JSON")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        data = f.read()
+    try:
+        mapper = snesmap.get_mapper(args.map)
+        symbols = load_symbols(args.labels, mapper, len(data)) if args.labels else None
+        regions = region_map(data, args.window, args.step, args.min_gain, symbols)
+    except ValueError as e:
+        parser.error(str(e))
+
+    for r in regions:
+        addr = int(mapper.to_address(r.start))
+        where = f"  {r.start_sym} .. {r.end_sym}" if symbols is not None else ""
+        print(f"  ${addr:06X} ${r.start:06X}-${r.end:06X} {r.end - r.start:7d}  {r.cls:<6} "
+              f"{r.entropy:4.2f} b/B  rle {100 * r.rle_gain:5.1f}%  runs {100 * r.run_share:5.1f}%{where}")
+
+    print()
+    for cls in CLASSES:
+        picked = [r for r in regions if r.cls == cls]
+        if picked:
+            size = sum(r.end - r.start for r in picked)
+            saved = sum((r.end - r.start) * r.rle_gain for r in picked)
+            print(f"  {cls:<6} {len(picked):5d} regions {size:8d} bytes ({100.0 * size / len(data):5.1f}%), "
+                  f"rle would save {saved:.0f}")
+    if args.output:
+        save_regions(args.output, regions, len(data), args.window, args.step, args.map)
+        print(f"\n{len(regions)} regions written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+RLE codec for the firmware's compressed asset format (src/rle.c, utils/derle.c).
+
+Token format:
+    RLE_RUN     $5B vv nn       nn copies of vv (1..255)
+    RLE_RUNLONG $77 vv ll hh    hhll copies of vv (1..65535)
+    RLE_ESC     $9B vv          literal vv (needed for $5B/$77/$9B)
+    anything else               literal byte
+
+Tokens never span a change of byte value, so the smallest encoding is the
+sum of the smallest encodings of each maximal run. For a run of R bytes
+that is R // 65535 long runs plus the cheapest of literals, a short run or
+a long run for the remainder, which is what encode() emits (ties go to the
+run token, which is fewer reads for the decoder).
+
+decode() matches derle.c, where a zero-length run emits nothing
+(rle_file_getc() would wrap it to 65536 bytes). decode_mem() matches
+rle_mem_getc() as used by load_bootrle()/fpga_rompgm(): those stop as soon
+as the input pointer reaches the end, so the last token is never output.
+Use encode(..., mem_pad=True) for streams that are decoded from memory.
+
+stats --regions takes a regionmap.py map and measures each region of the
+given classes (rle and fill by default) on its own, which is what packing
+those ranges as separate assets would save.
+
+Usage:
+    rle.py encode in.bin out.rle [--mem-pad]
+    rle.py decode in.rle out.bin [--mem]
+    rle.py stats in.bin [--regions regions.json] [--classes rle,fill]
+"""
+
+import argparse
+import re
+
+import numpy as np
+
+RLE_ESC = 0x9B
+RLE_RUN = 0x5B
+RLE_RUNLONG = 0x77
+
+RUN_MAX = 0xFF
+RUNLONG_MAX = 0xFFFF
+
+CHUNK_SIZE = 1 << 20
+
+_SPECIAL = re.compile(rb"[\x5b\x77\x9b]")
+_SPECIAL_LUT = np.zeros(256, dtype=bool)
+_SPECIAL_LUT[[RLE_ESC, RLE_RUN, RLE_RUNLONG]] = True
+
+
+def find_runs(data):
+    """Vectorized run detection. Returns (starts, lengths, values) arrays."""
+    a = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+    if len(a) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=np.uint8)
+    starts = np.flatnonzero(np.concatenate(([True], a[1:] != a[:-1])))
+    lengths = np.diff(np.append(starts, len(a)))
+    return starts, lengths, a[starts]
+
+
+def run_cost(length, escaped):
+    """Encoded size of a run of `length` equal bytes (all arrays or scalars)."""
+    length = np.asarray(length)
+    full, rem = np.divmod(length, RUNLONG_MAX)
+    lit = rem * (1 + np.asarray(escaped, dtype=np.int64))
+    tok = np.where(rem <= RUN_MAX, 3, 4)
+    return full * 4 + np.where(rem == 0, 0, np.minimum(lit, tok))
+
+
+def _run_tokens(value, length, escaped):
+    """Optimal token bytes for one run (the non-vectorized slow path)."""
+    out = bytearray()
+    while length >= RUNLONG_MAX:
+        out += bytes([RLE_RUNLONG, value, 0xFF, 0xFF])
+        length -= RUNLONG_MAX
+    if length == 0:
+        return out
+    lit_cost = length * (2 if escaped else 1)
+    if length <= RUN_MAX and lit_cost >= 3:
+        out += bytes([RLE_RUN, value, length])
+    elif length > RUN_MAX and lit_cost >= 4:
+        out += bytes([RLE_RUNLONG, value, length & 0xFF, length >> 8])
+    elif escaped:
+        out += bytes([RLE_ESC, value]) * length
+    else:
+        out += bytes([value]) * length
+    return out
+
+
+def _encode_block(a, out):
+    """Append the optimal encoding of uint8 array `a` to bytearray `out`."""
+    starts, lengths, values = find_runs(a)
+    if len(starts) == 0:
+        return
+    escaped = _SPECIAL_LUT[values]
+    # runs that come out as their own bytes unchanged can be block-copied
+    plain = ~escaped & (lengths < 3)
+    change = np.flatnonzero(np.diff(plain.astype(np.int8))) + 1
+    bounds = np.concatenate(([0], change, [len(starts)]))
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        if plain[lo]:
+            end = starts[hi] if hi < len(starts) else len(a)
+            out += a[starts[lo]:end].tobytes()
+        else:
+            for i in range(lo, hi):
+                out += _run_tokens(int(values[i]), int(lengths[i]), bool(escaped[i]))
+
+
+def encode(data, mem_pad=False):
+    """Encode bytes with the smallest possible token stream.
+
+    mem_pad appends a throwaway literal so decode_mem() yields all data
+    (the memory decoder drops the final token).
+    """
+    out = bytearray()
+    _encode_block(np.frombuffer(bytes(data), dtype=np.uint8), out)
+    if mem_pad:
+        out.append(0)
+    return bytes(out)
+
+
+def encode_stream(fin, fout, chunk_size=CHUNK_SIZE, mem_pad=False):
+    """Encode file object fin into fout in bounded memory.
+
+    The trailing run of each chunk is carried into the next one; whole
+    65535-byte long runs are flushed early since the optimal encoding
+    always contains them. Returns (bytes_in, bytes_out).
+    """
+    carry = b""
+    total_in = total_out = 0
+    while True:
+        chunk = fin.read(chunk_size)
+        total_in += len(chunk)
+        buf = np.frombuffer(carry + chunk, dtype=np.uint8)
+        if not chunk:
+            out = bytearray()
+            _encode_block(buf, out)
+            if mem_pad:
+                out.append(0)
+            fout.write(out)
+            return total_in, total_out + len(out)
+        if len(buf) == 0:
+            continue
+        starts, lengths, values = find_runs(buf)
+        last = int(starts[-1])
+        tail_len = len(buf) - last
+        out = bytearray()
+        _encode_block(buf[:last], out)
+        full = tail_len // RUNLONG_MAX
+        out += bytes([RLE_RUNLONG, int(values[-1]), 0xFF, 0xFF]) * full
+        carry = buf[last + full * RUNLONG_MAX:].tobytes()
+        fout.write(out)
+        total_out += len(out)
+
+
+def _decode_tokens(data, out, pos=0, final=True):
+    """Decode tokens from data[pos:] into out. Returns position of the first
+    unconsumed byte (an incomplete token at the end when final is False)."""
+    n = len(data)
+    while pos < n:
+        m = _SPECIAL.search(data, pos)
+        end = m.start() if m else n
+        out += data[pos:end]
+        pos = end
+        if pos >= n:
+            break
+        tok = data[pos]
+        need = 2 if tok == RLE_ESC else 3 if tok == RLE_RUN else 4
+        if pos + need > n:
+            if final:
+                raise ValueError(f"truncated RLE token at offset {pos}")
+            break
+        if tok == RLE_ESC:
+            out.append(data[pos+1])
+        elif tok == RLE_RUN:
+            out += bytes([data[pos+1]]) * data[pos+2]
+        else:
+            out += bytes([data[pos+1]]) * (data[pos+2] | (data[pos+3] << 8))
+        pos += need
+    return pos
+
+
+def decode(data):
+    """Decode like derle.c (a zero-length run emits nothing)."""
+    out = bytearray()
+    _decode_tokens(bytes(data), out)
+    return bytes(out)
+
+
+def decode_mem(data):
+    """Decode like the rle_mem_getc() loops in load_bootrle()/fpga_rompgm().
+
+    Zero-length runs come out as 65536 bytes here (the counter is
+    decremented before it is tested); the final token is dropped.
+    """
+    data = bytes(data)
+    out = bytearray()
+    pos = 0
+    n = len(data)
+    while pos < n:
+        tok = data[pos]
+        if tok not in (RLE_RUN, RLE_RUNLONG, RLE_ESC):
+            m = _SPECIAL.search(data, pos)
+            if m is None:
+                out += data[pos:n-1]
+                break
+            out += data[pos:m.start()]
+            pos = m.start()
+            continue
+        size = 2 if tok == RLE_ESC else 3 if tok == RLE_RUN else 4
+        if pos + size >= n:
+            break
+        if tok == RLE_ESC:
+            out.append(data[pos+1])
+        elif tok == RLE_RUN:
+            out += bytes([data[pos+1]]) * (data[pos+2] or 0x10000)
+        else:
+            out += bytes([data[pos+1]]) * ((data[pos+2] | (data[pos+3] << 8)) or 0x10000)
+        pos += size
+    return bytes(out)
+
+
+def decode_stream(fin, fout, chunk_size=CHUNK_SIZE):
+    """Decode file object fin into fout in bounded memory (derle.c semantics)."""
+    tail = b""
+    total = 0
+    while True:
+        chunk = fin.read(chunk_size)
+        data = tail + chunk
+        out = bytearray()
+        pos = _decode_tokens(data, out, final=not chunk)
+        fout.write(out)
+        total += len(out)
+        if not chunk:
+            return total
+        tail = data[pos:]
+
+
+def stats(data):
+    """Return a dict of run statistics and the optimal encoded size."""
+    starts, lengths, values = find_runs(data)
+    escaped = _SPECIAL_LUT[values]
+    size = int(run_cost(lengths, escaped).sum()) if len(lengths) else 0
+    return {
+        "size": len(data),
+        "runs": len(lengths),
+        "runs_ge4": int((lengths >= 4).sum()),
+        "longest_run": int(lengths.max()) if len(lengths) else 0,
+        "escaped_literals": int(lengths[escaped & (lengths < 3)].sum()),
+        "encoded_size": size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode/decode the sd2snes RLE asset format.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("encode")
+    p.add_argument("input")
+    p.add_argument("output")
+    p.add_argument("--mem-pad", action="store_true",
+                   help="append a pad byte for streams decoded by rle_mem_getc()")
+    p = sub.add_parser("decode")
+    p.add_argument("input")
+    p.add_argument("output")
+    p.add_argument("--mem", action="store_true", help="decode like rle_mem_getc() (drops last token)")
+    p = sub.add_parser("stats")
+    p.add_argument("input")
+    p.add_argument("--regions", help="regionmap.py map: measure only the regions of --classes")
+    p.add_argument("--classes", default="rle,fill", help="comma separated region classes to measure")
+    args = parser.parse_args()
+
+    if args.cmd == "encode":
+        with open(args.input, "rb") as fin, open(args.output, "wb") as fout:
+            n_in, n_out = encode_stream(fin, fout, mem_pad=args.mem_pad)
+        ratio = 100.0 * n_out / n_in if n_in else 0.0
+        print(f"{n_in} -> {n_out} bytes ({ratio:.1f}%)")
+    elif args.cmd == "decode":
+        if args.mem:
+            with open(args.input, "rb") as f:
+                data = decode_mem(f.read())
+            with open(args.output, "wb") as f:
+                f.write(data)
+            n_out = len(data)
+        else:
+            with open(args.input, "rb") as fin, open(args.output, "wb") as fout:
+                n_out = decode_stream(fin, fout)
+        print(f"{n_out} bytes written to {args.output}")
+    elif args.regions:
+        from regionmap import load_regions
+        with open(args.input, "rb") as f:
+            data = f.read()
+        classes = args.classes.split(",")
+        n_in = n_out = 0
+        for r in load_regions(args.regions):
+            if r.cls not in classes or r.start >= len(data):
+                continue
+            s = stats(data[r.start:r.end])
+            n_in += s["size"]
+            n_out += s["encoded_size"]
+            print(f"  ${r.start:06X}-${r.end:06X} {r.cls:<6} {s['size']:7d} -> {s['encoded_size']:7d}")
+        ratio = 100.0 * n_out / n_in if n_in else 0.0
+        print(f"{n_in} -> {n_out} bytes ({ratio:.1f}%) in {','.join(classes)} regions")
+    else:
+        with open(args.input, "rb") as f:
+            s = stats(f.read())
+        for k, v in s.items():
+            print(f"  {k:<18} {v}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Index a directory tree of SNES ROM images by header checksum.
+
+Each file is memory-mapped and scored with the same header heuristics as
+smc_id()/smc_headerscore() (src/smc.c), which gives the copier header,
+memory map, header checksum and complement, title and chipset the firmware
+will see. Files are scanned in a process pool and the results are kept in
+a JSON index; files whose size and mtime are unchanged are not rescanned.
+
+The checksum is the 16-bit value at $7FDE/$FFDE that savestate_fixes.yml
+and savestate_inputs.yml are keyed on.
+
+Usage:
+    romindex.py scan /path/to/roms [-o romindex.json] [-j 8]
+    romindex.py find romindex.json 648D [...]
+    romindex.py fixes romindex.json savestate/savestate_fixes.yml [--missing]
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from multiprocessing import Pool
+
+from ssfix_compile import parse_fixes_file
+
+ROM_EXTENSIONS = (".sfc", ".smc", ".swc", ".fig", ".bs")
+INDEX_VERSION = 1
+
+# header locations tried by smc_id(), odd entries are behind a 512 byte copier header
+HDR_ADDR = (0xFFB0, 0x101B0, 0x7FB0, 0x81B0, 0x40FFB0, 0x4101B0)
+HEADER_SIZE = 0x50
+
+# offsets into snes_header_t (starts at $xxB0)
+H_GAMECODE = 0x02
+H_EXPRAMSIZE = 0x0D
+H_CARTTYPE2 = 0x0F
+H_NAME = 0x10
+H_MAP = 0x25
+H_CARTTYPE = 0x26
+H_ROMSIZE = 0x27
+H_RAMSIZE = 0x28
+H_DESTCODE = 0x29
+H_LICENSEE = 0x2A
+H_VER = 0x2B
+H_CCHK = 0x2C
+H_CHK = 0x2E
+H_RESET = 0x4C
+
+RESET_SCORE = {
+    0x78: 8, 0x18: 8, 0x38: 8, 0x9C: 8, 0x4C: 8, 0x5C: 8,
+    0xC2: 4, 0xE2: 4, 0xAD: 4, 0xAE: 4, 0xAC: 4, 0xAF: 4, 0xA9: 4,
+    0xA2: 4, 0xA0: 4, 0x20: 4, 0x22: 4,
+    0x40: -4, 0x60: -4, 0x6B: -4, 0xCD: -4, 0xEC: -4, 0xCC: -4,
+    0x00: -8, 0x02: -8, 0xDB: -8, 0x42: -8, 0xFF: -8,
+}
+
+MAP_NAMES = {
+    0x20: "LoROM", 0x21: "HiROM", 0x22: "ExLoROM", 0x23: "SA-1",
+    0x25: "ExHiROM", 0x2A: "SPC7110",
+}
+
+COPROCESSORS = {
+    0x0: "DSP", 0x1: "GSU", 0x2: "OBC1", 0x3: "SA-1", 0x4: "S-DD1",
+    0x5: "S-RTC", 0xE: "other", 0xF: "custom",
+}
+
+CUSTOM_CHIPS = {0x00: "SPC7110", 0x01: "ST010/ST011", 0x02: "ST018", 0x10: "Cx4"}
+
+
+def header_score(rom, addr):
+    """Port of smc_headerscore() for a header candidate at file offset addr."""
+    if addr + HEADER_SIZE > len(rom):
+        return 0
+    h = rom[addr:addr+HEADER_SIZE]
+    header_offset = 0x200 if (addr & 0xFFF) == 0x1B0 else 0
+    mapper = h[H_MAP] & ~0x10
+    bsxmapper = h[H_RAMSIZE] & ~0x10
+    resetvector = h[H_RESET] | (h[H_RESET+1] << 8)
+    cchk, chk = struct.unpack_from("<HH", h, H_CCHK)
+    score = 0
+    bsx_bytecode_adjust = 0
+
+    if h[H_LICENSEE] == 0x33: score += 2
+    if cchk + chk == 0xFFFF: score += 4
+    if h[H_CARTTYPE] < 0x08: score += 1
+    if h[H_ROMSIZE] < 0x10: score += 1
+    if h[H_RAMSIZE] < 0x08: score += 1
+    if h[H_DESTCODE] < 0x0E: score += 1
+    if not (h[H_DESTCODE] & 0x40) and not (h[H_DESTCODE] & 0xF): score += 1
+    if h[H_GAMECODE:H_GAMECODE+4] == b"\x00\x01\x00\x00":
+        score += 1
+        bsx_bytecode_adjust = 2
+
+    if not bsx_bytecode_adjust and resetvector < 0x8000:
+        return 0
+
+    base = addr - header_offset
+    if base == 0x007FB0 and (mapper == 0x20 or bsxmapper == 0x20): score += 2
+    if base == 0x00FFB0 and (mapper == 0x21 or bsxmapper == 0x21): score += 2
+    if base == 0x007FB0 and mapper == 0x22: score += 2
+    if base == 0x40FFB0 and mapper == 0x25: score += 2
+
+    reset_addr = ((base & ~0x7FFF) | (resetvector & 0x7FFF)) + header_offset
+    if reset_addr < len(rom):
+        delta = RESET_SCORE.get(rom[reset_addr], 0)
+        if delta < 0:
+            delta += bsx_bytecode_adjust
+        score += delta
+
+    if score and addr > 0x400000: score += 4
+    return max(score, 0)
+
+
+def find_header(rom):
+    """Pick the header candidate like smc_id(). Returns (index, score)."""
+    maxscore, score_idx = 1, 2
+    for num, addr in enumerate(HDR_ADDR):
+        score = header_score(rom, addr)
+        if score >= maxscore:
+            score_idx, maxscore = num, score
+    return score_idx, maxscore
+
+
+def is_bsx(h):
+    """BS-X memory pack header check from smc_id()."""
+    return (h[H_NAME+0x13] in (0x00, 0xFF) and h[H_NAME+0x14] == 0x00
+            and h[H_MAP] in (0x00, 0x80, 0x84, 0x8C, 0x9C, 0xBC, 0xFC)
+            and h[H_LICENSEE] in (0x33, 0xFF))
+
+
+def mapping_name(h, score_idx, size):
+    """Memory map the firmware selects for this header."""
+    if is_bsx(h):
+        return "BS-X"
+    mapper = h[H_MAP] & 0xEF
+    if mapper == 0x22 and h[H_CARTTYPE] in (0x43, 0x45):
+        return "ExLoROM" if size == 0xC00200 else "S-DD1"
+    if mapper in MAP_NAMES:
+        return MAP_NAMES[mapper]
+    if score_idx in (0, 1):
+        return "HiROM"
+    if score_idx in (2, 3):
+        return "ExLoROM" if size > 0x800200 else "LoROM"
+    return "ExHiROM"
+
+
+def chipset_name(h):
+    """Human-readable cartridge type (ROM/RAM/battery/coprocessor)."""
+    carttype = h[H_CARTTYPE]
+    parts = ["ROM"]
+    low = carttype & 0xF
+    if low in (1, 2, 4, 5):
+        parts.append("RAM")
+    if low in (2, 5, 6):
+        parts.append("Battery")
+    if low >= 3:
+        chip = COPROCESSORS.get(carttype >> 4, f"chip{carttype >> 4:X}")
+        if carttype >> 4 == 0xF:
+            chip = CUSTOM_CHIPS.get(h[H_CARTTYPE2], f"custom{h[H_CARTTYPE2]:02X}")
+        parts.append(chip)
+    if carttype == 0x55:
+        parts.append("S-RTC")
+    return "+".join(parts)
+
+
+def scan_rom(rom, size):
+    """Identify one ROM image (a bytes-like object). Returns a dict."""
+    score_idx, score = find_header(rom)
+    addr = HDR_ADDR[score_idx]
+    h = bytes(rom[addr:addr+HEADER_SIZE]).ljust(HEADER_SIZE, b"\0")
+    cchk, chk = struct.unpack_from("<HH", h, H_CCHK)
+    return {
+        "checksum": f"{chk:04X}",
+        "complement": f"{cchk:04X}",
+        "checksum_ok": cchk + chk == 0xFFFF,
+        "title": h[H_NAME:H_NAME+21].decode("latin-1").rstrip("\0 \xff"),
+        "mapping": mapping_name(h, score_idx, size),
+        "map": h[H_MAP],
+        "carttype": h[H_CARTTYPE],
+        "chipset": chipset_name(h),
+        "romsize": h[H_ROMSIZE],
+        "ramsize": h[H_RAMSIZE],
+        "destcode": h[H_DESTCODE],
+        "version": h[H_VER],
+        "copier_header": bool(score_idx & 1),
+        "header_offset": addr,
+        "score": score,
+    }
+
+
+def scan_file(path):
+    """Worker: memory-map and identify one file. Returns (path, entry)."""
+    try:
+        st = os.stat(path)
+        entry = {"size": st.st_size, "mtime": st.st_mtime}
+        if st.st_size < 0x8000:
+            entry["error"] = "too small"
+            return path, entry
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as rom:
+            entry.update(scan_rom(rom, st.st_size))
+    except OSError as e:
+        entry = {"size": 0, "mtime": 0, "error": str(e)}
+    return path, entry
+
+
+def walk_roms(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(ROM_EXTENSIONS):
+                yield os.path.join(dirpath, name)
+
+
+def load_index(path):
+    try:
+        with open(path, "r") as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if index.get("version") != INDEX_VERSION:
+        return {}
+    return index["roms"]
+
+
+def save_index(path, roms):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"version": INDEX_VERSION, "roms": roms}, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def scan_tree(root, old=None, jobs=None):
+    """Scan a tree, reusing unchanged entries from old. Returns (roms, rescanned)."""
+    old = old or {}
+    roms = {}
+    todo = []
+    for path in walk_roms(root):
+        st = os.stat(path)
+        prev = old.get(path)
+        if prev and prev.get("size") == st.st_size and prev.get("mtime") == st.st_mtime:
+            roms[path] = prev
+        else:
+            todo.append(path)
+    if todo:
+        with Pool(jobs) as pool:
+            for path, entry in pool.imap_unordered(scan_file, todo, chunksize=16):
+                roms[path] = entry
+    return roms, len(todo)
+
+
+def by_checksum(roms):
+    result = {}
+    for path, entry in roms.items():
+        if "checksum" in entry:
+            result.setdefault(entry["checksum"], []).append(path)
+    return result
+
+
+def print_entry(path, e):
+    hdr = " +hdr" if e.get("copier_header") else ""
+    ok = "" if e.get("checksum_ok") else " (bad complement)"
+    print(f"  {e['checksum']}  {e['mapping']:<8} {e['chipset']:<24} {e['title']:<21}{hdr}{ok}  {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index SNES ROM headers by checksum.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("scan", help="scan a ROM directory tree")
+    p.add_argument("root")
+    p.add_argument("-o", "--index", default="romindex.json")
+    p.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    p.add_argument("--full", action="store_true", help="rescan all files")
+    p = sub.add_parser("find", help="look up ROMs by checksum")
+    p.add_argument("index")
+    p.add_argument("checksum", nargs="+")
+    p = sub.add_parser("fixes", help="cross-reference the index with a savestate fixes file")
+    p.add_argument("index")
+    p.add_argument("yml")
+    p.add_argument("--missing", action="store_true", help="list indexed ROMs without an entry")
+    args = parser.parse_args()
+
+    if args.cmd == "scan":
+        old = {} if args.full else load_index(args.index)
+        roms, rescanned = scan_tree(args.root, old, args.jobs)
+        save_index(args.index, roms)
+        errors = sum(1 for e in roms.values() if "error" in e)
+        print(f"{len(roms)} files indexed ({rescanned} scanned, {errors} errors) -> {args.index}")
+    elif args.cmd == "find":
+        roms = load_index(args.index)
+        index = by_checksum(roms)
+        for c in args.checksum:
+            for path in index.get(c.upper().zfill(4), []):
+                print_entry(path, roms[path])
+    else:
+        roms = load_index(args.index)
+        index = by_checksum(roms)
+        fixes = parse_fixes_file(args.yml)
+        if args.missing:
+            for checksum in sorted(set(index) - set(fixes)):
+                for path in index[checksum]:
+                    print_entry(path, roms[path])
+        else:
+            for checksum in sorted(set(index) & set(fixes)):
+                for path in index[checksum]:
+                    print_entry(path, roms[path])
+                for record in fixes[checksum]:
+                    print(f"        {record}")
+        print(f"{len(set(index) & set(fixes))} of {len(fixes)} fix entries match indexed ROMs",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+Build the menu's directory tables offline from a mounted SD card.
+
+scan_dir() (src/filetypes.c) lists one directory into SRAM when the menu
+asks for it (CMD_READDIR, ROOT_DIR = $C10000):
+
+    base_addr + 4*i       pointer to entry i: (entry - SRAM_MENU_ADDR) | type << 24
+    base_addr + 4*n       $00000000 terminator
+    base_addr + $10000    entries in readdir order: 6 byte size string
+                          (" 1024k", " <dir>"), then the name and a NUL;
+                          directory names get a trailing '/'
+
+and sort_dir() (src/sort.c) then sorts the pointers: '..' first, then
+directories, then names starting with '.', then strcasecmp() on the
+first 255 bytes of the name (without the '/' for directories). This
+walks a card in parallel (one process pool task per directory, level
+by level) and writes the same bytes for every directory the menu can
+reach, already sorted, so the menu could load them instead of
+rescanning.
+
+Entries are filtered like scan_dir(): types from determine_filetype()
+on the 8.3 name, hidden/system entries (FAT attributes are read with
+FAT_IOCTL_GET_ATTRIBUTES on a vfat mount), dot files and dot
+directories except '..', directories containing "sd2snes", and at most
+16000 entries. Names are the long names in code page 1252. FatFs falls
+back to the 8.3 name for long names of more than 254 bytes or with
+characters outside the code page; those are approximated (NAME~1.EXT)
+and counted in the summary. readdir order comes from os.scandir(),
+which is the on-disk order on vfat. qsort() is not stable, so entries
+whose names differ only in case may come out swapped against the device.
+
+Each table is written as one file holding the SRAM contents from
+base_addr: the pointer table and terminator, zero padded to $10000
+(scan_dir leaves those bytes alone), then the entries. index.txt lists
+the file, entry count and path for every directory.
+
+bench times the sort strategies on a synthetic directory (or a real
+one) and counts comparisons for the two firmware paths: qsort() on
+the cached pointer table up to QSORT_MAXELEM entries, ext_heapsort()
+in SRAM beyond that.
+
+Usage:
+    sddir.py build /media/sdcard -o sdindex/ [--no-sort] [--hide-extensions] [-j 8]
+    sddir.py show sdindex/00000.dir
+    sddir.py bench [--entries 16000] [--dir /media/sdcard/snes] [--repeat 3]
+"""
+
+import argparse
+import fcntl
+import functools
+import os
+import random
+import re
+import struct
+import sys
+import time
+from collections import namedtuple
+from multiprocessing import Pool
+
+import numpy as np
+
+SRAM_MENU_ADDR = 0xC00000
+SRAM_DIR_ADDR = 0xC10000
+FILE_TBL_OFFSET = 0x10000
+MAX_ENTRIES = 16000
+SORT_STRLEN = 256
+QSORT_MAXELEM = 2048
+LFN_MAX = 254
+CODEPAGE = "cp1252"
+
+# enum SNES_FTYPE (src/filetypes.h)
+TYPE_UNKNOWN = 0
+TYPE_ROM = 1
+TYPE_SRM = 2
+TYPE_SPC = 3
+TYPE_IPS = 4
+TYPE_CHT = 5
+TYPE_SKIN = 6
+TYPE_SUBDIR = 64
+TYPE_PARENT = 128
+
+# filesel_request_filelist
+MENU_TYPES = (TYPE_PARENT, TYPE_SUBDIR, TYPE_ROM, TYPE_SPC)
+LISTED_TYPES = frozenset((TYPE_ROM, TYPE_SPC, TYPE_SUBDIR, TYPE_PARENT))
+
+EXT_TYPES = {
+    "SMC": TYPE_ROM, "SFC": TYPE_ROM, "FIG": TYPE_ROM, "SWC": TYPE_ROM, "BS": TYPE_ROM,
+    "GB": TYPE_ROM, "GBC": TYPE_ROM, "SGB": TYPE_ROM,
+    "SPC": TYPE_SPC, "CHT": TYPE_CHT, "SKIN": TYPE_SKIN,
+}
+
+AM_HID = 0x02
+AM_SYS = 0x04
+FAT_IOCTL_GET_ATTRIBUTES = 0x80047210
+
+_SFN_INVALID = re.compile(r"[^A-Z0-9!#$%&'()@^_`{}~\-\x80-\xff]")
+
+Entry = namedtuple("Entry", "name type size")
+
+
+def filesize_string(size):
+    """make_filesize_string(): 5 digits right aligned plus ' ', 'k' or 'M'."""
+    unit = 0
+    while size > 9999:
+        size >>= 10
+        unit += 1
+    return f"{size:5d}".encode() + b" kM"[unit:unit + 1]
+
+
+def short_ext(name):
+    """Extension of the 8.3 name FAT would generate for a long name."""
+    if "." not in name.lstrip("."):
+        return ""
+    ext = name.rsplit(".", 1)[1].upper().replace(" ", "")
+    return _SFN_INVALID.sub("_", ext)[:3]
+
+
+def short_name(name):
+    """Approximate 8.3 name (basis name plus ~1), as FatFs lists it."""
+    base = name.rsplit(".", 1)[0] if "." in name.lstrip(".") else name
+    base = _SFN_INVALID.sub("_", base.upper().replace(" ", "").replace(".", ""))
+    ext = short_ext(name)
+    return base[:6] + "~1" + ("." + ext if ext else "")
+
+
+def file_type(name, is_dir):
+    """determine_filetype() (the extension is taken from the 8.3 name)."""
+    if is_dir:
+        return TYPE_PARENT if name == ".." else TYPE_SUBDIR
+    return EXT_TYPES.get(short_ext(name), TYPE_UNKNOWN)
+
+
+def fat_attributes(path):
+    """FAT attribute byte of a file on a vfat mount (0 elsewhere)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return 0
+    try:
+        buf = fcntl.ioctl(fd, FAT_IOCTL_GET_ATTRIBUTES, b"\0\0\0\0")
+        return struct.unpack("<I", buf)[0]
+    except OSError:
+        return 0
+    finally:
+        os.close(fd)
+
+
+def fatfs_name(name):
+    """Name bytes as f_readdir() returns them; second value is False for SFN fallbacks."""
+    try:
+        raw = name.encode(CODEPAGE)
+    except UnicodeEncodeError:
+        raw = None
+    if raw is None or len(raw) > LFN_MAX:
+        return short_name(name).encode(CODEPAGE, "replace"), False
+    return raw, True
+
+
+def read_dir(path, is_root, types=MENU_TYPES):
+    """Entries scan_dir() lists for a directory, in readdir order.
+
+    Returns (entries, subdirectories to descend into, names approximated).
+    """
+    entries = []
+    subdirs = []
+    approx = 0
+    listing = [("..", True, 0, path)] if not is_root else []
+    with os.scandir(path) as it:
+        for de in it:
+            try:
+                is_dir = de.is_dir(follow_symlinks=False)
+                size = 0 if is_dir else de.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+            listing.append((de.name, is_dir, size, de.path))
+    for name, is_dir, size, full in listing:
+        if len(entries) >= MAX_ENTRIES:
+            break
+        ftype = file_type(name, is_dir)
+        if ftype not in types or ftype not in LISTED_TYPES:
+            continue
+        if name != ".." and fat_attributes(full) & (AM_HID | AM_SYS):
+            continue
+        raw, exact = fatfs_name(name)
+        if is_dir:
+            if raw[:1] == b"." and raw[1:2] != b".":
+                continue
+            if b"sd2snes" in raw:
+                continue
+        elif raw[:1] == b".":
+            continue
+        approx += not exact
+        entries.append(Entry(raw, ftype, size & 0xFFFFFFFF))
+        if ftype == TYPE_SUBDIR:
+            subdirs.append(full)
+    return entries, subdirs, approx
+
+
+def sort_key(entry):
+    """sort_cmp_elem() as a key: parent, directories, dot names, strcasecmp()."""
+    name = entry.name[:SORT_STRLEN - 1]
+    if entry.type & TYPE_SUBDIR and name.endswith(b"/"):
+        name = name[:-1]
+    return (entry.type != TYPE_PARENT, not entry.type & TYPE_SUBDIR, name[:1] != b".", name.lower())
+
+
+def entry_name(entry, hide_extensions=False):
+    """Name bytes as scan_dir() writes them (trailing '/', hidden extension)."""
+    name = entry.name
+    if entry.type in (TYPE_SUBDIR, TYPE_PARENT):
+        return name + b"/"
+    if hide_extensions and b"." in name:
+        i = name.rindex(b".")
+        name = name[:i] + b"\x01" + name[i + 1:]
+    return name
+
+
+def build_table(entries, base_addr=SRAM_DIR_ADDR, sort=True, hide_extensions=False):
+    """SRAM bytes from base_addr as scan_dir() and sort_dir() leave them."""
+    file_tbl = bytearray()
+    pointers = []
+    file_off = base_addr + FILE_TBL_OFFSET
+    for e in entries:
+        size = b" <dir>" if e.type in (TYPE_SUBDIR, TYPE_PARENT) else filesize_string(e.size)
+        name = entry_name(e, hide_extensions)
+        sortable = e._replace(name=name)
+        pointers.append((sortable, ((file_off + len(file_tbl) - SRAM_MENU_ADDR) | (e.type << 24)) & 0xFFFFFFFF))
+        file_tbl += size + name + b"\0"
+    if sort:
+        pointers.sort(key=lambda p: sort_key(p[0]))
+    ptr_tbl = b"".join(struct.pack("<I", p) for _, p in pointers) + b"\0\0\0\0"
+    return ptr_tbl.ljust(FILE_TBL_OFFSET, b"\0") + bytes(file_tbl)
+
+
+def parse_table(data, base_addr=SRAM_DIR_ADDR):
+    """[(type, size string, name)] from a table written by build_table()."""
+    out = []
+    for i in range(0, FILE_TBL_OFFSET, 4):
+        ptr = struct.unpack_from("<I", data, i)[0]
+        if not ptr:
+            break
+        off = (ptr & 0xFFFFFF) + SRAM_MENU_ADDR - base_addr
+        end = data.index(b"\0", off + 6)
+        out.append((ptr >> 24, data[off:off + 6].decode(CODEPAGE), data[off + 6:end].decode(CODEPAGE)))
+    return out
+
+
+def _scan_task(job):
+    path, is_root, types, base_addr, sort, hide_extensions = job
+    try:
+        entries, subdirs, approx = read_dir(path, is_root, types)
+    except OSError as e:
+        return path, None, [], 0, str(e)
+    return path, build_table(entries, base_addr, sort, hide_extensions), subdirs, approx, len(entries)
+
+
+def build_index(root, outdir, types=MENU_TYPES, base_addr=SRAM_DIR_ADDR, sort=True,
+                hide_extensions=False, jobs=None):
+    """Write one table per reachable directory plus index.txt. Returns the index rows."""
+    os.makedirs(outdir, exist_ok=True)
+    rows = []
+    level = [(root, True)]
+    with Pool(jobs) as pool:
+        while level:
+            tasks = [(p, is_root, types, base_addr, sort, hide_extensions) for p, is_root in level]
+            results = sorted(pool.imap_unordered(_scan_task, tasks, chunksize=4))
+            level = []
+            for path, table, subdirs, approx, count in results:
+                rel = os.path.relpath(path, root).replace(os.sep, "/")
+                rel = "/" if rel == "." else "/" + rel
+                if table is None:
+                    print(f"  {rel}: {count}", file=sys.stderr)
+                    continue
+                fname = f"{len(rows):05d}.dir"
+                with open(os.path.join(outdir, fname), "wb") as f:
+                    f.write(table)
+                rows.append((fname, count, approx, rel))
+                level += [(d, False) for d in subdirs]
+    with open(os.path.join(outdir, "index.txt"), "w") as f:
+        for fname, count, approx, rel in rows:
+            f.write(f"{fname}\t{count}\t{rel}\n")
+    return rows
+
+
+def _c_compare(a, b, counter):
+    """sort_cmp_elem() with its early returns, for the firmware sort paths."""
+    counter[0] += 1
+    if a.type & TYPE_PARENT:
+        return -1
+    if b.type & TYPE_PARENT:
+        return 1
+    if a.type & TYPE_SUBDIR and not b.type & TYPE_SUBDIR:
+        return -1
+    if not a.type & TYPE_SUBDIR and b.type & TYPE_SUBDIR:
+        return 1
+    if a.name[:1] == b".":
+        return -1
+    if b.name[:1] == b".":
+        return 1
+    ka, kb = sort_key(a)[3], sort_key(b)[3]
+    return (ka > kb) - (ka < kb)
+
+
+def sort_heap(entries, counter):
+    """ext_heapsort(): in-place heap sort over the SRAM pointer table."""
+    a = list(entries)
+    cmp = functools.partial(_c_compare, counter=counter)
+
+    def heapify(i, size):
+        while True:
+            l, r = 2 * i + 1, 2 * i + 2
+            largest = l if l < size and cmp(a[i], a[l]) < 0 else i
+            if r < size and cmp(a[largest], a[r]) < 0:
+                largest = r
+            if largest == i:
+                return
+            a[i], a[largest] = a[largest], a[i]
+            i = largest
+
+    for i in range(len(a) // 2 - 1, -1, -1):
+        heapify(i, len(a))
+    for i in range(len(a) - 1, 0, -1):
+        a[0], a[i] = a[i], a[0]
+        heapify(0, i)
+    return a
+
+
+def sort_cmp(entries, counter):
+    """qsort() on the cached pointer table (comparison sort with the C comparator)."""
+    return sorted(entries, key=functools.cmp_to_key(functools.partial(_c_compare, counter=counter)))
+
+
+def sort_keyed(entries, counter):
+    """Precomputed keys, one pass to build them (what build uses)."""
+    return sorted(entries, key=sort_key)
+
+
+def sort_numpy(entries, counter):
+    """Stable argsort of fixed-width key strings (category byte + folded name)."""
+    keys = [bytes([(e.type != TYPE_PARENT) * 4 + (not e.type & TYPE_SUBDIR) * 2 + (sort_key(e)[2])])
+            + sort_key(e)[3] for e in entries]
+    order = np.argsort(np.array(keys, dtype=f"S{max(map(len, keys), default=1)}"), kind="stable")
+    return [entries[i] for i in order]
+
+
+SORTS = {"keyed": sort_keyed, "numpy": sort_numpy, "qsort": sort_cmp, "heapsort": sort_heap}
+
+
+def synthetic_entries(count, seed=1):
+    """A directory of random but unique ROM-like names, 10% subdirectories."""
+    rng = random.Random(seed)
+    words = ["Super", "Mario", "World", "Legend", "Zelda", "Final", "Fantasy", "Mega", "Man", "Kirby",
+             "Donkey", "Kong", "Country", "Star", "Fox", "Metroid", "Chrono", "Trigger", "Street", "Fighter",
+             "the", "of", "II", "III", "IV", "(USA)", "(Europe)", "(Japan)", "[!]", "(Rev 1)"]
+    names = set()
+    entries = [Entry(b"..", TYPE_PARENT, 0)]
+    while len(entries) < count:
+        name = " ".join(rng.choice(words) for _ in range(rng.randint(2, 7)))
+        is_dir = rng.random() < 0.1
+        name = name if is_dir else name + rng.choice((".sfc", ".smc", ".SFC", ".spc"))
+        if name.lower() in names:
+            continue
+        names.add(name.lower())
+        ftype = TYPE_SUBDIR if is_dir else file_type(name, False)
+        entries.append(Entry(name.encode(), ftype, rng.randint(0x40000, 0x600000)))
+    rng.shuffle(entries)
+    return entries
+
+
+def bench(entries, repeat=3):
+    """[(strategy, best seconds, comparisons)] for each sort strategy."""
+    results = []
+    reference = None
+    for name, fn in SORTS.items():
+        best = None
+        for _ in range(repeat):
+            counter = [0]
+            t0 = time.perf_counter()
+            out = fn(entries, counter)
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        order = [sort_key(e) for e in out]
+        if reference is None:
+            reference = order
+        elif order != reference:
+            raise ValueError(f"{name} sorts differently")
+        results.append((name, best, counter[0]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline scan_dir() tables for an SD card tree.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("build", help="write a table for every directory the menu can reach")
+    p.add_argument("root")
+    p.add_argument("-o", "--output", required=True, help="output directory")
+    p.add_argument("--no-sort", action="store_true", help="keep readdir order (sort_directories: false)")
+    p.add_argument("--hide-extensions", action="store_true", help="hide_extensions: true")
+    p.add_argument("--base", type=lambda s: int(s, 0), default=SRAM_DIR_ADDR, help="table address in SRAM")
+    p.add_argument("-j", "--jobs", type=int, help="worker processes (default: one per CPU)")
+    p = sub.add_parser("show", help="list a table")
+    p.add_argument("table")
+    p.add_argument("--base", type=lambda s: int(s, 0), default=SRAM_DIR_ADDR, help="table address in SRAM")
+    p = sub.add_parser("bench", help="time the sort strategies")
+    p.add_argument("--entries", type=int, default=MAX_ENTRIES)
+    p.add_argument("--dir", help="benchmark a real directory instead of synthetic names")
+    p.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.cmd == "build":
+        if not os.path.isdir(args.root):
+            parser.error(f"{args.root} is not a directory")
+        t0 = time.perf_counter()
+        rows = build_index(args.root, args.output, base_addr=args.base, sort=not args.no_sort,
+                           hide_extensions=args.hide_extensions, jobs=args.jobs)
+        entries = sum(r[1] for r in rows)
+        approx = sum(r[2] for r in rows)
+        print(f"{len(rows)} directories, {entries} entries in {time.perf_counter() - t0:.2f}s -> {args.output}")
+        if approx:
+            print(f"{approx} names use an approximated 8.3 name (not code page 1252 or over {LFN_MAX} bytes)")
+    elif args.cmd == "show":
+        with open(args.table, "rb") as f:
+            data = f.read()
+        for ftype, size, name in parse_table(data, args.base):
+            print(f"  {ftype:3d} {size} {name}")
+    else:
+        if args.dir:
+            entries = read_dir(args.dir, False)[0]
+        else:
+            entries = synthetic_entries(args.entries)
+        try:
+            results = bench(entries, args.repeat)
+        except ValueError as e:
+            parser.error(str(e))
+        device = "heapsort" if len(entries) > QSORT_MAXELEM else "qsort"
+        print(f"{len(entries)} entries (firmware uses {device}, QSORT_MAXELEM {QSORT_MAXELEM})")
+        for name, seconds, comparisons in results:
+            cmps = f"{comparisons:9d} comparisons" if comparisons else ""
+            print(f"  {name:<9} {1000 * seconds:9.1f} ms {cmps}")
+
+
+if __name__ == "__main__":
+    main()
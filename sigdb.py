@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Generate the shortest unique byte signature for every labelled routine.
+
+compare_wram.py finds routines in another build by hand-picked
+signatures, and 08 E2 20 C2 10 A9 80 matches more than one place. This
+builds a suffix automaton over the image instead and, for every ROM
+symbol that explore() decodes as code, walks it from each byte of the
+symbol's extent until the pattern occurs exactly once in the whole
+image. The shortest such pattern wins (the earliest one on a tie) and is
+stored with its distance from the symbol start.
+
+Operand bytes that move between builds are masked (.. in the database)
+unless --no-mask is given: absolute and long addresses of WRAM variables
+and of anything in the image, and BRL offsets. Hardware registers and
+immediates are kept. A masked byte matches any byte, which the automaton
+handles by following every transition of every live state, so the
+occurrence count stays exact.
+
+Signatures shorter than --min-len are extended to it (very short patterns
+are unique by accident and are the first to break), and --margin adds
+bytes beyond the minimum. Symbols that are not unique anywhere inside
+their extent are listed as comments.
+
+match scans an image once: every position is keyed by its byte pair, and
+each signature only checks the positions whose key equals the first two
+fixed bytes of its pattern.
+
+The automaton is pure Python, roughly a second and 100 MB per 64 KB of
+image; it is meant for menu.bin-sized images.
+
+Usage:
+    sigdb.py build menu.bin [--labels snes-64tass/menu.labels] [--map menu] [-o menu.sigs]
+                            [--no-mask] [--min-len 4] [--margin 0]
+    sigdb.py match menu.sigs other/menu.bin [--map menu]
+"""
+
+import argparse
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+import snesmap
+from disasm65 import explore, image_roots
+from menulabels import DEFAULT_LABELS, label_widths, load_labels, rom_symbols
+
+Signature = namedtuple("Signature", "name delta pattern")
+
+ADDR_MODES = frozenset(("abs", "absx", "absy", "absi", "absxi", "absil", "long", "longx"))
+
+
+class SuffixAutomaton:
+    """Suffix automaton of a byte string with per-state occurrence counts."""
+
+    def __init__(self, data):
+        nxt = [{}]
+        link = [-1]
+        length = [0]
+        count = [0]
+        last = 0
+        for b in data:
+            cur = len(nxt)
+            nxt.append({})
+            link.append(0)
+            length.append(length[last] + 1)
+            count.append(1)
+            p = last
+            while p != -1 and b not in nxt[p]:
+                nxt[p][b] = cur
+                p = link[p]
+            if p != -1:
+                q = nxt[p][b]
+                if length[p] + 1 == length[q]:
+                    link[cur] = q
+                else:
+                    clone = len(nxt)
+                    nxt.append(dict(nxt[q]))
+                    link.append(link[q])
+                    length.append(length[p] + 1)
+                    count.append(0)
+                    while p != -1 and nxt[p].get(b) == q:
+                        nxt[p][b] = clone
+                        p = link[p]
+                    link[q] = link[cur] = clone
+            last = cur
+        for s in sorted(range(1, len(nxt)), key=length.__getitem__, reverse=True):
+            count[link[s]] += count[s]
+        self.next = nxt
+        self.count = count
+
+    def step(self, states, byte):
+        """States after one more byte (None matches any byte)."""
+        if byte is None:
+            return {t for s in states for t in self.next[s].values()}
+        return {self.next[s][byte] for s in states if byte in self.next[s]}
+
+    def occurrences(self, states):
+        return sum(self.count[s] for s in states)
+
+
+def relocation_mask(data, cm, mapper):
+    """True for operand bytes whose value depends on where things were linked."""
+    mask = np.zeros(len(data), dtype=bool)
+    for insn in cm.insns.values():
+        if insn.mode == "rel16":
+            mask[insn.offset + 1:insn.offset + insn.size] = True
+        elif insn.mode in ADDR_MODES:
+            v = insn.operand
+            if insn.size == 3:
+                moves = v < 0x2000 or v >= 0x8000
+            else:
+                moves = (v >> 16) in (0x7E, 0x7F) or 0 <= int(mapper.to_offset(v)) < len(data)
+            if moves:
+                mask[insn.offset + 1:insn.offset + insn.size] = True
+    return mask
+
+
+def shortest_unique(sam, data, mask, start, end, min_len=1, margin=0):
+    """(delta, length) of the shortest unique pattern inside data[start:end], or None."""
+    best = None
+    for pos in range(start, end):
+        if mask[pos]:
+            continue
+        states = {0}
+        limit = end - pos if best is None else min(end - pos, best[1] - 1)
+        for n in range(1, limit + 1):
+            states = sam.step(states, None if mask[pos + n - 1] else data[pos + n - 1])
+            if sam.occurrences(states) == 1:
+                best = (pos - start, n)
+                break
+    if best is None:
+        return None
+    delta, n = best
+    return delta, min(max(n + margin, min_len), end - start - delta)
+
+
+def build(data, symbols, mapper, masked=True, min_len=4, margin=0):
+    """Return ([Signature], [names without a unique pattern])."""
+    roots = image_roots(data, mapper, symbols)
+    cm = explore(data, roots, mapper)
+    mask = relocation_mask(data, cm, mapper) if masked else np.zeros(len(data), dtype=bool)
+    sam = SuffixAutomaton(data)
+    sigs = []
+    missing = []
+    for i in symbols.primary():
+        name = symbols.names[i]
+        start, end = symbols.extent(name)
+        if start not in cm.insns:
+            continue
+        found = shortest_unique(sam, data, mask, start, end, min_len, margin)
+        if found is None:
+            missing.append(name)
+            continue
+        delta, n = found
+        pos = start + delta
+        pattern = [None if mask[p] else data[p] for p in range(pos, pos + n)]
+        sigs.append(Signature(name, delta, pattern))
+    return sigs, missing
+
+
+def format_pattern(pattern):
+    return " ".join(".." if b is None else f"{b:02X}" for b in pattern)
+
+
+def parse_pattern(text):
+    return [None if t == ".." else int(t, 16) for t in text.split()]
+
+
+def save(path, sigs, missing, header=""):
+    with open(path, "w") as f:
+        if header:
+            f.write(f"; {header}\n")
+        for s in sigs:
+            f.write(f"{s.name} +{s.delta:X} {format_pattern(s.pattern)}\n")
+        for name in missing:
+            f.write(f"; {name}: not unique\n")
+
+
+def load(path):
+    sigs = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(";"):
+                continue
+            name, delta, pattern = line.split(None, 2)
+            sigs.append(Signature(name, int(delta.lstrip("+"), 16), parse_pattern(pattern)))
+    return sigs
+
+
+def match(data, sigs):
+    """{name: [symbol offsets]} of every signature in data, in one pass over the image."""
+    a = np.frombuffer(bytes(data), dtype=np.uint8)
+    keys = (a[:-1].astype(np.int64) << 8) | a[1:] if len(a) > 1 else np.zeros(0, dtype=np.int64)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    found = {}
+    for s in sigs:
+        fixed = np.array([i for i, b in enumerate(s.pattern) if b is not None], dtype=np.int64)
+        values = np.array([s.pattern[i] for i in fixed], dtype=np.uint8)
+        pairs = [i for i in fixed if i + 1 < len(s.pattern) and s.pattern[i + 1] is not None]
+        if pairs:
+            j = pairs[0]
+            key = (s.pattern[j] << 8) | s.pattern[j + 1]
+            lo, hi = np.searchsorted(sorted_keys, [key, key + 1])
+            cand = order[lo:hi] - j
+        elif len(fixed):
+            cand = np.flatnonzero(a == values[0]) - fixed[0]
+        else:
+            cand = np.arange(len(a))
+        cand = cand[(cand >= 0) & (cand + len(s.pattern) <= len(a))]
+        if len(cand) and len(fixed):
+            cand = cand[(a[cand[:, None] + fixed] == values).all(axis=1)]
+        found[s.name] = [int(c) - s.delta for c in cand if c >= s.delta]
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Minimal unique routine signatures.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("build", help="write a signature database for an image")
+    p.add_argument("image")
+    p.add_argument("--labels", default=DEFAULT_LABELS)
+    p.add_argument("--map", default="menu", help="memory map (" + ", ".join(snesmap.MAPPERS) + ")")
+    p.add_argument("-o", "--output", help="signature database (default: print)")
+    p.add_argument("--no-mask", action="store_true", help="keep relocation-sensitive operand bytes")
+    p.add_argument("--min-len", type=int, default=4, help="shortest signature to emit")
+    p.add_argument("--margin", type=int, default=0, help="bytes to add beyond the unique length")
+    p = sub.add_parser("match", help="locate every signature in an image")
+    p.add_argument("sigs")
+    p.add_argument("image")
+    p.add_argument("--map", default="menu", help="memory map (" + ", ".join(snesmap.MAPPERS) + ")")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        data = f.read()
+    try:
+        mapper = snesmap.get_mapper(args.map)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.cmd == "build":
+        symbols = rom_symbols(load_labels(args.labels), mapper, len(data), label_widths(args.labels))
+        sigs, missing = build(data, symbols, mapper, not args.no_mask, args.min_len, args.margin)
+        header = f"{args.image} ({len(data)} bytes), {'unmasked' if args.no_mask else 'masked'}"
+        if args.output:
+            save(args.output, sigs, missing, header)
+        else:
+            for s in sigs:
+                print(f"  {s.name:<32} +{s.delta:<4X} {format_pattern(s.pattern)}")
+        lengths = [len(s.pattern) for s in sigs]
+        avg = sum(lengths) / len(lengths) if lengths else 0.0
+        print(f"{len(sigs)} signatures (average {avg:.1f} bytes), {len(missing)} not unique", file=sys.stderr)
+    else:
+        found = match(data, load(args.sigs))
+        counts = {"found": 0, "missing": 0, "multiple": 0}
+        for name, offs in found.items():
+            if len(offs) == 1:
+                counts["found"] += 1
+                print(f"  {name:<32} ${int(mapper.to_address(offs[0])):06X}")
+            elif offs:
+                counts["multiple"] += 1
+                print(f"  {name:<32} multiple: " + " ".join(f"${int(mapper.to_address(o)):06X}" for o in offs[:8]))
+            else:
+                counts["missing"] += 1
+                print(f"  {name:<32} missing")
+        print(", ".join(f"{v} {k}" for k, v in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Code size and bank free space per build, from the label map.
+
+A build is measured from its image and label file; nothing is
+re-assembled. Each symbol's size is its label extent (to the next label)
+minus any padding inside it, where padding is a run of at least
+--min-run fill bytes (64tass leaves the gap before the header at $C0FF00
+as zeroes). That padding is the free space of its bank. Symbols are
+grouped into sections by the source file that defines them (the .a65
+files next to the label file). Image bytes the memory map does not
+address are counted as unmapped rather than given a bank.
+
+Builds are appended to a JSON-lines store, one line per build. Each line
+keeps bank and section totals in full but only the symbol sizes that
+changed since the previous build, so the store stays small; sizes for
+any build are rebuilt by replaying it. Recording a build whose image
+hash is already the latest is skipped.
+
+For the menu map, show also checks the relocated routines against the
+length store_wram_routines copies (snesmap.MENU_RELOCATIONS): a
+store_blockram_routine_src that outgrows $80 bytes is copied truncated.
+
+Usage:
+    sizetrack.py show menu.bin [--labels snes-64tass/menu.labels] [--map menu]
+    sizetrack.py record menu.bin [--labels ...] [--name v1.11.0] [--store sizes.jsonl]
+    sizetrack.py history [--store sizes.jsonl]
+    sizetrack.py growers [OLD NEW] [--top 20]     (name, hash prefix or #index, #-1 for latest)
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+import snesmap
+from menulabels import DEFAULT_LABELS, label_widths, load_labels, rom_symbols
+
+DEFAULT_STORE = "sizes.jsonl"
+MIN_RUN = 64
+
+_DEFINITION_RE = re.compile(r"^([A-Za-z_]\w*)")
+
+
+def source_sections(directory):
+    """{label: source file} for labels defined at column 0 in directory/*.a65."""
+    sections = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.a65"))):
+        name = os.path.basename(path)
+        with open(path, "r", errors="replace") as f:
+            for line in f:
+                m = _DEFINITION_RE.match(line)
+                if m:
+                    sections.setdefault(m.group(1), name)
+    return sections
+
+
+def padding_mask(data, fill=0x00, min_run=MIN_RUN):
+    """Boolean mask of the bytes in runs of at least min_run fill bytes."""
+    arr = np.frombuffer(data, dtype=np.uint8)
+    is_fill = np.concatenate(([False], arr == fill, [False]))
+    edges = np.flatnonzero(np.diff(is_fill.astype(np.int8)))
+    starts, ends = edges[::2], edges[1::2]
+    long_runs = (ends - starts) >= min_run
+    delta = np.zeros(len(arr) + 1, dtype=np.int32)
+    np.add.at(delta, starts[long_runs], 1)
+    np.add.at(delta, ends[long_runs], -1)
+    return np.cumsum(delta[:-1]) > 0
+
+
+class Measurement:
+    """Sizes of one build: symbols, sections and banks."""
+
+    def __init__(self, data, labels, mapper, widths=None, sections=None, fill=0x00, min_run=MIN_RUN):
+        self.size = len(data)
+        self.sha1 = hashlib.sha1(data).hexdigest()
+        syms = rom_symbols(labels, mapper, len(data), widths)
+        prim = syms.primary()
+        starts = syms.offsets[prim]
+        ends = syms.ends[prim]
+        names = [syms.names[i] for i in prim]
+
+        free = padding_mask(data, fill, min_run)
+        cum = np.concatenate(([0], np.cumsum(free, dtype=np.int64)))
+        sizes = (ends - starts) - (cum[ends] - cum[starts])
+        self.symbols = {name: int(s) for name, s in zip(names, sizes)}
+
+        sections = sections or {}
+        self.sections = {}
+        for name, s in self.symbols.items():
+            key = sections.get(name, "?")
+            self.sections[key] = self.sections.get(key, 0) + int(s)
+        if len(starts) and starts[0] > 0:
+            lead = int(starts[0] - cum[starts[0]])
+            self.sections["(unlabelled)"] = self.sections.get("(unlabelled)", 0) + lead
+
+        # bank -> [used, free]; a bank's capacity is what the image covers of it
+        banks = mapper.to_address(np.arange(len(data), dtype=np.int64)) >> 16
+        mapped = banks >= 0
+        self.unmapped = int(len(data) - np.count_nonzero(mapped))
+        capacity = np.bincount(banks[mapped], minlength=256)
+        unused = np.bincount(banks[mapped], weights=free[mapped], minlength=256).astype(np.int64)
+        self.banks = {f"{b:02X}": [int(capacity[b] - unused[b]), int(unused[b])]
+                      for b in np.flatnonzero(capacity)}
+
+    def record(self):
+        return {"sha1": self.sha1, "size": self.size, "banks": self.banks, "unmapped": self.unmapped,
+                "sections": self.sections, "symbols": self.symbols}
+
+
+def measure(image_path, labels_path=DEFAULT_LABELS, map_name="menu", fill=0x00, min_run=MIN_RUN):
+    labels = load_labels(labels_path)
+    mapper = snesmap.get_mapper(map_name, labels)
+    with open(image_path, "rb") as f:
+        data = f.read()
+    sections = source_sections(os.path.dirname(labels_path) or ".")
+    return Measurement(data, labels, mapper, label_widths(labels_path), sections, fill, min_run), mapper, labels
+
+
+def relocation_overflows(symbols, labels):
+    """[(source label, size, copied length)] for relocated routines larger than their copy."""
+    out = []
+    for src, dst, length in snesmap.MENU_RELOCATIONS:
+        if src in symbols and dst in labels and symbols[src] > length:
+            out.append((src, symbols[src], length))
+    return out
+
+
+class SizeStore:
+    """Append-only JSON-lines store; symbol sizes are deltas against the previous build."""
+
+    def __init__(self, path=DEFAULT_STORE):
+        self.path = path
+
+    def lines(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def builds(self):
+        """Every build with its full symbol sizes, oldest first."""
+        symbols = {}
+        out = []
+        for line in self.lines():
+            for name, size in line["symbols"].items():
+                if size is None:
+                    symbols.pop(name, None)
+                else:
+                    symbols[name] = size
+            build = dict(line)
+            build["symbols"] = dict(symbols)
+            out.append(build)
+        return out
+
+    def append(self, measurement, name=None):
+        """Append a build; returns False if it is already the latest one."""
+        builds = self.builds()
+        previous = builds[-1]["symbols"] if builds else {}
+        if builds and builds[-1]["sha1"] == measurement.sha1:
+            return False
+        delta = {n: s for n, s in measurement.symbols.items() if previous.get(n) != s}
+        delta.update({n: None for n in previous if n not in measurement.symbols})
+        line = measurement.record()
+        line["symbols"] = delta
+        line["name"] = name
+        line["time"] = time.time()
+        with open(self.path, "a") as f:
+            f.write(json.dumps(line, separators=(",", ":"), sort_keys=True) + "\n")
+        return True
+
+    @staticmethod
+    def resolve(builds, ref):
+        """Index of a build by name, hash prefix or #index (negative from the end)."""
+        if not ref.startswith("#"):
+            for index in range(len(builds) - 1, -1, -1):
+                if builds[index].get("name") == ref or builds[index]["sha1"].startswith(ref.lower()):
+                    return index
+            raise ValueError(f"no build matches '{ref}'")
+        try:
+            index = int(ref[1:])
+        except ValueError:
+            raise ValueError(f"bad build index '{ref}'") from None
+        if not -len(builds) <= index < len(builds):
+            raise ValueError(f"no build {ref} ({len(builds)} recorded)")
+        return index % len(builds)
+
+
+def growers(old, new):
+    """[(name, old size, new size)] sorted by growth, biggest first (0 when absent)."""
+    names = set(old) | set(new)
+    rows = [(n, old.get(n, 0), new.get(n, 0)) for n in names if old.get(n) != new.get(n)]
+    return sorted(rows, key=lambda r: (r[1] - r[2], r[0]))
+
+
+def _label(builds, index):
+    return f"#{index} {builds[index].get('name') or builds[index]['sha1'][:12]}"
+
+
+def _print_growth(title, rows, top):
+    grew = [r for r in rows if r[2] > r[1]]
+    shrank = [r for r in reversed(rows) if r[2] < r[1]]
+    print(f"{title} {len(grew)} grew, {len(shrank)} shrank, net {sum(b - a for _, a, b in rows):+d}")
+    for group in (grew, shrank):
+        for name, a, b in group[:top]:
+            print(f"  {b - a:+7d}  {a:6d} -> {b:6d}  {name}")
+        if top is not None and len(group) > top:
+            print(f"  ... {len(group) - top} more")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Track code size and bank free space across builds.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for cmd in ("show", "record"):
+        p = sub.add_parser(cmd)
+        p.add_argument("image")
+        p.add_argument("--labels", default=DEFAULT_LABELS)
+        p.add_argument("--map", default="menu", help="memory map (" + ", ".join(snesmap.MAPPERS) + ")")
+        p.add_argument("--fill", type=lambda s: int(s, 16), default=0x00, help="padding byte (hex)")
+        p.add_argument("--min-run", type=int, default=MIN_RUN, help="shortest fill run counted as free")
+    sub.choices["show"].add_argument("--top", type=int, default=20, help="largest symbols to list")
+    sub.choices["record"].add_argument("--name", help="build name (tag, version)")
+    sub.add_parser("history")
+    p = sub.add_parser("growers")
+    p.add_argument("old", nargs="?", default="#-2")
+    p.add_argument("new", nargs="?", default="#-1")
+    p.add_argument("--top", type=int, default=20, help="growers/shrinkers to list (0: all)")
+    for p in sub.choices.values():
+        p.add_argument("--store", default=DEFAULT_STORE)
+    args = parser.parse_args()
+    store = SizeStore(args.store)
+
+    if args.cmd in ("show", "record"):
+        m, mapper, labels = measure(args.image, args.labels, args.map, args.fill, args.min_run)
+        if args.cmd == "record":
+            added = store.append(m, args.name)
+            print(f"{'recorded' if added else 'unchanged'}: {args.image} {m.sha1[:12]}")
+            return
+        print(f"{args.image}: {m.size} bytes, {len(m.symbols)} symbols")
+        for bank, (used, free) in m.banks.items():
+            print(f"  bank ${bank}: {used:6d} used  {free:6d} free  ({100 * used / (used + free):5.1f}%)")
+        if m.unmapped:
+            print(f"  unmapped: {m.unmapped:6d} bytes beyond what --map {args.map} addresses")
+        print("sections:")
+        for name, size in sorted(m.sections.items(), key=lambda kv: (-kv[1], kv[0])):
+            print(f"  {size:6d}  {name}")
+        print("largest symbols:")
+        for name, size in sorted(m.symbols.items(), key=lambda kv: (-kv[1], kv[0]))[:args.top]:
+            print(f"  {size:6d}  {name}")
+        if isinstance(mapper, snesmap.MenuMap):
+            for src, size, length in relocation_overflows(m.symbols, labels):
+                print(f"warning: {src} is {size} bytes but only ${length:X} are copied to WRAM")
+        return
+
+    builds = store.builds()
+    if args.cmd == "history":
+        for i, b in enumerate(builds):
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(b["time"]))
+            banks = "  ".join(f"${k}: {free} free" for k, (_, free) in b["banks"].items())
+            print(f"  #{i:<3} {when}  {b['sha1'][:12]}  {b.get('name') or '':<12} {banks}")
+        return
+
+    try:
+        i, j = (SizeStore.resolve(builds, ref) for ref in (args.old, args.new))
+    except ValueError as e:
+        parser.error(str(e))
+    old, new = builds[i], builds[j]
+    top = args.top or None
+    print(f"{_label(builds, i)} -> {_label(builds, j)}")
+    for bank in sorted(set(old["banks"]) | set(new["banks"])):
+        a = old["banks"].get(bank, [0, 0])[1]
+        b = new["banks"].get(bank, [0, 0])[1]
+        print(f"  bank ${bank} free: {a} -> {b} ({b - a:+d})")
+    _print_growth("sections:", growers(old["sections"], new["sections"]), top)
+    _print_growth("symbols:", growers(old["symbols"], new["symbols"]), top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+SNES address <-> ROM file offset translation for LoROM, HiROM, ExHiROM
+and the menu image.
+
+Every mapper works on whole NumPy arrays, so translating hundreds of
+labels or xrefs is one call instead of one utils/mem2lorom run each.
+Unmapped inputs come back as -1. Scalars in, scalars out.
+
+The "menu" map is HiROM with menu.bin at $C00000, plus the routines that
+store_wram_routines copies to WRAM: their $7EFxxx run addresses map back
+to the source bytes in the image (needs the label file to resolve).
+
+Usage:
+    snesmap.py [--map lorom] c01379 7ef100 ...      address -> offset
+    snesmap.py [--map lorom] --reverse 1379 ...      offset -> address
+    snesmap.py --map menu --labels snes-64tass/menu.labels fadeloop ...
+"""
+
+import argparse
+
+import numpy as np
+
+UNMAPPED = -1
+
+# (source label, run address label, length) as copied by store_wram_routines
+MENU_RELOCATIONS = (
+    ("wram_routine_src", "WRAM_ROUTINE", 0x80),
+    ("store_blockram_routine_src", "WRAM_STORE_BLOCKRAM_ROUTINE", 0x80),
+    ("fadeloop", "WRAM_FADELOOP", 0xEF),
+    ("wram_wait_mcu_src", "WRAM_WAIT_MCU", 0x0B),
+    ("wram_load_ultra16_cfg_src", "WRAM_LOAD_ULTRA16_CFG", 0x80),
+)
+
+
+def _wrap(fn):
+    """Let a mapper method take scalars or arrays."""
+    def wrapper(self, values):
+        arr = np.asarray(values, dtype=np.int64)
+        result = fn(self, arr)
+        return int(result) if arr.ndim == 0 else result
+    wrapper.__doc__ = fn.__doc__
+    wrapper.__name__ = fn.__name__
+    return wrapper
+
+
+def _is_wram(bank):
+    return (bank == 0x7E) | (bank == 0x7F)
+
+
+class LoROM:
+    """32 KB banks at $8000-$FFFF; reverse mapping uses FastROM banks $80+."""
+    name = "lorom"
+
+    def __init__(self, fast=True):
+        self.fast = fast
+
+    @_wrap
+    def to_offset(self, addr):
+        bank = (addr >> 16) & 0xFF
+        off = ((addr & 0x7F0000) >> 1) | (addr & 0x7FFF)
+        ok = ((addr & 0x8000) != 0) & ~_is_wram(bank)
+        return np.where(ok, off, UNMAPPED)
+
+    @_wrap
+    def to_address(self, off):
+        addr = ((off << 1) & 0x7F0000) | (off & 0x7FFF) | 0x8000
+        if self.fast:
+            addr |= 0x800000
+        return np.where((off >= 0) & (off < 0x400000), addr, UNMAPPED)
+
+
+class HiROM:
+    """64 KB banks at $C0-$FF (mirrored at $40-$7D and $00-$3F/$80-$BF:8000+)."""
+    name = "hirom"
+
+    @_wrap
+    def to_offset(self, addr):
+        bank = (addr >> 16) & 0xFF
+        full = ((bank & 0x40) != 0) & ~_is_wram(bank)
+        ok = full | (((bank & 0x40) == 0) & ((addr & 0x8000) != 0))
+        return np.where(ok, addr & 0x3FFFFF, UNMAPPED)
+
+    @_wrap
+    def to_address(self, off):
+        return np.where((off >= 0) & (off < 0x400000), off | 0xC00000, UNMAPPED)
+
+
+class ExHiROM:
+    """HiROM with a second 4 MB half in banks $40-$7D / $00-$3F:8000+."""
+    name = "exhirom"
+
+    @_wrap
+    def to_offset(self, addr):
+        bank = (addr >> 16) & 0xFF
+        full = ((bank & 0x40) != 0) & ~_is_wram(bank)
+        ok = full | (((bank & 0x40) == 0) & ((addr & 0x8000) != 0))
+        off = (addr & 0x3FFFFF) | np.where(bank < 0x80, 0x400000, 0)
+        return np.where(ok, off, UNMAPPED)
+
+    @_wrap
+    def to_address(self, off):
+        low = off | 0xC00000
+        high = (off & 0x3FFFFF) | 0x400000
+        bank = (high >> 16) & 0xFF
+        # $7E/$7F are WRAM, that part of ROM is only visible at $3E/$3F:8000+
+        high = np.where(_is_wram(bank), np.where((off & 0x8000) != 0, high - 0x400000, UNMAPPED), high)
+        res = np.where(off < 0x400000, low, high)
+        return np.where((off >= 0) & (off < 0x800000), res, UNMAPPED)
+
+
+class MenuMap(HiROM):
+    """menu.bin: HiROM at $C00000 plus the WRAM routine copies."""
+    name = "menu"
+
+    def __init__(self, labels=None):
+        # (run start, run end, image offset) for each relocated routine
+        self.relocations = []
+        if labels:
+            for src, dst, length in MENU_RELOCATIONS:
+                if src in labels and dst in labels:
+                    off = HiROM.to_offset(self, labels[src])
+                    self.relocations.append((labels[dst], labels[dst] + length, off))
+
+    @_wrap
+    def to_offset(self, addr):
+        off = HiROM.to_offset(self, addr)
+        for start, end, src in self.relocations:
+            off = np.where((addr >= start) & (addr < end), src + (addr - start), off)
+        return off
+
+    @_wrap
+    def run_address(self, off):
+        """WRAM address an image offset executes at, or -1 if not relocated."""
+        res = np.full(off.shape, UNMAPPED, dtype=np.int64)
+        for start, end, src in self.relocations:
+            inside = (off >= src) & (off < src + (end - start))
+            res = np.where(inside, start + (off - src), res)
+        return res
+
+
+MAPPERS = {
+    "lorom": LoROM,
+    "hirom": HiROM,
+    "exhirom": ExHiROM,
+    "menu": MenuMap,
+}
+
+# romindex.py mapping names
+_ROMINDEX_NAMES = {
+    "LoROM": "lorom", "ExLoROM": "lorom", "S-DD1": "lorom", "SA-1": "lorom",
+    "HiROM": "hirom", "SPC7110": "hirom", "ExHiROM": "exhirom",
+}
+
+
+def get_mapper(name, labels=None):
+    """Mapper by name; also accepts romindex.py mapping names."""
+    name = _ROMINDEX_NAMES.get(name, name).lower()
+    if name not in MAPPERS:
+        raise ValueError(f"unknown memory map '{name}' (choose from {', '.join(MAPPERS)})")
+    if MAPPERS[name] is MenuMap:
+        return MenuMap(labels)
+    return MAPPERS[name]()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Translate SNES addresses to ROM offsets and back.")
+    parser.add_argument("values", nargs="+", help="hex addresses/offsets, or label names with --labels")
+    parser.add_argument("--map", default="lorom", help="memory map (" + ", ".join(MAPPERS) + ")")
+    parser.add_argument("--reverse", action="store_true", help="translate file offsets to addresses")
+    parser.add_argument("--labels", help="64tass label file for label names and menu relocations")
+    args = parser.parse_args()
+
+    labels = {}
+    if args.labels:
+        from menulabels import load_labels
+        labels = load_labels(args.labels)
+    mapper = get_mapper(args.map, labels)
+    values = np.array([labels[v] if v in labels else int(v.lstrip("$"), 16) for v in args.values],
+                      dtype=np.int64)
+    result = mapper.to_address(values) if args.reverse else mapper.to_offset(values)
+    for text, v, r in zip(args.values, values, result):
+        name = f"  ({text})" if text in labels else ""
+        out = f"{r:06X}" if r >= 0 else "unmapped"
+        print(f"{v:06X} -> {out}{name}")
+
+
+if __name__ == "__main__":
+    main()
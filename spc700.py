@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+SPC700 disassembler and payload comparator for the sound-CPU code that the
+menu uploads (apu_ram_init_code, spc_loader, spc_transfer).
+
+Upload payloads are found from the 65816 side: disasm65 explores the
+image, routines that write APUIO1 ($2141) are taken as upload routines,
+and every loop that calls one and closes with CPX/CPY #n around an
+LDA table,X gives a payload (table + start index, n bytes). The SPC700
+load address comes from the LDY #imm handed to the begin/next upload call
+before the loop. Payloads whose table is outside the image (SPC_DATA in
+cart RAM) are listed but not disassembled.
+
+compare pairs the payloads of two builds by source label or, failing that,
+by signature search, then walks both instruction streams aligned by
+offset the way compare_wram.compare_routines does and reports each
+instruction as same, operand (same opcode, different operand bytes),
+differs, size, or only on one side.
+
+Usage:
+    spc700.py find menu.bin [--labels snes-64tass/menu.labels] [--map menu]
+    spc700.py disasm menu.bin [--labels ...] [--at OFFSET:LENGTH[:ORG]]
+    spc700.py compare orig.bin port.bin [--labels ...] [--orig-labels ...] [--all]
+"""
+
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+import disasm65
+import snesmap
+
+APUIO1 = 0x2141
+
+# one entry per opcode, "MNEM operand,operand"; see _TOKEN_BYTES for operand forms
+_TABLE = """
+NOP|TCALL 0|SET1 d.0|BBS d.0,r|OR A,d|OR A,!a|OR A,(X)|OR A,[d+X]|OR A,#i|OR dd,ds|OR1 C,m.b|ASL d|ASL !a|PUSH PSW|TSET1 !a|BRK
+BPL r|TCALL 1|CLR1 d.0|BBC d.0,r|OR A,d+X|OR A,!a+X|OR A,!a+Y|OR A,[d]+Y|OR d,#i|OR (X),(Y)|DECW d|ASL d+X|ASL A|DEC X|CMP X,!a|JMP [!a+X]
+CLRP|TCALL 2|SET1 d.1|BBS d.1,r|AND A,d|AND A,!a|AND A,(X)|AND A,[d+X]|AND A,#i|AND dd,ds|OR1 C,/m.b|ROL d|ROL !a|PUSH A|CBNE d,r|BRA r
+BMI r|TCALL 3|CLR1 d.1|BBC d.1,r|AND A,d+X|AND A,!a+X|AND A,!a+Y|AND A,[d]+Y|AND d,#i|AND (X),(Y)|INCW d|ROL d+X|ROL A|INC X|CMP X,d|CALL !a
+SETP|TCALL 4|SET1 d.2|BBS d.2,r|EOR A,d|EOR A,!a|EOR A,(X)|EOR A,[d+X]|EOR A,#i|EOR dd,ds|AND1 C,m.b|LSR d|LSR !a|PUSH X|TCLR1 !a|PCALL u
+BVC r|TCALL 5|CLR1 d.2|BBC d.2,r|EOR A,d+X|EOR A,!a+X|EOR A,!a+Y|EOR A,[d]+Y|EOR d,#i|EOR (X),(Y)|CMPW YA,d|LSR d+X|LSR A|MOV X,A|CMP Y,!a|JMP !a
+CLRC|TCALL 6|SET1 d.3|BBS d.3,r|CMP A,d|CMP A,!a|CMP A,(X)|CMP A,[d+X]|CMP A,#i|CMP dd,ds|AND1 C,/m.b|ROR d|ROR !a|PUSH Y|DBNZ d,r|RET
+BVS r|TCALL 7|CLR1 d.3|BBC d.3,r|CMP A,d+X|CMP A,!a+X|CMP A,!a+Y|CMP A,[d]+Y|CMP d,#i|CMP (X),(Y)|ADDW YA,d|ROR d+X|ROR A|MOV A,X|CMP Y,d|RETI
+SETC|TCALL 8|SET1 d.4|BBS d.4,r|ADC A,d|ADC A,!a|ADC A,(X)|ADC A,[d+X]|ADC A,#i|ADC dd,ds|EOR1 C,m.b|DEC d|DEC !a|MOV Y,#i|POP PSW|MOV d,#i
+BCC r|TCALL 9|CLR1 d.4|BBC d.4,r|ADC A,d+X|ADC A,!a+X|ADC A,!a+Y|ADC A,[d]+Y|ADC d,#i|ADC (X),(Y)|SUBW YA,d|DEC d+X|DEC A|MOV X,SP|DIV YA,X|XCN A
+EI|TCALL 10|SET1 d.5|BBS d.5,r|SBC A,d|SBC A,!a|SBC A,(X)|SBC A,[d+X]|SBC A,#i|SBC dd,ds|MOV1 C,m.b|INC d|INC !a|CMP Y,#i|POP A|MOV (X)+,A
+BCS r|TCALL 11|CLR1 d.5|BBC d.5,r|SBC A,d+X|SBC A,!a+X|SBC A,!a+Y|SBC A,[d]+Y|SBC d,#i|SBC (X),(Y)|MOVW YA,d|INC d+X|INC A|MOV SP,X|DAS A|MOV A,(X)+
+DI|TCALL 12|SET1 d.6|BBS d.6,r|MOV d,A|MOV !a,A|MOV (X),A|MOV [d+X],A|CMP X,#i|MOV !a,X|MOV1 m.b,C|MOV d,Y|MOV !a,Y|MOV X,#i|POP X|MUL YA
+BNE r|TCALL 13|CLR1 d.6|BBC d.6,r|MOV d+X,A|MOV !a+X,A|MOV !a+Y,A|MOV [d]+Y,A|MOV d,X|MOV d+Y,X|MOVW d,YA|MOV d+X,Y|DEC Y|MOV A,Y|CBNE d+X,r|DAA A
+CLRV|TCALL 14|SET1 d.7|BBS d.7,r|MOV A,d|MOV A,!a|MOV A,(X)|MOV A,[d+X]|MOV A,#i|MOV X,!a|NOT1 m.b|MOV Y,d|MOV Y,!a|NOTC|POP Y|SLEEP
+BEQ r|TCALL 15|CLR1 d.7|BBC d.7,r|MOV A,d+X|MOV A,!a+X|MOV A,!a+Y|MOV A,[d]+Y|MOV X,d|MOV X,d+Y|MOV dd,ds|MOV Y,d+X|INC Y|MOV Y,A|DBNZ Y,r|STOP
+"""
+
+# operand form -> (bytes, format); {0} is the operand value
+_TOKEN_BYTES = {
+    "#i": (1, "#${0:02X}"), "d": (1, "${0:02X}"), "dd": (1, "${0:02X}"), "ds": (1, "${0:02X}"),
+    "d+X": (1, "${0:02X}+X"), "d+Y": (1, "${0:02X}+Y"),
+    "[d+X]": (1, "[${0:02X}+X]"), "[d]+Y": (1, "[${0:02X}]+Y"),
+    "!a": (2, "!${0:04X}"), "!a+X": (2, "!${0:04X}+X"), "!a+Y": (2, "!${0:04X}+Y"),
+    "[!a+X]": (2, "[!${0:04X}+X]"), "u": (1, "$FF{0:02X}"), "r": (1, None),
+    "m.b": (2, None), "/m.b": (2, None),
+}
+for _bit in range(8):
+    _TOKEN_BYTES[f"d.{_bit}"] = (1, "${0:02X}." + str(_bit))
+
+SpcInsn = namedtuple("SpcInsn", "offset opcode mnem values size")
+Payload = namedtuple("Payload", "site offset address length org name")
+
+
+def _build_table():
+    table = {}
+    for row, line in enumerate(_TABLE.strip().splitlines()):
+        for col, entry in enumerate(line.split("|")):
+            mnem, _, ops = entry.partition(" ")
+            tokens = ops.split(",") if ops else []
+            fields = [(t, _TOKEN_BYTES[t][0]) if t in _TOKEN_BYTES else (t, 0) for t in tokens]
+            sized = [i for i, (_, n) in enumerate(fields) if n]
+            # "d,#i" and "dd,ds" store their operands in reverse (source byte first)
+            if len(sized) == 2 and (tokens[sized[1]] == "#i" or tokens[sized[1]] == "ds"):
+                sized.reverse()
+            layout = []
+            pos = 1
+            for i in sized:
+                layout.append((i, pos, fields[i][1]))
+                pos += fields[i][1]
+            table[row * 16 + col] = (mnem, tuple(tokens), tuple(layout), pos)
+    return table
+
+
+OPCODES = _build_table()
+
+
+def decode(data, offset):
+    """Decode one instruction, or None past the end of data."""
+    if offset >= len(data):
+        return None
+    mnem, tokens, layout, size = OPCODES[data[offset]]
+    if offset + size > len(data):
+        return None
+    values = [None] * len(tokens)
+    for i, pos, n in layout:
+        values[i] = data[offset + pos] if n == 1 else data[offset + pos] | (data[offset + pos + 1] << 8)
+    return SpcInsn(offset, data[offset], mnem, tuple(values), size)
+
+
+def linear_sweep(data, start=0, end=None):
+    end = len(data) if end is None else end
+    insns = []
+    pos = start
+    while pos < end:
+        insn = decode(data, pos)
+        if insn is None:
+            break
+        insns.append(insn)
+        pos += insn.size
+    return insns
+
+
+def branch_target(insn, pc):
+    """Target of a relative branch at SPC address pc (the offset is the last byte)."""
+    rel = insn.values[-1]
+    rel = rel - 0x100 if rel & 0x80 else rel
+    return (pc + insn.size + rel) & 0xFFFF
+
+
+def text(insn, pc=None):
+    """Assembler text; pc (SPC address) resolves branch targets."""
+    tokens = OPCODES[insn.opcode][1]
+    parts = []
+    for tok, val in zip(tokens, insn.values):
+        if val is None:
+            parts.append(tok)
+        elif tok == "r":
+            parts.append(f"${branch_target(insn, pc):04X}" if pc is not None else f"*{val - 0x100 if val & 0x80 else val:+d}")
+        elif tok in ("m.b", "/m.b"):
+            parts.append(f"{'/' if tok[0] == '/' else ''}${val & 0x1FFF:04X}.{val >> 13}")
+        else:
+            parts.append(_TOKEN_BYTES[tok][1].format(val))
+    return f"{insn.mnem} {', '.join(parts)}" if parts else insn.mnem
+
+
+def listing(data, org=0):
+    """[(spc address, raw bytes, text)] for a whole payload."""
+    lines = []
+    for insn in linear_sweep(data):
+        pc = (org + insn.offset) & 0xFFFF
+        raw = bytes(data[insn.offset:insn.offset + insn.size]).hex(" ").upper()
+        lines.append((pc, raw, text(insn, pc)))
+    return lines
+
+
+# --- locating payloads in a 65816 image ---
+
+def _writes_apuio1(cm, start):
+    lo, hi = disasm65.routine_extent(cm, start)
+    for off in range(lo, hi):
+        insn = cm.insns.get(off)
+        if (insn is not None and insn.mnem == "STA" and insn.mode in ("abs", "long")
+                and insn.operand & 0xFFFF == APUIO1):
+            return True
+    return False
+
+
+def find_payloads(data, mapper, symbols=None, cm=None):
+    """Find SPC700 upload loops. Returns [Payload] in image order.
+
+    offset is None when the table is not in the image.
+    """
+    if cm is None:
+        cm = disasm65.explore(data, disasm65.image_roots(data, mapper, symbols), mapper)
+    uploaders = {t for t in set(cm.calls.values()) if _writes_apuio1(cm, t)}
+    offsets = sorted(cm.insns)
+    where = {off: i for i, off in enumerate(offsets)}
+    found = []
+    for leader, block in cm.blocks():
+        last = block[-1]
+        if last.opcode not in disasm65.COND_BRANCHES or len(block) < 2:
+            continue
+        pc = int(mapper.to_address(last.offset))
+        loop = int(mapper.to_offset(disasm65.branch_target(last, pc)))
+        counter = block[-2]
+        if loop > last.offset or counter.opcode not in (0xE0, 0xC0):     # CPX/CPY #imm
+            continue
+        body = [cm.insns[o] for o in offsets[where.get(loop, len(offsets)):where[last.offset]]]
+        if not any(i.opcode in disasm65.CALLS and cm.calls.get(i.offset) in uploaders for i in body):
+            continue
+        load = next((i for i in body if i.opcode in (0xBD, 0xBF, 0xB9)), None)   # LDA abs,X / long,X / abs,Y
+        if load is None:
+            continue
+        # index start (LDX #imm before the loop; CPY counts from the Y=0 the upload call leaves)
+        before = [cm.insns[o] for o in offsets[max(0, where.get(loop, 0) - 12):where.get(loop, 0)]]
+        start = 0
+        if counter.opcode == 0xE0:
+            ldx = [i for i in before if i.opcode == 0xA2]
+            start = ldx[-1].operand if ldx else 0
+        ldy = [i for i in before if i.opcode == 0xA0]
+        org = ldy[-1].operand if ldy else None
+        length = counter.operand - start
+        if length <= 0:
+            continue
+        if load.opcode == 0xBF:
+            table = load.operand
+        else:
+            table = (int(mapper.to_address(load.offset)) & 0xFF0000) | load.operand
+        off = int(mapper.to_offset(table + start))
+        if not 0 <= off < len(data) or off + length > len(data):
+            off = None
+        name = symbols.format(off) if symbols is not None and off is not None else None
+        found.append(Payload(int(mapper.to_address(load.offset)), off, table + start, length, org, name))
+    return found
+
+
+# --- comparison ---
+
+def aligned_diff(a_insns, b_insns):
+    """Walk two instruction lists by relative offset like compare_routines.
+
+    Returns [(a insn or None, b insn or None, status)].
+    """
+    rows = []
+    ia = ib = 0
+    a0 = a_insns[0].offset if a_insns else 0
+    b0 = b_insns[0].offset if b_insns else 0
+    while ia < len(a_insns) or ib < len(b_insns):
+        a = a_insns[ia] if ia < len(a_insns) else None
+        b = b_insns[ib] if ib < len(b_insns) else None
+        ra = a.offset - a0 if a else None
+        rb = b.offset - b0 if b else None
+        if a and b and ra == rb:
+            if a.opcode != b.opcode:
+                status = "size" if a.size != b.size else "differs"
+            elif a.values != b.values:
+                status = "operand"
+            else:
+                status = "same"
+            rows.append((a, b, status))
+            ia += 1
+            ib += 1
+        elif b is None or (a is not None and ra < rb):
+            rows.append((a, None, "only_a"))
+            ia += 1
+        else:
+            rows.append((None, b, "only_b"))
+            ib += 1
+    return rows
+
+
+def compare_payload(a_data, b_data):
+    """Aligned diff of two payloads; returns (rows, differing byte count)."""
+    n = min(len(a_data), len(b_data))
+    diffs = int(np.count_nonzero(np.frombuffer(a_data[:n], dtype=np.uint8)
+                                 != np.frombuffer(b_data[:n], dtype=np.uint8))) + abs(len(a_data) - len(b_data))
+    return aligned_diff(linear_sweep(a_data), linear_sweep(b_data)), diffs
+
+
+def match_payloads(a_list, a_data, b_list, b_data):
+    """Pair payloads by label name, then by signature (first 8 bytes)."""
+    pairs = []
+    by_name = {p.name: p for p in b_list if p.name}
+    for p in a_list:
+        if p.offset is None:
+            continue
+        q = by_name.get(p.name) if p.name else None
+        if q is None or q.offset is None:
+            sig = a_data[p.offset:p.offset + min(8, p.length)]
+            hit = b_data.find(sig)
+            q = next((c for c in b_list if c.offset == hit), None) if hit >= 0 else None
+            if q is None and hit >= 0:
+                q = Payload(None, hit, None, p.length, p.org, None)
+        pairs.append((p, q))
+    return pairs
+
+
+def _describe(p):
+    where = p.name or (f"${p.offset:06X}" if p.offset is not None else "outside image")
+    org = f"${p.org:04X}" if p.org is not None else "?"
+    return f"${p.address:06X} {p.length:5d} bytes -> SPC {org}  ({where})"
+
+
+def _symbols(path, mapper, size):
+    if not path:
+        return None
+    from menulabels import label_widths, load_labels, rom_symbols
+    return rom_symbols(load_labels(path), mapper, size, label_widths(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find, disassemble and compare SPC700 upload payloads.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("find")
+    p.add_argument("image")
+    p = sub.add_parser("disasm")
+    p.add_argument("image")
+    p.add_argument("--at", help="OFFSET:LENGTH[:ORG] (hex) instead of searching")
+    p = sub.add_parser("compare")
+    p.add_argument("orig")
+    p.add_argument("port")
+    p.add_argument("--orig-labels", help="label file for orig (default: --labels)")
+    p.add_argument("--all", action="store_true", help="also print identical instructions")
+    for p in sub.choices.values():
+        p.add_argument("--labels", help="64tass label file")
+        p.add_argument("--map", default="menu", help="memory map (" + ", ".join(snesmap.MAPPERS) + ")")
+    args = parser.parse_args()
+
+    def load(path, labels_path):
+        with open(path, "rb") as f:
+            data = f.read()
+        labels = {}
+        if labels_path:
+            from menulabels import load_labels
+            labels = load_labels(labels_path)
+        mapper = snesmap.get_mapper(args.map, labels)
+        symbols = _symbols(labels_path, mapper, len(data))
+        return data, find_payloads(data, mapper, symbols)
+
+    if args.cmd == "find":
+        _, payloads = load(args.image, args.labels)
+        for p in payloads:
+            print(f"  ${p.site:06X}  {_describe(p)}")
+    elif args.cmd == "disasm":
+        if args.at:
+            fields = [int(v, 16) for v in args.at.split(":")]
+            with open(args.image, "rb") as f:
+                data = f.read()
+            off, length = fields[0], fields[1]
+            payloads = [Payload(0, off, off, length, fields[2] if len(fields) > 2 else 0, None)]
+        else:
+            data, payloads = load(args.image, args.labels)
+        for p in payloads:
+            print(f"\n{_describe(p)}")
+            if p.offset is None:
+                continue
+            for pc, raw, asm in listing(data[p.offset:p.offset + p.length], p.org or 0):
+                print(f"  ${pc:04X}  {raw:<10} {asm}")
+    else:
+        a_data, a_list = load(args.orig, args.orig_labels or args.labels)
+        b_data, b_list = load(args.port, args.labels)
+        for p, q in match_payloads(a_list, a_data, b_list, b_data):
+            print(f"\n{'=' * 100}\n{_describe(p)}")
+            if q is None:
+                print("  ** not found in port **")
+                continue
+            a_bytes = a_data[p.offset:p.offset + p.length]
+            b_bytes = b_data[q.offset:q.offset + q.length]
+            rows, diffs = compare_payload(a_bytes, b_bytes)
+            print(f"port: {_describe(q) if q.address is not None else f'${q.offset:06X} (signature match)'}")
+            if diffs == 0:
+                print("  ** IDENTICAL **")
+                continue
+            print(f"  ** {diffs} byte(s) differ **")
+            org = p.org or 0
+            for a, b, status in rows:
+                if status == "same" and not args.all:
+                    continue
+                left = f"${org + a.offset:04X} {text(a, org + a.offset):<24}" if a else " " * 30
+                right = f"${org + b.offset:04X} {text(b, org + b.offset):<24}" if b else " " * 30
+                print(f"  {left} | {right}  {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Precompile savestate_fixes.yml into a packed, checksum-indexed fix code file.
+
+savestate_set_fixes() (src/savestate.c) scans the whole YAML file on every
+load and assembles each record into 65816 code at SS_FIXES_ADDR. This tool
+does the same conversion ahead of time and writes one blob per checksum,
+byte-identical to what savestate_write_fix_code()/savestate_write_fix_literal()
+would deploy (including the terminating RTL), plus a sorted index so the
+loader only needs a binary search and a single read.
+
+Pack layout (little endian):
+    header:  "SSFX" u16 version, u16 entry count
+    index:   count * (u16 checksum, u16 code length, u16 patch count,
+                      u16 reserved, u32 blob offset)   sorted by checksum
+    blobs:   fix code, followed by patch count * (u24 address, u8 value)
+
+Identical blobs are stored once and shared between index entries.
+
+Usage:
+    ssfix_compile.py build savestate/savestate_fixes.yml -o savestate_fixes.bin
+    ssfix_compile.py verify savestate_fixes.bin [--yml savestate_fixes.yml] [-v]
+    ssfix_compile.py show savestate_fixes.bin 648D
+"""
+
+import argparse
+import os
+import struct
+import sys
+
+from compare_wram import disasm_block
+
+PACK_MAGIC = b"SSFX"
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct("<4sHH")
+PACK_ENTRY = struct.Struct("<HHHHI")
+
+# mirrors src/snes.h / src/savestate.h
+SS_FIXES_ADDR = 0xFE1014
+ASM_LDA_IMM = 0xA9
+ASM_LDA_ABSLONG = 0xAF
+ASM_STA_ABSLONG = 0x8F
+ASM_ORA_IMM = 0x09
+ASM_AND_IMM = 0x29
+ASM_EOR_IMM = 0x49
+ASM_RTL = 0x6B
+
+SS_OPERATORS = {"^": ASM_EOR_IMM, "&": ASM_AND_IMM, "|": ASM_ORA_IMM}
+
+# savestate_write_fix_literal() buffer size
+LITERAL_MAX = 64
+YAML_BUFLEN = 256
+
+
+def _strtol16(s, pos):
+    """C strtol(s + pos, &end, 16). Returns (value, end_pos)."""
+    i = pos
+    while i < len(s) and s[i] in " \t\n\v\f\r":
+        i += 1
+    neg = False
+    if i < len(s) and s[i] in "+-":
+        neg = s[i] == "-"
+        i += 1
+    if s[i:i+2].lower() == "0x" and i + 2 < len(s) and s[i+2] in "0123456789abcdefABCDEF":
+        i += 2
+    start = i
+    while i < len(s) and s[i] in "0123456789abcdefABCDEF":
+        i += 1
+    if i == start:
+        return 0, pos
+    value = int(s[start:i], 16)
+    return (-value if neg else value), i
+
+
+def _strip_comment(line):
+    """Truncate a YAML line at the first unquoted '#', like yaml_get_next()."""
+    quote = dblquote = False
+    for i, c in enumerate(line):
+        if c == "#" and not quote and not dblquote:
+            return line[:i].rstrip()
+        if c == "'":
+            quote = not quote
+        elif c == '"':
+            dblquote = not dblquote
+    return line
+
+
+def _scalar(token):
+    """Value string as yaml_detect_value() leaves it in tok.stringvalue."""
+    token = token.strip(" ")[:YAML_BUFLEN]
+    if token.startswith('"'):
+        token = token[1:].split('"', 1)[0]
+    return token
+
+
+def parse_fixes_file(path):
+    """Collect fix records per checksum key, in file order.
+
+    Returns a dict mapping the upper-case key (as compared by
+    yaml_search_next()) to a list of record strings. Repeated keys are
+    concatenated, just like the firmware's repeated yaml_get_value() calls.
+    """
+    fixes = {}
+    current = None
+    in_doc = False
+    with open(path, "r", encoding="latin-1") as f:
+        for raw in f:
+            line = _strip_comment(raw.rstrip("\r\n"))
+            if not in_doc:
+                in_doc = line.startswith("---")
+                continue
+            if not line.strip():
+                continue
+            if line.startswith("..."):
+                break
+            stripped = line.lstrip(" ")
+            if current is not None and stripped.startswith("- "):
+                fixes[current].append(_scalar(stripped.lstrip(" -")))
+                continue
+            if ":" not in line:
+                current = None
+                continue
+            key, value = line.split(":", 1)
+            current = key.strip(" ").upper()
+            fixes.setdefault(current, [])
+            value = value.strip(" ")
+            if value.startswith("["):
+                for item in value[1:].split(","):
+                    item = item.rstrip(" ]")
+                    if item:
+                        fixes[current].append(_scalar(item))
+                current = None
+            elif value:
+                fixes[current].append(_scalar(value))
+                current = None
+    return fixes
+
+
+def parse_fix(record):
+    """Parse 'DST,SRC[OP][;PCADDR,PATCH]' like savestate_parse_yaml_fix().
+
+    Returns (dst, src, operator, operand, patches) or None for an invalid
+    record. patches is a list of (address, value) ROM patch tuples, parsed
+    per the format documented at the top of savestate_fixes.yml.
+    """
+    dst, pos = _strtol16(record, 0)
+    if pos >= len(record) or record[pos] != ",":
+        return None
+    src, pos = _strtol16(record, pos + 1)
+    operator = 0
+    operand = 0
+    if pos < len(record) and record[pos] not in "; ":
+        operator = SS_OPERATORS.get(record[pos])
+        if operator is None:
+            return None
+        operand, pos = _strtol16(record, pos + 1)
+    patches = []
+    if pos < len(record) and record[pos] == ";":
+        addr, pos = _strtol16(record, pos + 1)
+        if pos < len(record) and record[pos] == "," and addr > 0:
+            value, pos = _strtol16(record, pos + 1)
+            patches.append((addr & 0xFFFFFF, value & 0xFF))
+    return (dst & 0xFFFFFF, src & 0xFFFF, operator, operand & 0xFF, patches)
+
+
+def fix_code(dst, src, operator, operand):
+    """Code emitted by savestate_write_fix_code()."""
+    if 0x2140 <= src <= 0x2143:
+        code = bytearray([ASM_LDA_ABSLONG, src & 0xFF, (src >> 8) & 0xFF, 0])
+    else:
+        code = bytearray([ASM_LDA_IMM, src & 0xFF])
+    if operator:
+        code += bytes([operator, operand])
+    code += bytes([ASM_STA_ABSLONG, dst & 0xFF, (dst >> 8) & 0xFF, (dst >> 16) & 0xFF])
+    return bytes(code)
+
+
+def literal_code(record):
+    """Code emitted by savestate_write_fix_literal()."""
+    code = bytearray()
+    chars = iter(record)
+    for c in chars:
+        if len(code) >= LITERAL_MAX:
+            break
+        if c == "@":
+            continue
+        d = next(chars, None)
+        if d is None:
+            break
+        c, d = ord(c), ord(d)
+        c = (c & 0x7) + 9 if c & 0x40 else c & 0xF
+        d = (d & 0x7) + 9 if d & 0x40 else d & 0xF
+        code.append(((c << 4) | d) & 0xFF)
+    return bytes(code)
+
+
+def compile_records(records):
+    """Compile one checksum's record list. Returns (code, patches)."""
+    code = bytearray()
+    patches = []
+    for record in records:
+        if record.startswith("@"):
+            code += literal_code(record)
+            continue
+        fix = parse_fix(record)
+        if fix is None:
+            continue
+        dst, src, operator, operand, fix_patches = fix
+        code += fix_code(dst, src, operator, operand)
+        patches += fix_patches
+    code.append(ASM_RTL)
+    return bytes(code), patches
+
+
+def compile_fixes(path):
+    """Compile a fixes file. Returns {checksum: (code, patches)}."""
+    compiled = {}
+    for key, records in parse_fixes_file(path).items():
+        try:
+            checksum = int(key, 16)
+        except ValueError:
+            print(f"  skipping non-checksum key '{key}'", file=sys.stderr)
+            continue
+        if checksum > 0xFFFF or not records:
+            continue
+        compiled[checksum] = compile_records(records)
+    return compiled
+
+
+def write_pack(compiled, path):
+    """Write compiled fixes as a pack file, sharing identical blobs."""
+    checksums = sorted(compiled)
+    data_start = PACK_HEADER.size + PACK_ENTRY.size * len(checksums)
+    blobs = bytearray()
+    offsets = {}
+    index = bytearray()
+    for checksum in checksums:
+        code, patches = compiled[checksum]
+        blob = code + b"".join(struct.pack("<I", addr)[:3] + bytes([value])
+                               for addr, value in patches)
+        if blob not in offsets:
+            offsets[blob] = data_start + len(blobs)
+            blobs += blob
+        index += PACK_ENTRY.pack(checksum, len(code), len(patches), 0, offsets[blob])
+    with open(path, "wb") as f:
+        f.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(checksums)))
+        f.write(index)
+        f.write(blobs)
+    return data_start + len(blobs)
+
+
+def read_pack(path):
+    """Read a pack file. Returns {checksum: (code, patches)}."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, count = PACK_HEADER.unpack_from(data, 0)
+    if magic != PACK_MAGIC or version != PACK_VERSION:
+        raise ValueError(f"{path}: not a version {PACK_VERSION} savestate fix pack")
+    compiled = {}
+    for i in range(count):
+        checksum, code_len, patch_count, _, offset = PACK_ENTRY.unpack_from(
+            data, PACK_HEADER.size + i * PACK_ENTRY.size)
+        code = data[offset:offset+code_len]
+        patches = []
+        pos = offset + code_len
+        for _ in range(patch_count):
+            rec = data[pos:pos+4]
+            patches.append((rec[0] | (rec[1] << 8) | (rec[2] << 16), rec[3]))
+            pos += 4
+        compiled[checksum] = (code, patches)
+    return compiled
+
+
+def lookup_pack(path, checksum):
+    """Binary-search the pack index for one checksum (what the loader does)."""
+    with open(path, "rb") as f:
+        magic, version, count = PACK_HEADER.unpack(f.read(PACK_HEADER.size))
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(PACK_HEADER.size + mid * PACK_ENTRY.size)
+            entry = PACK_ENTRY.unpack(f.read(PACK_ENTRY.size))
+            if entry[0] == checksum:
+                f.seek(entry[4])
+                return f.read(entry[1])
+            if entry[0] < checksum:
+                lo = mid + 1
+            else:
+                hi = mid
+    return bytes([ASM_RTL])
+
+
+def disasm_fix(code):
+    """Disassemble fix code the way the handler runs it (A=8 bits, X=16 bits)."""
+    return disasm_block(code, 0, len(code), m_flag=True, x_flag=False)
+
+
+def verify_blob(code):
+    """Check that a blob decodes into whole instructions ending in RTL.
+
+    Returns a list of problem strings (empty if the blob is fine).
+    """
+    problems = []
+    lines = disasm_fix(code)
+    end = lines[-1][0] + lines[-1][3] if lines else 0
+    if end != len(code):
+        problems.append(f"last instruction runs {end - len(code)} byte(s) past end of blob")
+    if not code or code[-1] != ASM_RTL or lines[-1][2] != "RTL":
+        problems.append("blob does not end with RTL")
+    for off, bstr, mnem, size in lines[:-1]:
+        if mnem in ("RTL", "RTS", "RTI", "BRK", "STP"):
+            problems.append(f"+${off:02X}: unexpected {mnem} inside fix code")
+    return problems
+
+
+def print_blob(checksum, code, patches):
+    print(f"  {checksum:04X}: {len(code)} bytes @ ${SS_FIXES_ADDR:06X}")
+    for off, bstr, mnem, size in disasm_fix(code):
+        print(f"    ${SS_FIXES_ADDR+off:06X}  {bstr:<14} {mnem}")
+    for addr, value in patches:
+        print(f"    ROM patch ${addr:06X} = ${value:02X}")
+
+
+def cmd_build(args):
+    compiled = compile_fixes(args.yml)
+    size = write_pack(compiled, args.output)
+    print(f"{len(compiled)} checksums, {size} bytes -> {args.output}")
+    if args.dump_dir:
+        os.makedirs(args.dump_dir, exist_ok=True)
+        for checksum, (code, patches) in compiled.items():
+            with open(os.path.join(args.dump_dir, f"{checksum:04X}.bin"), "wb") as f:
+                f.write(code)
+    return 0
+
+
+def cmd_verify(args):
+    compiled = read_pack(args.pack)
+    errors = 0
+    for checksum in sorted(compiled):
+        code, patches = compiled[checksum]
+        problems = verify_blob(code)
+        if lookup_pack(args.pack, checksum) != code:
+            problems.append("index lookup returned a different blob")
+        if problems or args.verbose:
+            print_blob(checksum, code, patches)
+        for p in problems:
+            print(f"    !! {p}")
+        errors += len(problems)
+    if args.yml:
+        expected = compile_fixes(args.yml)
+        for checksum in sorted(set(expected) | set(compiled)):
+            if expected.get(checksum) != compiled.get(checksum):
+                print(f"  !! {checksum:04X}: pack differs from {args.yml}")
+                errors += 1
+    print(f"{len(compiled)} checksums verified, {errors} problem(s)")
+    return 1 if errors else 0
+
+
+def cmd_show(args):
+    checksum = int(args.checksum, 16)
+    compiled = read_pack(args.pack)
+    if checksum not in compiled:
+        print(f"  {checksum:04X}: no fixes (RTL only)")
+        return 0
+    print_blob(checksum, *compiled[checksum])
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompile savestate_fixes.yml into an indexed fix pack.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("build", help="compile a fixes file into a pack")
+    p.add_argument("yml", help="savestate_fixes.yml")
+    p.add_argument("-o", "--output", default="savestate_fixes.bin", help="pack file to write")
+    p.add_argument("--dump-dir", help="also write one CKSUM.bin code blob per checksum here")
+    p.set_defaults(func=cmd_build)
+
+    p = sub.add_parser("verify", help="disassemble and check every blob in a pack")
+    p.add_argument("pack")
+    p.add_argument("--yml", help="also check the pack against this fixes file")
+    p.add_argument("-v", "--verbose", action="store_true", help="disassemble every blob")
+    p.set_defaults(func=cmd_verify)
+
+    p = sub.add_parser("show", help="disassemble the fixes for one checksum")
+    p.add_argument("pack")
+    p.add_argument("checksum", help="16-bit ROM header checksum (hex)")
+    p.set_defaults(func=cmd_show)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Propose savestate_fixes.yml records from a batch of state snapshots.
+
+A fix is needed when a game keeps a WRAM copy of an APU port value
+($2140-$2143) that goes stale after a state load. Given several
+snapshots of the same game, every WRAM byte is checked against every
+port across the whole set at once (one NumPy array of snapshots x 128 KB):
+
+    W == P ^ k      DST,214x^k    (k = 0 is a plain copy, DST,214x)
+    W == P & k      DST,214x&k
+    W == P | k      DST,214x|k
+
+A relationship only counts if the port took at least --min-values
+different values over the snapshots, so bytes that happen to equal a
+constant port are not proposed. --min-match allows a fraction of the
+snapshots to disagree for ^ (a state caught halfway through the game's
+handshake); & and | must hold in every snapshot.
+
+Snapshots are sd2snes .state files (SRAM $F00000-$F4FFFF: WRAM $7E/$7F
+first) or raw 128 KB WRAM dumps. The .state files do not hold the port
+values ($2140 writes are not captured and the APU image is not saved), so
+they come from --ports, a CSV of "file,2140,2141,2142,2143" in hex, or
+from --port-offset for dumps that carry the four bytes at a fixed offset.
+
+Snapshots are grouped per game: sd2snes NAME01.state files in the states
+folder by NAME, everything else by the name of the folder it is in. With a romindex.py
+index the group name (the ROM's base name) gives the checksum; records
+already in --fixes are marked as known.
+
+Usage:
+    ssfix_find.py states/ --ports ports.csv [--index romindex.json] [--fixes savestate/savestate_fixes.yml]
+    ssfix_find.py states/mmx2 --port-offset 46002 --checksum 09B7 [--min-match 0.9] [--top 5]
+"""
+
+import argparse
+import csv
+import math
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+
+from ssfix_compile import parse_fix, parse_fixes_file
+
+WRAM_SIZE = 0x20000
+APU_PORTS = (0x2140, 0x2141, 0x2142, 0x2143)
+STATE_EXTENSIONS = (".state", ".bin", ".wram", ".dmp")
+
+_SLOT_RE = re.compile(r"0[1-4]\.state$", re.IGNORECASE)
+_OP_RANK = {"": 0, "^": 1, "&": 2, "|": 3}
+
+Candidate = namedtuple("Candidate", "offset port op operand matched values")
+
+
+def wram_address(offset):
+    """Long address a fix record uses for a WRAM offset (low 8 KB via bank $00, like the existing fixes)."""
+    return offset if offset < 0x2000 else 0x7E0000 + offset
+
+
+def record(c):
+    """savestate_fixes.yml record for a candidate."""
+    text = f"{wram_address(c.offset):06X},{APU_PORTS[c.port]:04X}"
+    return text + (f"{c.op}{c.operand:02X}" if c.op else "")
+
+
+def find_states(root):
+    """{group: [paths]}; NAMEnn.state files in root group by NAME, anything else by folder name."""
+    groups = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not name.lower().endswith(STATE_EXTENSIONS):
+                continue
+            if os.path.samefile(dirpath, root) and _SLOT_RE.search(name):
+                group = _SLOT_RE.sub("", name)
+            else:
+                group = os.path.basename(os.path.abspath(dirpath))
+            groups.setdefault(group, []).append(os.path.join(dirpath, name))
+    return groups
+
+
+def read_ports_table(path):
+    """{file base name: (p0, p1, p2, p3)} from a CSV of hex values."""
+    table = {}
+    with open(path, "r", newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#"):
+                continue
+            try:
+                values = tuple(int(v, 16) & 0xFF for v in row[1:5])
+            except ValueError:
+                continue  # header line
+            if len(values) == 4:
+                table[os.path.basename(row[0].strip())] = values
+    return table
+
+
+def load_snapshots(paths, ports_table=None, port_offset=None):
+    """(wram (n, 128K) uint8, ports (n, 4) uint8, used paths); snapshots without port values are skipped."""
+    wram, ports, used = [], [], []
+    for path in paths:
+        size = os.path.getsize(path)
+        if size < WRAM_SIZE:
+            raise ValueError(f"{path}: {size} bytes, too small for 128 KB of WRAM")
+        if port_offset is not None:
+            with open(path, "rb") as f:
+                f.seek(port_offset)
+                values = tuple(f.read(4))
+            if len(values) < 4:
+                raise ValueError(f"{path}: no port values at ${port_offset:X}")
+        elif ports_table is not None and os.path.basename(path) in ports_table:
+            values = ports_table[os.path.basename(path)]
+        else:
+            continue
+        wram.append(np.fromfile(path, dtype=np.uint8, count=WRAM_SIZE))
+        ports.append(values)
+        used.append(path)
+    if not wram:
+        return np.zeros((0, WRAM_SIZE), dtype=np.uint8), np.zeros((0, 4), dtype=np.uint8), used
+    return np.stack(wram), np.array(ports, dtype=np.uint8), used
+
+
+def _xor_matches(wram, port, need):
+    """(match count, k) per WRAM byte for W == P ^ k, k taken from the best agreeing snapshot."""
+    x = wram ^ port[:, None]
+    if need == len(wram):
+        same = (x == x[0]).all(axis=0)
+        return np.where(same, len(wram), 0), x[0]
+    best = np.zeros(wram.shape[1], dtype=np.int64)
+    best_k = x[0].copy()
+    for row in x:
+        count = (x == row).sum(axis=0)
+        better = count > best
+        best[better] = count[better]
+        best_k[better] = row[better]
+    return best, best_k
+
+
+def correlate(wram, ports, min_match=1.0, min_values=3):
+    """Candidate fixes for one game's snapshots, best first."""
+    n = len(wram)
+    out = []
+    if n == 0:
+        return out
+    need = max(1, math.ceil(min_match * n))
+    for p in range(4):
+        port = ports[:, p]
+        if len(np.unique(port)) < min_values:
+            continue
+        varying = np.bitwise_or.reduce(port ^ port[0])
+
+        count, k = _xor_matches(wram, port, need)
+        copies = count >= need
+        for off in np.flatnonzero(copies):
+            agree = (wram[:, off] ^ port) == k[off]
+            values = len(np.unique(port[agree]))
+            if values >= min_values:
+                op = "^" if k[off] else ""
+                out.append(Candidate(int(off), p, op, int(k[off]), int(count[off]), values))
+
+        w, pc = wram, port[:, None]
+        # W == P & k: no bit outside P, and each bit of k fixed where P has it set
+        ones = np.bitwise_or.reduce(pc & w, axis=0)
+        zeros = np.bitwise_or.reduce(pc & ~w, axis=0)
+        ok = ((w & ~pc) == 0).all(axis=0) & ((ones & zeros) == 0) & (ones & varying != 0) & ~copies
+        for off in np.flatnonzero(ok):
+            values = len(np.unique(port & ones[off]))
+            if values >= 2:
+                out.append(Candidate(int(off), p, "&", int(ones[off]), n, values))
+        # W == P | k: every bit of P kept, and each bit of k fixed where P has it clear
+        ones = np.bitwise_or.reduce(~pc & w, axis=0)
+        zeros = np.bitwise_or.reduce(~pc & ~w, axis=0)
+        ok = ((pc & ~w) == 0).all(axis=0) & ((ones & zeros) == 0) & (~ones & varying != 0) & ~copies
+        for off in np.flatnonzero(ok):
+            values = len(np.unique(port | ones[off]))
+            if values >= 2:
+                out.append(Candidate(int(off), p, "|", int(ones[off]), n, values))
+    out.sort(key=lambda c: (-c.matched, -c.values, _OP_RANK[c.op], c.offset, c.port))
+    return out
+
+
+def load_index_checksums(path):
+    """{ROM base name without extension: checksum} from a romindex.py index."""
+    from romindex import load_index
+    names = {}
+    for rom, entry in load_index(path).items():
+        if "checksum" in entry:
+            names[os.path.splitext(os.path.basename(rom))[0]] = entry["checksum"]
+    return names
+
+
+def known_records(path):
+    """{checksum: set of (dst, src, operator, operand)} from savestate_fixes.yml."""
+    known = {}
+    for key, records in parse_fixes_file(path).items():
+        for rec in records:
+            fix = parse_fix(rec)
+            if fix:
+                known.setdefault(key, set()).add(fix[:4])
+    return known
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find WRAM copies of APU ports across savestate snapshots.")
+    parser.add_argument("states", help="folder of snapshots (subfolders or NAMEnn.state per game)")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--ports", help="CSV: file,2140,2141,2142,2143 (hex) per snapshot")
+    src.add_argument("--port-offset", type=lambda s: int(s, 16), help="offset of the 4 port bytes in each dump (hex)")
+    parser.add_argument("--index", help="romindex.py index to map game names to checksums")
+    parser.add_argument("--checksum", help="checksum for all snapshots (one game)")
+    parser.add_argument("--fixes", help="savestate_fixes.yml to mark records that already exist")
+    parser.add_argument("--min-match", type=float, default=1.0, help="fraction of snapshots that must agree (^ only)")
+    parser.add_argument("--min-values", type=int, default=3, help="distinct port values required")
+    parser.add_argument("--top", type=int, default=10, help="candidates per game (0: all)")
+    args = parser.parse_args()
+
+    table = read_ports_table(args.ports) if args.ports else None
+    checksums = load_index_checksums(args.index) if args.index else {}
+    known = known_records(args.fixes) if args.fixes else {}
+
+    for group, paths in sorted(find_states(args.states).items()):
+        try:
+            wram, ports, used = load_snapshots(paths, table, args.port_offset)
+        except ValueError as e:
+            print(f"# {group}: {e}")
+            continue
+        cksum = (args.checksum or checksums.get(group, "????")).upper()
+        spread = ", ".join(f"{a:04X}: {len(np.unique(ports[:, i]))}" for i, a in enumerate(APU_PORTS))
+        print(f"# {group}: {len(used)} of {len(paths)} snapshots with port values; distinct {spread}")
+        found = correlate(wram, ports, args.min_match, args.min_values)
+        for c in found[:args.top or None]:
+            rec = record(c)
+            fix = parse_fix(rec)
+            mark = "  (known)" if fix and fix[:4] in known.get(cksum, ()) else ""
+            print(f"{cksum}: {rec} # {group} ({c.matched}/{len(used)}, {c.values} values){mark}")
+        if not found:
+            print("#   no candidates")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Profile the menu from an emulator CPU trace log, per menu.labels symbol.
+
+The trace is read line by line (plain or .gz), so its size does not
+matter; memory grows only with the number of distinct PCs and call
+stacks. A line is taken as an instruction when it starts with a 24-bit
+PC, which covers the usual logs:
+
+    bsnes/bsnes-plus   c08000 sei   A:0000 X:0000 ... V:  0 H:  0
+    Mesen              80:8000  SEI   A:0000 ... V:0 H:186 Fr:12 Cycle:4021
+    snes9x             $00/8000 78   SEI   A:0000 ... HC:0186 VC:000 FC:00
+
+An instruction's cycles are the time to the next line: from a running
+cycle counter (Cycle:, CYC:, MC:) when the log has one, otherwise from
+the V/H beam position (H in master clocks, or in dots when no line has
+H above 340, --h-units). Frames end where the frame counter (F:, Fr:,
+FC:) changes or V wraps.
+
+PCs resolve to symbols through the label file's interval index
+(relocated WRAM routines included, via the menu map), cached per PC.
+A shadow call stack follows JSR/JSL and RTS/RTL/RTI by return address;
+entering an interrupt vector (--image, else the NMI_16bit/IRQ_16bit
+style labels) pushes an interrupt frame. Trace time is attributed to
+(stack, symbol) pairs, which gives self and inclusive time per routine,
+time per call edge and folded stacks for flamegraph.pl / speedscope.
+
+Usage:
+    traceprof.py trace.log[.gz] [--labels snes-64tass/menu.labels] [--map menu] [--image menu.bin]
+                 [--top 25] [--folded stacks.txt] [--weight cycles|insns] [--frames 10]
+"""
+
+import argparse
+import gzip
+import heapq
+import itertools
+import re
+
+import snesmap
+from menulabels import DEFAULT_LABELS, label_widths, load_labels, rom_symbols
+
+MASTER_PER_LINE = 1364
+DOTS_PER_LINE = 341
+DETECT_LINES = 4096
+DEFAULT_INTERRUPTS = ("NMI_16bit", "IRQ_16bit", "BRK_handler", "COP_handler", "ABT_handler")
+UNKNOWN = "?"
+MAX_DEPTH = 64             # deeper shadow stacks lose their outermost frame (unbalanced stack tricks)
+
+_PC_RE = re.compile(rb"^\s*\$?([0-9A-Fa-f]{2})[:/]?([0-9A-Fa-f]{4})\s")
+_MNEM_RE = re.compile(rb"\s([A-Za-z]{3})(?=[\s.]|$)")
+_CYCLE_RE = re.compile(rb"\b(?:Cycle|CYC|Cyc|MC|Clk):\s*(\d+)")
+_V_RE = re.compile(rb"\b(?:V|VC):\s*([0-9A-Fa-f]+)")
+_H_RE = re.compile(rb"\b(?:H|HC):\s*([0-9A-Fa-f]+)")
+_FRAME_RE = re.compile(rb"\b(?:F|Fr|FC):\s*(\d+)")
+
+CALL_SIZES = {b"JSR": 3, b"JSL": 4}
+RETURNS = frozenset((b"RTS", b"RTL"))
+
+
+def open_trace(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def pc_counts(path):
+    """{pc: times executed} over a whole trace."""
+    counts = {}
+    with open_trace(path) as f:
+        for line in f:
+            m = _PC_RE.match(line)
+            if m:
+                pc = (int(m.group(1), 16) << 16) | int(m.group(2), 16)
+                counts[pc] = counts.get(pc, 0) + 1
+    return counts
+
+
+def _beam(line, hex_fields):
+    v, h = _V_RE.search(line), _H_RE.search(line)
+    if not v or not h:
+        return None
+    base = 16 if hex_fields else 10
+    return int(v.group(1), base), int(h.group(1), base)
+
+
+class Profile:
+    """Aggregates over one trace: (stack, symbol) counts, call edges, frames."""
+
+    def __init__(self, symbols, mapper, interrupts=(), h_scale=1, keep_frames=10):
+        self.symbols, self.mapper = symbols, mapper
+        self.interrupts = set(interrupts)
+        self.h_scale = h_scale
+        self.names = [UNKNOWN]
+        self._name_ids = {UNKNOWN: 0}
+        self._pc_sym = {}
+        self._stack_ids = {(): 0}
+        self.stacks = [()]
+        self.counts = {}           # (stack id, symbol id) -> [instructions, cycles]
+        self.calls = {}            # (caller id, callee id) -> calls
+        self.frames = 0
+        self.frame_cycles = []     # heap of (cycles, frame, busiest symbol id) for the worst frames
+        self.keep_frames = keep_frames
+        self.frame_max = {}        # symbol id -> most cycles in one frame
+        self._frame_syms = {}
+        self._frame_total = 0
+        self.lines = self.insns = self.cycles = 0
+        self.max_line = 0
+
+    def symbol(self, pc):
+        sym = self._pc_sym.get(pc)
+        if sym is None:
+            off = int(self.mapper.to_offset(pc))
+            name = None
+            if 0 <= off < self.symbols.image_size:
+                name, _ = self.symbols.lookup(off)
+            name = name or UNKNOWN
+            sym = self._name_ids.get(name)
+            if sym is None:
+                sym = self._name_ids[name] = len(self.names)
+                self.names.append(name)
+            self._pc_sym[pc] = sym
+        return sym
+
+    def _stack_id(self, shadow):
+        # the callers down to the innermost interrupt, which starts its own root
+        key = []
+        for sym, ret in shadow:
+            if ret is None:
+                key = [sym]
+            elif not key or key[-1] != sym:
+                key.append(sym)
+        key = tuple(key)
+        sid = self._stack_ids.get(key)
+        if sid is None:
+            sid = self._stack_ids[key] = len(self.stacks)
+            self.stacks.append(key)
+        return sid
+
+    def _end_frame(self):
+        if self._frame_total:
+            busiest = max(self._frame_syms, key=self._frame_syms.get)
+            item = (self._frame_total, self.frames, busiest)
+            if len(self.frame_cycles) < self.keep_frames:
+                heapq.heappush(self.frame_cycles, item)
+            else:
+                heapq.heappushpop(self.frame_cycles, item)
+            for sym, c in self._frame_syms.items():
+                if c > self.frame_max.get(sym, 0):
+                    self.frame_max[sym] = c
+        self.frames += 1
+        self._frame_syms = {}
+        self._frame_total = 0
+
+    def run(self, lines):
+        shadow = []                # (caller symbol id, return pc), or (vector symbol id, None) for interrupts
+        sid = 0
+        prev = None                # (pc, mnemonic, key, time, beam, frame counter)
+        hex_beam = None
+        for line in lines:
+            m = _PC_RE.match(line)
+            if not m:
+                continue
+            self.lines += 1
+            pc = (int(m.group(1), 16) << 16) | int(m.group(2), 16)
+            mn = _MNEM_RE.search(line, m.end() - 1)
+            mnem = mn.group(1).upper() if mn else b""
+
+            if hex_beam is None:
+                hex_beam = b"HC:" in line
+            c = _CYCLE_RE.search(line)
+            t = int(c.group(1)) if c else None
+            beam = None if c else _beam(line, hex_beam)
+            f = _FRAME_RE.search(line)
+            fc = int(f.group(1)) if f else None
+            if beam:
+                self.max_line = max(self.max_line, beam[0])
+
+            # control flow from the previous instruction
+            if prev is not None:
+                ppc, pmnem = prev[0], prev[1]
+                if pmnem in CALL_SIZES:
+                    ret = (ppc & 0xFF0000) | ((ppc + CALL_SIZES[pmnem]) & 0xFFFF)
+                    caller = self.symbol(ppc)
+                    callee = self.symbol(pc)
+                    shadow.append((caller, ret))
+                    if len(shadow) > MAX_DEPTH:
+                        del shadow[0]
+                    self.calls[(caller, callee)] = self.calls.get((caller, callee), 0) + 1
+                    sid = self._stack_id(shadow)
+                elif pmnem in RETURNS or pmnem == b"RTI":
+                    for depth in range(len(shadow) - 1, -1, -1):
+                        ret = shadow[depth][1]
+                        if (ret == pc if pmnem != b"RTI" else ret is None):
+                            del shadow[depth:]
+                            sid = self._stack_id(shadow)
+                            break
+                if pc in self.interrupts and pmnem not in CALL_SIZES:
+                    shadow.append((self.symbol(pc), None))
+                    sid = self._stack_id(shadow)
+
+                # time of the previous instruction
+                cycles = 0
+                if t is not None and prev[3] is not None:
+                    cycles = max(0, t - prev[3])
+                elif beam and prev[4]:
+                    (v, h), (pv, ph) = beam, prev[4]
+                    lines_per_frame = max(self.max_line + 1, 262)
+                    dv = v - pv if v >= pv else v + lines_per_frame - pv
+                    cycles = max(0, dv * MASTER_PER_LINE + (h - ph) * self.h_scale)
+                count = self.counts.get(prev[2])
+                if count is None:
+                    count = self.counts[prev[2]] = [0, 0]
+                count[0] += 1
+                count[1] += cycles
+                self.insns += 1
+                self.cycles += cycles
+                psym = prev[2][1]
+                self._frame_syms[psym] = self._frame_syms.get(psym, 0) + cycles
+                self._frame_total += cycles
+
+                if (fc is not None and prev[5] is not None and fc != prev[5]) or \
+                        (fc is None and beam and prev[4] and beam[0] < prev[4][0]):
+                    self._end_frame()
+            elif pc in self.interrupts:
+                shadow.append((self.symbol(pc), None))
+                sid = self._stack_id(shadow)
+
+            prev = (pc, mnem, (sid, self.symbol(pc)), t, beam, fc)
+        if prev is not None:
+            count = self.counts.setdefault(prev[2], [0, 0])
+            count[0] += 1
+            self.insns += 1
+        self._end_frame()
+        return self
+
+    # -- reports --
+
+    def path(self, sid, sym):
+        """Symbol ids from the outermost caller to sym, recursion collapsed."""
+        chain = self.stacks[sid]
+        return chain if chain and chain[-1] == sym else chain + (sym,)
+
+    def per_symbol(self):
+        """{name: [self insns, self cycles, inclusive insns, inclusive cycles]}."""
+        out = {}
+        for (sid, sym), (insns, cycles) in self.counts.items():
+            row = out.setdefault(self.names[sym], [0, 0, 0, 0])
+            row[0] += insns
+            row[1] += cycles
+            for s in set(self.path(sid, sym)):
+                row = out.setdefault(self.names[s], [0, 0, 0, 0])
+                row[2] += insns
+                row[3] += cycles
+        return out
+
+    def per_edge(self):
+        """{(caller, callee): [calls, inclusive cycles of the callee under the caller's frame]}."""
+        out = {}
+        for (a, b), n in self.calls.items():
+            out[(self.names[a], self.names[b])] = [n, 0]
+        for (sid, sym), (_, cycles) in self.counts.items():
+            chain = self.path(sid, sym)
+            for a, b in set(zip(chain, chain[1:])):
+                key = (self.names[a], self.names[b])
+                if key in out:
+                    out[key][1] += cycles
+        return out
+
+    def folded(self, weight="cycles"):
+        """flamegraph.pl lines: 'outer;...;leaf value'."""
+        merged = {}
+        col = 1 if weight == "cycles" else 0
+        for (sid, sym), counts in self.counts.items():
+            key = ";".join(self.names[s] for s in self.path(sid, sym))
+            merged[key] = merged.get(key, 0) + counts[col]
+        return [f"{k} {v}" for k, v in sorted(merged.items()) if v]
+
+
+def interrupt_entries(labels, mapper, image=None):
+    """PCs of the interrupt handlers: native/emulation vectors of the image, or the handler labels."""
+    pcs = set()
+    if image is not None:
+        base = int(mapper.to_offset(0x00FFE4))
+        if 0 <= base and base + 0x1C <= len(image):
+            for i in range(0, 0x1C, 2):
+                vec = image[base + i] | (image[base + i + 1] << 8)
+                if vec >= 0x8000:
+                    pcs.add(vec)
+    for name in DEFAULT_INTERRUPTS:
+        if name in labels:
+            # the vectors hold bank 00 addresses of the bank $C0 stubs
+            pcs.add(labels[name] & 0xFFFF)
+            pcs.add(labels[name])
+    return pcs
+
+
+def detect_h_scale(lines):
+    """Master clocks per H unit: 1 if any H is above 340 (master clocks), 4 otherwise (dots)."""
+    hex_fields = any(b"HC:" in line for line in lines)
+    for line in lines:
+        beam = _beam(line, hex_fields)
+        if beam and beam[1] >= DOTS_PER_LINE:
+            return 1
+    return MASTER_PER_LINE // DOTS_PER_LINE
+
+
+def profile(path, labels_path=DEFAULT_LABELS, map_name="menu", image_path=None, h_units="auto",
+            image_size=0x10000, keep_frames=10):
+    labels = load_labels(labels_path)
+    mapper = snesmap.get_mapper(map_name, labels)
+    image = None
+    if image_path:
+        with open(image_path, "rb") as f:
+            image = f.read()
+        image_size = len(image)
+    symbols = rom_symbols(labels, mapper, image_size, label_widths(labels_path))
+    interrupts = interrupt_entries(labels, mapper, image)
+    with open_trace(path) as f:
+        head = list(itertools.islice(f, DETECT_LINES))
+        scale = {"master": 1, "dot": MASTER_PER_LINE // DOTS_PER_LINE}.get(h_units) or detect_h_scale(head)
+        prof = Profile(symbols, mapper, interrupts, scale, keep_frames)
+        prof.run(itertools.chain(head, f))
+    return prof
+
+
+def _pct(part, whole):
+    return 100.0 * part / whole if whole else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-symbol profile of an emulator CPU trace log.")
+    parser.add_argument("trace", help="trace log (.gz ok)")
+    parser.add_argument("--labels", default=DEFAULT_LABELS)
+    parser.add_argument("--map", default="menu", help="memory map (" + ", ".join(snesmap.MAPPERS) + ")")
+    parser.add_argument("--image", help="ROM image, for its size and interrupt vectors")
+    parser.add_argument("--h-units", choices=("auto", "master", "dot"), default="auto")
+    parser.add_argument("--top", type=int, default=25, help="routines and edges to list")
+    parser.add_argument("--frames", type=int, default=10, help="worst frames to list")
+    parser.add_argument("--folded", help="write flamegraph folded stacks here")
+    parser.add_argument("--weight", choices=("cycles", "insns"), default="cycles", help="folded stack values")
+    args = parser.parse_args()
+
+    try:
+        prof = profile(args.trace, args.labels, args.map, args.image, args.h_units, keep_frames=args.frames)
+    except ValueError as e:
+        parser.error(str(e))
+    if not prof.insns:
+        parser.error(f"{args.trace}: no instruction lines recognised")
+
+    total = prof.cycles or prof.insns
+    unit = "cycles" if prof.cycles else "insns"
+    col = 1 if prof.cycles else 0
+    print(f"{args.trace}: {prof.insns} instructions, {prof.cycles} master cycles, {prof.frames} frames, "
+          f"{len(prof._pc_sym)} PCs, {len(prof.stacks)} stacks")
+
+    rows = prof.per_symbol()
+    print(f"\nhot routines (self {unit}):")
+    print(f"  {'self %':>7} {'self':>12} {'incl %':>7} {'insns':>10} {'max/frame':>10}  symbol")
+    ids = prof._name_ids
+    for name, r in sorted(rows.items(), key=lambda kv: (-kv[1][col], kv[0]))[:args.top]:
+        if not r[col]:
+            break
+        worst = prof.frame_max.get(ids[name], 0)
+        print(f"  {_pct(r[col], total):6.1f}% {r[col]:12d} {_pct(r[col + 2], total):6.1f}% {r[0]:10d} "
+              f"{worst:10d}  {name}")
+
+    edges = prof.per_edge()
+    if edges:
+        print("\ncall edges (inclusive cycles):")
+        for (a, b), (n, cycles) in sorted(edges.items(), key=lambda kv: (-kv[1][1], -kv[1][0]))[:args.top]:
+            print(f"  {_pct(cycles, prof.cycles):6.1f}% {cycles:12d} {n:8d} calls  {a} -> {b}")
+
+    if prof.frame_cycles and prof.cycles:
+        print(f"\nbusiest frames (of {prof.frames}):")
+        for cycles, frame, sym in sorted(prof.frame_cycles, reverse=True):
+            print(f"  frame {frame:6d}: {cycles:9d} cycles, most in {prof.names[sym]}")
+
+    if args.folded:
+        with open(args.folded, "w") as f:
+            for line in prof.folded(args.weight):
+                f.write(line + "\n")
+        print(f"\nfolded stacks written to {args.folded}")
+
+
+if __name__ == "__main__":
+    main()
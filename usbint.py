@@ -0,0 +1,1093 @@
+#!/usr/bin/env python3
+"""
+Host side of the USB command protocol in src/usbinterface.c: an asyncio
+client, a local simulator of the firmware server and a throughput
+benchmark.
+
+Protocol (all multi-byte fields big endian):
+    command   512 bytes, or 64 for VGET/VPUT: "USBA", opcode [4], space [5],
+              flags [6], size [252..255], offset or NUL-terminated name at
+              [256..]; VGET/VPUT carry up to 8 vectors at [32 + 4 * i]
+              (size byte, 24-bit offset); MV takes the new name at [8..]
+    response  512 bytes: "USBA", opcode RESPONSE, error [5], size [252..255]
+              (not sent with NORESP)
+    data      blocks of 512 bytes (64 with 64BDATA), the last zero-padded;
+              GET/VGET/LS send them after the response, PUT/VPUT take them
+              after the command
+
+Device is the firmware state machine without I/O: feed() takes host bytes
+as usbint_recv_flit() does and poll() returns the next block the device
+sends. It keeps the firmware's quirks, since they decide what a host may
+do: a command that arrives while GET/VGET/LS data is still going out
+takes over and the old transfer is dropped, leaving the data counter
+where it was (the next GET starts short); a zero-length GET sends no
+data at all. Commands after a PUT/VPUT are held back until its data is
+in, so writes may be pipelined; reads may not.
+
+The simulator serves a Device over TCP or a pty. The link is paced at
+--rate bytes/s each way with --latency ms of turnaround per command; the
+defaults are roughly full-speed USB CDC. SNES space is a flat 16 MB,
+MSU and CMD 64 KB each, and FILE space a host directory (--root).
+STREAM has no MSU-1 producer behind it, so it only ever sends the state
+preload and NOP blocks.
+
+Client pipelines requests: up to --depth commands are outstanding, and
+a command is only held while a read's data is still on its way. read()
+and write() queue small transfers and coalesce whatever is queued into
+VGET/VPUT commands of 8 vectors (255 bytes each); larger ones become
+GET/PUT.
+
+Usage:
+    usbint.py serve [--listen 127.0.0.1:5299 | --pty] [--root sd/] [--rate 1000000] [--latency 1.0]
+    usbint.py bench [--target HOST:PORT | /dev/ttyACM0] [--ops read,write] [--sizes 16,64,255,2048,16384]
+                    [--blocks 64,512] [--depths 1,4,16] [--bytes 262144]
+    usbint.py info TARGET
+    usbint.py ls TARGET [/path]
+    usbint.py get TARGET (OFFSET SIZE | /path) [-o out.bin] [--space snes]
+    usbint.py put TARGET (OFFSET | /path) FILE [--space snes]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+BLOCK_SIZE = 512
+SMALL_BLOCK = 64
+MAGIC = b"USBA"
+
+(OP_GET, OP_PUT, OP_VGET, OP_VPUT, OP_LS, OP_MKDIR, OP_RM, OP_MV, OP_RESET, OP_BOOT,
+ OP_POWER_CYCLE, OP_INFO, OP_MENU_RESET, OP_STREAM, OP_TIME, OP_RESPONSE) = range(16)
+SPACE_FILE, SPACE_SNES, SPACE_MSU, SPACE_CMD, SPACE_CONFIG, SPACE_CFG = range(6)
+SPACES = {"file": SPACE_FILE, "snes": SPACE_SNES, "msu": SPACE_MSU, "cmd": SPACE_CMD,
+          "config": SPACE_CONFIG, "cfg": SPACE_CFG}
+
+FLAG_SKIPRESET = 0x01
+FLAG_ONLYRESET = 0x02
+FLAG_CLRX = 0x04
+FLAG_SETX = 0x08
+FLAG_STREAMBURST = 0x10
+FLAG_NORESP = 0x40
+FLAG_64BDATA = 0x80
+
+(STATE_IDLE, STATE_HANDLE_CMD, STATE_HANDLE_DAT, STATE_HANDLE_DATPUSH, STATE_HANDLE_REQDAT,
+ STATE_HANDLE_STREAM, STATE_HANDLE_LOCK) = range(7)
+
+VECTORS = 8
+VECTOR_MAX = 255
+SNESCMD_WRAM_CHEATS = 0x2AD8
+SNESCMD_EXE = 0x2C00
+STREAM_PRELOAD = 0x50000
+DEFAULT_PORT = 5299
+DEFAULT_RATE = 1000000
+DEFAULT_LATENCY = 1.0
+
+
+def command(opcode, space=SPACE_SNES, flags=0, size=0, offset=None, name=None, vectors=None, arg=None):
+    """Command block; vectors is [(offset, size)], arg the bytes at [8..] (MV, TIME)."""
+    buf = bytearray(BLOCK_SIZE)
+    buf[0:4] = MAGIC
+    buf[4], buf[5], buf[6] = opcode, space, flags
+    if arg:
+        buf[8:8 + len(arg)] = arg
+    for i, (off, n) in enumerate(vectors or ()):
+        if i >= VECTORS or not 0 < n <= VECTOR_MAX:
+            raise ValueError(f"vector {i}: {n} bytes at ${off:06X} (up to {VECTORS} of 1-{VECTOR_MAX} bytes)")
+        buf[32 + i * 4] = n
+        buf[33 + i * 4:36 + i * 4] = (off & 0xFFFFFF).to_bytes(3, "big")
+    buf[252:256] = size.to_bytes(4, "big")
+    if offset is not None:
+        buf[256:260] = offset.to_bytes(4, "big")
+    if name is not None:
+        raw = name.encode("latin-1") if isinstance(name, str) else bytes(name)
+        buf[256:256 + min(len(raw), 255)] = raw[:255]
+    return bytes(buf[:SMALL_BLOCK if opcode in (OP_VGET, OP_VPUT) else BLOCK_SIZE])
+
+
+def parse_response(block):
+    """(error, size) of a response block."""
+    if len(block) < BLOCK_SIZE or block[:4] != MAGIC or block[4] != OP_RESPONSE:
+        raise IOError("not a response block")
+    return block[5], int.from_bytes(block[252:256], "big")
+
+
+def parse_ls(data):
+    """[(is_dir, name)] from LS data blocks; continuation markers skip to the next block."""
+    entries = []
+    for pos in range(0, len(data), BLOCK_SIZE):
+        block = data[pos:pos + BLOCK_SIZE]
+        i = 0
+        while i < len(block):
+            kind = block[i]
+            if kind == 0xFF:
+                return entries
+            if kind == 2:
+                break
+            end = block.index(0, i + 1)
+            entries.append((kind == 0, block[i + 1:end].decode("latin-1")))
+            i = end + 1
+    return entries
+
+
+def _cstring(buf, start, limit=None):
+    end = buf.find(0, start, limit)
+    return bytes(buf[start:end if end >= 0 else limit])
+
+
+class Device:
+    """usbinterface.c server state machine over in-memory spaces and a host directory."""
+
+    def __init__(self, root=None, version="1.11.0-sim", name="FXPAK PRO sim", fwver=0x00010B00):
+        self.snes = bytearray(0x1000000)
+        self.msu = bytearray(0x10000)
+        self.cmd = bytearray(0x10000)
+        self.config = {}
+        self.cfg = {}
+        self.root = root
+        self.version, self.name, self.fwver = version, name, fwver
+        self.features = 0
+        self.rom = ""
+        self.events = []
+        self.stats = {"commands": 0, "preempted": 0, "stalled": 0, "bytes_in": 0, "bytes_out": 0}
+
+        self.state = STATE_IDLE
+        self.cmd_dat = False
+        self.data_ready = False
+        self.recv = bytearray()
+        self.cmd_buffer = bytearray(BLOCK_SIZE)
+        self.block_size = BLOCK_SIZE
+        self.opcode = self.space = self.flags = 0
+        self.size = self.total_size = self.offset = self.error = 0
+        self.vector_count = 0
+        self.out = deque()
+        # the two static counters of usbint_recv_block() and usbint_handler_dat()
+        self.put_count = 0
+        self.dat_count = 0
+        self.fbuf = b""
+        self.fh = None
+        self.dir = None
+        self.entry = None
+        self.entry_cont = False
+        self.stream_init = False
+        self.preload = 0
+
+    # -- connection and flit collection --
+
+    def disconnect(self):
+        """usbint_check_connect() on close; a partly received command stays buffered as on the device."""
+        self.state = STATE_IDLE
+        self.data_ready = False
+        self.cmd_dat = False
+        self.out.clear()
+
+    def feed(self, data):
+        """Host -> device bytes."""
+        self.stats["bytes_in"] += len(data)
+        self.recv += data
+        while True:
+            if self.cmd_dat:
+                size = self.block_size
+            elif len(self.recv) < 64:
+                return
+            else:
+                size = 64 if self.recv[4] in (OP_VGET, OP_VPUT) else BLOCK_SIZE
+            if len(self.recv) < size:
+                return
+            block = bytes(self.recv[:size])
+            del self.recv[:size]
+            if self.cmd_dat:
+                self._recv_data(block)
+            else:
+                self.block_size = SMALL_BLOCK if block[6] & FLAG_64BDATA else BLOCK_SIZE
+                self.cmd_buffer[:size] = block
+                self._recv_command()
+
+    def poll(self):
+        """Next device -> host block, or None while there is nothing to send."""
+        if not self.out and self.data_ready and self.state in (STATE_HANDLE_DAT, STATE_HANDLE_STREAM):
+            self._handler_dat()
+        if not self.out:
+            return None
+        block = self.out.popleft()
+        self.stats["bytes_out"] += len(block)
+        return block
+
+    def _recv_command(self):
+        if self.cmd_buffer[:4] != MAGIC:
+            return
+        if self.cmd_buffer[4] in (OP_PUT, OP_VPUT):
+            self.cmd_dat = True
+        if self.state in (STATE_HANDLE_DAT, STATE_HANDLE_STREAM):
+            # the lock loop in usbint_handler_cmd() sees HANDLE_CMD and gives up on the transfer
+            self.stats["preempted"] += 1
+            self.data_ready = False
+            self._finish()
+        self.state = STATE_HANDLE_CMD
+        self._handler_cmd()
+
+    def _recv_data(self, block):
+        if self.space == SPACE_FILE:
+            n = 0
+            while True:
+                chunk = block[n:n + min(self.block_size - n, self.size - self.put_count)]
+                if self.fh is not None:
+                    self.fh.seek(self.put_count)
+                    self.fh.write(chunk)
+                else:
+                    self.error |= 1
+                n += len(chunk)
+                self.put_count += len(chunk)
+                if not (n != self.block_size and self.put_count < self.size):
+                    break
+        else:
+            n = 0
+            while True:
+                if self.space in (SPACE_SNES, SPACE_CMD):
+                    count = min(self.block_size - n, self.size - self.put_count)
+                    self._write(self.space, self.offset + self.put_count, block[n:n + count])
+                else:
+                    group, index = self.size & 0xFF, self.offset & 0xFF
+                    data, invmask = (self.offset >> 8) & 0xFF, (self.offset >> 16) & 0xFF
+                    old = self.config.get((group, index), 0)
+                    self.config[(group, index)] = (old & invmask) | (data & ~invmask & 0xFF)
+                    count = 1
+                    self.size = 1
+                n += count
+                self.put_count += count
+                if self.opcode == OP_VPUT and self.put_count == self.size:
+                    self._next_vector("put_count")
+                if not (n != self.block_size and self.put_count < self.size):
+                    break
+        if self.put_count >= self.size:
+            if self.fh is not None:
+                self.fh.close()
+                self.fh = None
+            self.block_size = BLOCK_SIZE
+            self.cmd_dat = False
+            self.put_count = 0
+            if self.state == STATE_HANDLE_LOCK:
+                self.state = STATE_IDLE
+                self._finish()
+
+    def _next_vector(self, counter):
+        while self.vector_count < VECTORS:
+            self.vector_count += 1
+            # vector 8 reads cmd_buffer[64..67], left over from the last 512-byte command
+            base = 32 + self.vector_count * 4
+            if self.cmd_buffer[base]:
+                self.size = self.cmd_buffer[base]
+                self.offset = int.from_bytes(self.cmd_buffer[base + 1:base + 4], "big")
+                setattr(self, counter, 0)
+                return
+
+    # -- memory spaces --
+
+    def _read(self, space, addr, count):
+        if space == SPACE_SNES:
+            mem, mask = self.snes, 0xFFFFFF
+        elif space == SPACE_MSU:
+            mem, mask = self.msu, 0xFFFF
+        else:
+            mem, mask = self.cmd, 0xFFFF
+        addr &= mask
+        if addr + count <= len(mem):
+            return bytes(mem[addr:addr + count])
+        return bytes(mem[(addr + i) & mask] for i in range(count))
+
+    def _write(self, space, addr, data):
+        mem, mask = (self.snes, 0xFFFFFF) if space == SPACE_SNES else (self.cmd, 0xFFFF)
+        addr &= mask
+        if addr + len(data) <= len(mem):
+            mem[addr:addr + len(data)] = data
+        else:
+            for i, b in enumerate(data):
+                mem[(addr + i) & mask] = b
+
+    def _path(self, raw):
+        """Host path for a FatFs path, or None outside the root."""
+        if self.root is None:
+            return None
+        parts = [p for p in raw.decode("latin-1").replace("\\", "/").split("/") if p and p != "."]
+        if ".." in parts:
+            return None
+        return os.path.join(self.root, *parts)
+
+    # -- command handler --
+
+    def _handler_cmd(self):
+        self.stats["commands"] += 1
+        buf = self.cmd_buffer
+        param = _cstring(buf, 256, BLOCK_SIZE)
+        self.opcode, self.space, self.flags = buf[4], buf[5], buf[6]
+        self.size = self.total_size = int.from_bytes(buf[252:256], "big")
+        self.offset = 0
+        self.error = 0
+        op, space = self.opcode, self.space
+
+        if op == OP_GET:
+            if space == SPACE_FILE:
+                path = self._path(param)
+                try:
+                    self.size = self.total_size = os.path.getsize(path)
+                    self.fh = open(path, "rb")
+                except (OSError, TypeError):
+                    self.size = self.total_size = 0
+                    self.error |= 1
+            elif space == SPACE_CFG:
+                value = self.cfg.get(param.decode("latin-1"))
+                self.error |= value is None
+                if value is not None:
+                    self.fbuf = str(value).encode("latin-1")
+                self.size = self.total_size = len(self.fbuf) + 1
+            else:
+                self.offset = int.from_bytes(buf[256:260], "big")
+        elif op == OP_PUT:
+            if space == SPACE_FILE:
+                try:
+                    self.fh = open(self._path(param), "wb")
+                except (OSError, TypeError):
+                    self.fh = None
+                    self.error = 1
+            else:
+                self.offset = int.from_bytes(buf[256:260], "big")
+        elif op in (OP_VGET, OP_VPUT):
+            # don't support MSU for now (the firmware only refuses FILE)
+            self.error = int(space == SPACE_FILE)
+            if not self.error:
+                self.total_size = sum(buf[32 + i * 4] for i in range(VECTORS))
+                self.vector_count = 0
+                self.size = buf[32]
+                self.offset = int.from_bytes(buf[33:36], "big")
+        elif op == OP_LS:
+            self.entry_cont = False
+            path = self._path(param)
+            try:
+                names = sorted(os.listdir(path))
+                if param.strip(b"/"):
+                    names = [".", ".."] + names
+                self.dir = iter([(os.path.isdir(os.path.join(path, n)), n) for n in names])
+            except (OSError, TypeError):
+                self.dir = None
+                self.error |= 1
+            self.size = self.total_size = 1
+        elif op == OP_MKDIR:
+            try:
+                os.mkdir(self._path(param))
+            except (OSError, TypeError):
+                self.error |= 1
+        elif op == OP_RM:
+            try:
+                path = self._path(param)
+                if os.path.isdir(path):
+                    os.rmdir(path)
+                else:
+                    os.unlink(path)
+            except (OSError, TypeError):
+                self.error |= 1
+        elif op == OP_RESET:
+            self.events.append(("reset",))
+        elif op == OP_MENU_RESET:
+            self.rom = ""
+            self.events.append(("menu_reset",))
+        elif op == OP_STREAM:
+            self.error = int(space != SPACE_MSU)
+            if not self.error:
+                self.stream_init = True
+                self.offset = int.from_bytes(buf[256:260], "big")
+        elif op in (OP_INFO, OP_BOOT, OP_POWER_CYCLE):
+            pass
+        elif op not in (OP_TIME, OP_MV):
+            self.error = 1
+        if op in (OP_TIME, OP_MV):
+            # TIME falls through into MV in the firmware, renaming with its clock bytes
+            if op == OP_TIME:
+                self.events.append(("time", bytes(buf[8:15])))
+            slash = param.rfind(b"/")
+            target = (param[:slash + 1] if slash >= 0 else param) + _cstring(buf, 8, BLOCK_SIZE)
+            try:
+                os.rename(self._path(param), self._path(target[:255]))
+            except (OSError, TypeError):
+                self.error |= 1
+
+        if not self.error and self.flags & FLAG_CLRX:
+            self.cmd[SNESCMD_WRAM_CHEATS] = 0x60
+        if op == OP_BOOT:
+            if not self.flags & FLAG_ONLYRESET:
+                self.rom = param.decode("latin-1")
+                self.events.append(("boot", self.rom))
+            if not self.flags & FLAG_SKIPRESET:
+                self.events.append(("gameloop",))
+
+        if op in (OP_GET, OP_VGET, OP_LS):
+            self.state = STATE_HANDLE_DAT
+        elif op in (OP_PUT, OP_VPUT):
+            self.state = STATE_HANDLE_LOCK
+        elif op == OP_STREAM:
+            self.state = STATE_HANDLE_STREAM
+        else:
+            self.state = STATE_IDLE
+
+        self.data_ready = self.state in (STATE_HANDLE_DAT, STATE_HANDLE_STREAM)
+        if not self.flags & FLAG_NORESP:
+            self.out.append(self._response())
+        elif self.state == STATE_HANDLE_DAT:
+            self.state = STATE_HANDLE_DATPUSH
+            self._handler_dat()
+            if self.state == STATE_HANDLE_DATPUSH:
+                self.state = STATE_HANDLE_DAT
+        if self.state not in (STATE_HANDLE_LOCK, STATE_HANDLE_DAT, STATE_HANDLE_STREAM):
+            self._finish()
+
+    def _response(self):
+        buf = bytearray(BLOCK_SIZE)
+        buf[0:4] = MAGIC
+        buf[4] = OP_RESPONSE
+        buf[5] = self.error & 0xFF
+        buf[252:256] = (self.total_size & 0xFFFFFFFF).to_bytes(4, "big")
+        if self.opcode == OP_INFO:
+            buf[256:260] = self.fwver.to_bytes(4, "big")
+            version, name = self.version.encode()[:64], self.name.encode()[:64]
+            buf[260:260 + len(version)] = version
+            buf[324:324 + len(name)] = name
+            buf[6:10] = self.features.to_bytes(4, "little")
+            rom = self.rom.encode("latin-1")[-(255 - 16):]
+            buf[16:16 + len(rom)] = rom
+        return bytes(buf)
+
+    def _finish(self):
+        """End of the command's lock loop: SETX runs the uploaded routine, POWER_CYCLE resets."""
+        if self.flags & FLAG_SETX and not self.error:
+            code = self._read(SPACE_SNES, self.offset, max(self.size, 1))
+            self.cmd[SNESCMD_EXE:SNESCMD_EXE + len(code) + 3] = code + b"\x6c\xea\xff"
+            self.events.append(("exe", self.offset, self.size))
+        if self.opcode == OP_POWER_CYCLE:
+            self.events.append(("power_cycle",))
+
+    # -- data handler --
+
+    def _handler_dat(self):
+        bs = self.block_size
+        buf = bytearray(bs)
+        sent = 0
+        stream_end = False
+        op = self.opcode
+        if op in (OP_GET, OP_VGET) and self.space == SPACE_FILE:
+            while True:
+                chunk = self.fh.read(bs - sent) if self.fh else b""
+                buf[sent:sent + len(chunk)] = chunk
+                sent += len(chunk)
+                self.dat_count += len(chunk)
+                if not chunk or not (sent != bs and self.dat_count < self.size):
+                    break
+            if self.dat_count >= self.size and self.fh:
+                self.fh.close()
+                self.fh = None
+        elif op in (OP_GET, OP_VGET):
+            while True:
+                if self.space in (SPACE_SNES, SPACE_MSU, SPACE_CMD):
+                    count = min(bs - sent, self.size - self.dat_count)
+                    buf[sent:sent + count] = self._read(self.space, self.offset + self.dat_count, count)
+                else:
+                    buf[sent] = self.config.get((self.size & 0xFF, self.offset & 0xFF), 0)
+                    count = 1
+                    self.size = 1
+                sent += count
+                self.dat_count += count
+                if op == OP_VGET and self.dat_count == self.size:
+                    self._next_vector("dat_count")
+                if not (sent != bs and self.dat_count < self.size):
+                    break
+        elif op == OP_LS:
+            while True:
+                cont = self.entry_cont
+                self.entry_cont = False
+                if not cont:
+                    self.entry = next(self.dir, None) if self.dir is not None else None
+                if self.error or self.entry is None:
+                    buf[sent] = 0xFF
+                    sent += 1
+                    self.dat_count = 1
+                    self.dir = None
+                    break
+                is_dir, name = self.entry
+                raw = name.encode("latin-1", "replace")
+                if sent + 1 + len(raw) + 1 <= bs:
+                    buf[sent] = 0 if is_dir else 1
+                    buf[sent + 1:sent + 1 + len(raw)] = raw
+                    sent += len(raw) + 2
+                else:
+                    buf[sent] = 2
+                    sent += 1
+                    self.entry_cont = True
+                    break
+                if sent >= bs:
+                    break
+        elif op == OP_STREAM:
+            if self.stream_init:
+                self.dat_count = 0
+                self.preload = STREAM_PRELOAD if self.flags & FLAG_STREAMBURST else 0
+                self.stream_init = False
+            if self.dat_count % 8 == 0 and self.preload < STREAM_PRELOAD:
+                buf[0:64] = self._read(SPACE_SNES, 0xF50000 + self.preload, 64)
+                sent = 64
+                self.preload += 64
+            self.dat_count += 1
+            buf[sent:] = b"\xff" * (bs - sent)
+            stream_end = sent < bs
+            sent = bs
+
+        if not sent:
+            # nothing read (zero-length GET): the firmware sends nothing and stays in HANDLE_DAT
+            self.stats["stalled"] += 1
+            self.data_ready = False
+            return
+        stream = self.state == STATE_HANDLE_STREAM
+        if not stream or (self.flags & FLAG_STREAMBURST and stream_end):
+            if self.dat_count >= self.size or stream:
+                self.data_ready = False
+                self.state = STATE_IDLE
+                self.dat_count = 0
+                self._finish()
+        self.out.append(bytes(buf))
+
+
+class Pacer:
+    """Spaces transfers on one direction of the link to rate bytes/s."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.next = 0.0
+
+    async def __call__(self, nbytes):
+        if not self.rate:
+            return
+        now = time.perf_counter()
+        # a little slack so that sleeping late does not lower the rate
+        self.next = max(self.next, now - 0.002) + nbytes / self.rate
+        if self.next - now > 0.0005:
+            await asyncio.sleep(self.next - now)
+
+
+async def serve_stream(device, reader, writer, rate=DEFAULT_RATE, latency=DEFAULT_LATENCY):
+    """Run a device over one host connection until it closes."""
+    wake = asyncio.Event()
+    host_to_device, device_to_host = Pacer(rate), Pacer(rate)
+
+    async def receive():
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                return
+            await host_to_device(len(data))
+            before = device.stats["commands"]
+            device.feed(data)
+            if device.stats["commands"] != before and latency:
+                await asyncio.sleep(latency / 1000 * (device.stats["commands"] - before))
+            wake.set()
+
+    async def send():
+        while True:
+            block = device.poll()
+            if block is None:
+                wake.clear()
+                await wake.wait()
+                continue
+            writer.write(block)
+            await writer.drain()
+            await device_to_host(len(block))
+
+    rx, tx = asyncio.ensure_future(receive()), asyncio.ensure_future(send())
+    try:
+        done, _ = await asyncio.wait((rx, tx), return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() and not isinstance(task.exception(), (ConnectionError, OSError)):
+                raise task.exception()
+    finally:
+        rx.cancel()
+        tx.cancel()
+        device.disconnect()
+        writer.close()
+
+
+async def start_server(device, host="127.0.0.1", port=DEFAULT_PORT, rate=DEFAULT_RATE, latency=DEFAULT_LATENCY):
+    """TCP server for a device; one connection at a time, like the CDC port."""
+    busy = asyncio.Lock()
+
+    async def connection(reader, writer):
+        try:
+            async with busy:
+                await serve_stream(device, reader, writer, rate, latency)
+        except asyncio.CancelledError:
+            pass  # server shut down with a host still connected
+
+    return await asyncio.start_server(connection, host, port)
+
+
+async def _pipe_streams(read_fd, write_fd):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, "rb", 0))
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin,
+                                                        os.fdopen(write_fd, "wb", 0))
+    return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+
+async def serve_pty(device, rate=DEFAULT_RATE, latency=DEFAULT_LATENCY, announce=print):
+    """Serve a device on a new pty until cancelled; the path of its slave side is announced."""
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    announce(os.ttyname(slave))
+    # keeping the slave open stops the master reading EIO when a host closes it
+    reader, writer = await _pipe_streams(master, os.dup(master))
+    await serve_stream(device, reader, writer, rate, latency)
+
+
+class Client:
+    """Pipelined client for a device (or the simulator) on a TCP socket or serial port."""
+
+    def __init__(self, reader, writer, depth=4, block=BLOCK_SIZE, noresp=False):
+        self.reader, self.writer = reader, writer
+        self.depth = depth
+        self.block = block
+        self.noresp = noresp
+        self._cond = asyncio.Condition()
+        self._inflight = 0
+        self._reading = 0
+        self._last = None
+        self._pending = deque()
+        self._pump_task = None
+
+    @classmethod
+    async def open(cls, target, **kwargs):
+        """target is HOST:PORT or a serial device path."""
+        if os.path.exists(target):
+            import termios
+            import tty
+            fd = os.open(target, os.O_RDWR | os.O_NOCTTY)
+            if os.isatty(fd):
+                tty.setraw(fd, termios.TCSANOW)
+            reader, writer = await _pipe_streams(fd, os.dup(fd))
+        else:
+            host, _, port = target.rpartition(":")
+            reader, writer = await asyncio.open_connection(host or "127.0.0.1", int(port))
+        return cls(reader, writer, **kwargs)
+
+    async def close(self):
+        if self._pump_task:
+            await self._pump_task
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError, NotImplementedError):
+            pass  # pipe writers (serial ports) have no close waiter
+
+    # -- pipeline --
+
+    async def _submit(self, cmd, data, reply, read=False):
+        """Send a command (and its data); returns a future for reply(), run after all earlier replies."""
+        loop = asyncio.get_running_loop()
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._reading and self._inflight < self.depth)
+            self._inflight += 1
+            self._reading += read
+            prev, done = self._last, loop.create_future()
+            self._last = done
+            self.writer.write(cmd + data)
+        await self.writer.drain()
+        return asyncio.ensure_future(self._reply(prev, done, reply, read))
+
+    async def _reply(self, prev, done, reply, read):
+        try:
+            if prev is not None:
+                await prev
+            return await reply()
+        finally:
+            done.set_result(None)
+            async with self._cond:
+                self._inflight -= 1
+                self._reading -= read
+                self._cond.notify_all()
+
+    async def _response(self, what):
+        error, size = parse_response(await self.reader.readexactly(BLOCK_SIZE))
+        if error:
+            raise IOError(f"{what}: device error {error}")
+        return size
+
+    def _flags(self, flags=0, noresp=None):
+        if self.block == SMALL_BLOCK:
+            flags |= FLAG_64BDATA
+        if self.noresp if noresp is None else noresp:
+            flags |= FLAG_NORESP
+        return flags
+
+    def _pad(self, data):
+        blocks = max(1, -(-len(data) // self.block))
+        return bytes(data) + bytes(blocks * self.block - len(data))
+
+    async def _data(self, size, block):
+        data = await self.reader.readexactly(-(-size // block) * block)
+        return data[:size]
+
+    async def _run(self, opcode, space=SPACE_SNES, flags=0, what=None, **fields):
+        async def reply():
+            await self._response(what or f"opcode {opcode}")
+        return await (await self._submit(command(opcode, space, flags, **fields), b"", reply))
+
+    # -- requests --
+
+    async def submit_get(self, space, offset, size, name=None):
+        flags = self._flags(noresp=False if space == SPACE_FILE else None)
+        block = self.block
+
+        async def reply():
+            total = size
+            if not flags & FLAG_NORESP:
+                total = await self._response(f"GET {name or hex(offset)}")
+            return await self._data(total, block)
+        cmd = command(OP_GET, space, flags, size, offset=None if name else offset, name=name)
+        return await self._submit(cmd, b"", reply, read=True)
+
+    async def submit_put(self, space, offset, data, name=None):
+        flags = self._flags()
+
+        async def reply():
+            if not flags & FLAG_NORESP:
+                await self._response(f"PUT {name or hex(offset)}")
+        cmd = command(OP_PUT, space, flags, len(data), offset=None if name else offset, name=name)
+        return await self._submit(cmd, self._pad(data), reply)
+
+    async def submit_vget(self, space, vectors):
+        flags = self._flags()
+        total, block = sum(n for _, n in vectors), self.block
+
+        async def reply():
+            if not flags & FLAG_NORESP:
+                await self._response("VGET")
+            data = await self._data(total, block)
+            out, pos = [], 0
+            for _, n in vectors:
+                out.append(data[pos:pos + n])
+                pos += n
+            return out
+        return await self._submit(command(OP_VGET, space, flags, vectors=vectors), b"", reply, read=True)
+
+    async def submit_vput(self, space, items):
+        flags = self._flags()
+
+        async def reply():
+            if not flags & FLAG_NORESP:
+                await self._response("VPUT")
+        vectors = [(off, len(d)) for off, d in items]
+        data = self._pad(b"".join(d for _, d in items))
+        return await self._submit(command(OP_VPUT, space, flags, vectors=vectors), data, reply)
+
+    async def get(self, offset, size, space=SPACE_SNES):
+        return await (await self.submit_get(space, offset, size))
+
+    async def put(self, offset, data, space=SPACE_SNES):
+        await (await self.submit_put(space, offset, data))
+
+    async def vget(self, vectors, space=SPACE_SNES):
+        return await (await self.submit_vget(space, vectors))
+
+    async def vput(self, items, space=SPACE_SNES):
+        await (await self.submit_vput(space, items))
+
+    async def get_file(self, path):
+        return await (await self.submit_get(SPACE_FILE, 0, 0, name=path))
+
+    async def put_file(self, path, data):
+        await (await self.submit_put(SPACE_FILE, 0, data, name=path))
+
+    async def ls(self, path="/"):
+        async def reply():
+            await self._response(f"LS {path}")
+            data = bytearray()
+            while True:
+                block = await self.reader.readexactly(BLOCK_SIZE)
+                data += block
+                i = 0
+                while i < len(block) and block[i] not in (0xFF, 2):
+                    i = block.index(0, i + 1) + 1
+                if i < len(block) and block[i] == 0xFF:
+                    return parse_ls(bytes(data))
+        return await (await self._submit(command(OP_LS, SPACE_FILE, name=path), b"", reply, read=True))
+
+    async def info(self):
+        async def reply():
+            block = await self.reader.readexactly(BLOCK_SIZE)
+            parse_response(block)
+            return {"fwver": int.from_bytes(block[256:260], "big"),
+                    "version": _cstring(block, 260, 324).decode("latin-1"),
+                    "device": _cstring(block, 324, 388).decode("latin-1"),
+                    "features": int.from_bytes(block[6:10], "little"),
+                    "cfg": int.from_bytes(block[10:12], "little"),
+                    "rom": _cstring(block, 16, 256).decode("latin-1")}
+        return await (await self._submit(command(OP_INFO), b"", reply))
+
+    async def mkdir(self, path):
+        await self._run(OP_MKDIR, SPACE_FILE, what=f"MKDIR {path}", name=path)
+
+    async def rm(self, path):
+        await self._run(OP_RM, SPACE_FILE, what=f"RM {path}", name=path)
+
+    async def mv(self, path, new_name):
+        await self._run(OP_MV, SPACE_FILE, what=f"MV {path}", name=path, arg=new_name.encode("latin-1") + b"\0")
+
+    async def boot(self, path, flags=0):
+        await self._run(OP_BOOT, SPACE_FILE, flags, what=f"BOOT {path}", name=path)
+
+    async def reset(self):
+        await self._run(OP_RESET)
+
+    async def menu_reset(self):
+        await self._run(OP_MENU_RESET)
+
+    # -- coalesced transfers --
+
+    async def read(self, offset, size, space=SPACE_SNES):
+        """Queued read; concurrent reads share VGET commands."""
+        return await self._queue("r", space, offset, size)
+
+    async def write(self, offset, data, space=SPACE_SNES):
+        """Queued write; concurrent writes share VPUT commands."""
+        await self._queue("w", space, offset, bytes(data))
+
+    def _queue(self, kind, space, offset, arg):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((kind, space, offset, arg, future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.ensure_future(self._pump())
+        return future
+
+    async def _pump(self):
+        while self._pending:
+            kind, space = self._pending[0][:2]
+            length = self._pending[0][3] if kind == "r" else len(self._pending[0][3])
+            batch, pieces = [], []
+            if length > VECTORS * VECTOR_MAX:
+                batch.append(self._pending.popleft())
+            else:
+                while self._pending and self._pending[0][:2] == (kind, space):
+                    _, _, offset, arg, future = self._pending[0]
+                    size = arg if kind == "r" else len(arg)
+                    split = [(offset + i, min(VECTOR_MAX, size - i)) for i in range(0, size, VECTOR_MAX)]
+                    if len(pieces) + len(split) > VECTORS:
+                        break
+                    pieces += split
+                    batch.append(self._pending.popleft())
+            try:
+                if not batch:
+                    continue
+                if not pieces and length:
+                    item = batch[0]
+                    if kind == "r":
+                        task = await self.submit_get(space, item[2], length)
+                    else:
+                        task = await self.submit_put(space, item[2], item[3])
+                elif not pieces:
+                    task = asyncio.get_running_loop().create_future()
+                    task.set_result([])
+                elif kind == "r":
+                    task = await self.submit_vget(space, pieces)
+                else:
+                    data, items, pos = b"".join(item[3] for item in batch), [], 0
+                    for off, n in pieces:
+                        items.append((off, data[pos:pos + n]))
+                        pos += n
+                    task = await self.submit_vput(space, items)
+            except Exception as e:
+                for item in batch:
+                    item[4].set_exception(e)
+                continue
+            task.add_done_callback(lambda t, batch=batch, kind=kind: self._deliver(t, batch, kind))
+
+    @staticmethod
+    def _deliver(task, batch, kind):
+        if task.exception():
+            for item in batch:
+                item[4].set_exception(task.exception())
+            return
+        result = task.result()
+        if kind == "w":
+            for item in batch:
+                item[4].set_result(None)
+        elif isinstance(result, list):
+            pos = 0
+            for item in batch:
+                count = -(-item[3] // VECTOR_MAX)
+                item[4].set_result(b"".join(result[pos:pos + count]))
+                pos += count
+        else:
+            batch[0][4].set_result(result)
+
+
+async def bench_case(client, op, size, depth, total, rng):
+    """(requests, bytes/s, latencies in s) for concurrent read()/write() calls of size bytes."""
+    client.depth = depth
+    requests = max(depth, total // size)
+    latencies = []
+    payload = bytes(rng.getrandbits(8) for _ in range(size))
+
+    async def worker(n):
+        for _ in range(n):
+            offset = rng.randrange(0, 0xE00000 - size)
+            t0 = time.perf_counter()
+            if op == "read":
+                data = await client.read(offset, size)
+                if len(data) != size:
+                    raise IOError(f"read {len(data)} of {size} bytes")
+            else:
+                await client.write(offset, payload)
+            latencies.append(time.perf_counter() - t0)
+
+    shares = [requests // depth + (i < requests % depth) for i in range(depth)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in shares))
+    if op == "write" and client.noresp:
+        # NORESP writes complete when sent; a read waits until the device took them all
+        await client.get(0, 1)
+    elapsed = time.perf_counter() - t0
+    return requests, requests * size / elapsed, np.array(latencies)
+
+
+async def bench(target, ops, sizes, blocks, depths, total, rate, latency, noresp=False, seed=1):
+    server = None
+    if target is None:
+        server = await start_server(Device(), "127.0.0.1", 0, rate, latency)
+        target = "127.0.0.1:%d" % server.sockets[0].getsockname()[1]
+        print(f"# simulator: {rate or 'unlimited'} bytes/s, {latency} ms per command")
+    rng = random.Random(seed)
+    print(f"{'op':<6} {'block':>5} {'size':>6} {'depth':>5} {'reqs':>6} {'KB/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    try:
+        for op in ops:
+            for block in blocks:
+                client = await Client.open(target, block=block, noresp=noresp)
+                try:
+                    for size in sizes:
+                        for depth in depths:
+                            n, speed, lat = await bench_case(client, op, size, depth, total, rng)
+                            p50, p99 = np.percentile(lat, (50, 99)) * 1000
+                            print(f"{op:<6} {block:5d} {size:6d} {depth:5d} {n:6d} {speed / 1024:9.1f} "
+                                  f"{p50:8.2f} {p99:8.2f}")
+                finally:
+                    await client.close()
+    finally:
+        if server:
+            server.close()
+            await server.wait_closed()
+
+
+def _int_list(text):
+    return [int(v, 0) for v in text.split(",")]
+
+
+async def _client_command(args):
+    client = await Client.open(args.target)
+    try:
+        space = SPACES[args.space] if hasattr(args, "space") else SPACE_SNES
+        if args.cmd == "info":
+            for key, value in (await client.info()).items():
+                print(f"{key:>9}: {value:#x}" if isinstance(value, int) else f"{key:>9}: {value}")
+        elif args.cmd == "ls":
+            for is_dir, name in await client.ls(args.path):
+                print(f"{'<dir>' if is_dir else '':>5}  {name}")
+        elif args.cmd == "get":
+            if args.size is None:
+                data = await client.get_file(args.where)
+            else:
+                data = await client.get(int(args.where, 16), int(args.size, 0), space)
+            if args.output:
+                with open(args.output, "wb") as f:
+                    f.write(data)
+            else:
+                sys.stdout.buffer.write(data)
+        elif args.cmd == "put":
+            with open(args.file, "rb") as f:
+                data = f.read()
+            if args.where.startswith("/"):
+                await client.put_file(args.where, data)
+            else:
+                await client.put(int(args.where, 16), data, space)
+            print(f"{len(data)} bytes written")
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="USB protocol client, device simulator and benchmark.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("serve", help="run the device simulator")
+    where = p.add_mutually_exclusive_group()
+    where.add_argument("--listen", default=f"127.0.0.1:{DEFAULT_PORT}", help="HOST:PORT to listen on")
+    where.add_argument("--pty", action="store_true", help="serve on a pty instead (its path is printed)")
+    p.add_argument("--root", help="directory for FILE space")
+    p = sub.add_parser("bench", help="throughput and latency sweep")
+    p.add_argument("--target", help="HOST:PORT or serial device (default: an in-process simulator)")
+    p.add_argument("--ops", default="read,write")
+    p.add_argument("--sizes", type=_int_list, default=[16, 64, 255, 2048, 16384], help="bytes per request")
+    p.add_argument("--blocks", type=_int_list, default=[SMALL_BLOCK, BLOCK_SIZE], help="data block sizes (64, 512)")
+    p.add_argument("--depths", type=_int_list, default=[1, 4, 16], help="requests in flight")
+    p.add_argument("--bytes", type=int, default=256 * 1024, help="bytes per case")
+    p.add_argument("--noresp", action="store_true", help="send NORESP commands")
+    for name in ("serve", "bench"):
+        sub.choices[name].add_argument("--rate", type=int, default=DEFAULT_RATE, help="link bytes/s (0: unlimited)")
+        sub.choices[name].add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="ms per command")
+    p = sub.add_parser("info")
+    p.add_argument("target")
+    p = sub.add_parser("ls")
+    p.add_argument("target")
+    p.add_argument("path", nargs="?", default="/")
+    p = sub.add_parser("get")
+    p.add_argument("target")
+    p.add_argument("where", help="offset (hex) or /path")
+    p.add_argument("size", nargs="?", help="bytes to read from offset")
+    p.add_argument("-o", "--output")
+    p = sub.add_parser("put")
+    p.add_argument("target")
+    p.add_argument("where", help="offset (hex) or /path")
+    p.add_argument("file")
+    for name in ("get", "put"):
+        sub.choices[name].add_argument("--space", choices=SPACES, default="snes")
+    args = parser.parse_args()
+
+    if args.cmd == "serve":
+        device = Device(args.root)
+
+        async def run():
+            if args.pty:
+                await serve_pty(device, args.rate, args.latency)
+                return
+            host, _, port = args.listen.rpartition(":")
+            server = await start_server(device, host or "127.0.0.1", int(port), args.rate, args.latency)
+            print("listening on " + ", ".join("%s:%d" % s.getsockname()[:2] for s in server.sockets))
+            async with server:
+                await server.serve_forever()
+        try:
+            asyncio.run(run())
+        except KeyboardInterrupt:
+            pass
+    elif args.cmd == "bench":
+        for size in args.sizes:
+            if size <= 0:
+                parser.error(f"request size {size}")
+        if set(args.blocks) - {SMALL_BLOCK, BLOCK_SIZE}:
+            parser.error("block sizes are 64 or 512")
+        ops = args.ops.split(",")
+        if set(ops) - {"read", "write"}:
+            parser.error("ops are read and write")
+        asyncio.run(bench(args.target, ops, args.sizes, args.blocks, args.depths, args.bytes,
+                          args.rate, args.latency, args.noresp))
+    else:
+        asyncio.run(_client_command(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -78,9 +78,120 @@ class Instruction:
     self.Src = src
     self.Grp = grp
           
+def implicants(on, dc):
+  # Quine-McCluskey prime implicants of an 8-input function.  An implicant is
+  # (value, mask): mask bits are free, value holds the fixed bits.
+  terms = set((m, 0) for m in on | dc)
+  primes = set()
+  while terms:
+    merged = set()
+    used = set()
+    for (v, mask) in terms:
+      for b in xrange(8):
+        bit = 1 << b
+        if (mask | v) & bit: continue
+        if (v | bit, mask) in terms:
+          merged.add((v, mask | bit))
+          used.add((v, mask))
+          used.add((v | bit, mask))
+    primes |= terms - used
+    terms = merged
+  return primes
+
+def covers(term, m):
+  return (m & ~term[1]) == term[0]
+
+def literals(term):
+  return 8 - bin(term[1]).count('1')
+
+def minimise(on, dc):
+  # essential primes first, then greedy on the remaining on-set
+  primes = implicants(on, dc)
+  cover = []
+  left = set(on)
+  for m in on:
+    hits = [p for p in primes if covers(p, m)]
+    if len(hits) == 1 and hits[0] not in cover:
+      cover.append(hits[0])
+  for p in cover:
+    left -= set(m for m in left if covers(p, m))
+  while left:
+    best = max(primes, key=lambda p: (sum(1 for m in left if covers(p, m)), -literals(p)))
+    cover.append(best)
+    left -= set(m for m in left if covers(best, m))
+  return sorted(cover)
+
+def product(term):
+  if term[1] == 0xff: return "1'b1"
+  lits = []
+  for b in xrange(7, -1, -1):
+    if term[1] & (1 << b): continue
+    lits.append(('' if term[0] & (1 << b) else '~') + 'address[' + str(b) + ']')
+  return ' & '.join(lits)
+
+def write_logic(filename, rows, width, unused):
+  # rows[i] is the to_string() of opcode i.  Every output bit is minimised as
+  # its own sum of products; missing rows and unused opcodes are don't-cares.
+  dc = set(i for i in xrange(0x100) if i >= len(rows) or i in unused)
+  covers_by_bit = []
+  for bit in xrange(width):
+    on = set(i for i in xrange(0x100) if i not in dc and rows[i][width-1-bit] == '1')
+    covers_by_bit.append(minimise(on, dc))
+
+  # equivalence check against the table
+  for i in xrange(0x100):
+    if i in dc: continue
+    for bit in xrange(width):
+      val = '1' if any(covers(p, i) for p in covers_by_bit[bit]) else '0'
+      if val != rows[i][width-1-bit]:
+        print 'Mismatch: opcode ' + '{0:02x}'.format(i) + ' bit ' + str(bit)
+        sys.exit(1)
+
+  products = set(p for c in covers_by_bit for p in c)
+  print str(len(products)) + ' products, ' + str(sum(literals(p) for p in products)) + ' literals, ' + str(len(dc)) + ' don\'t-care opcodes'
+
+  if os.path.exists(filename):
+    if os.path.isfile(filename):
+      copyfile(filename, filename+'.bak')
+    else:
+      print filename + ' not a file.'
+      sys.exit()
+
+  with open(filename, 'w') as f:
+    f.write('// Combinational replacement for dec_table generated by decoder.py.\n')
+    f.write('// REGISTERED=1 keeps the block RAM read latency, 0 drops it.\n')
+    f.write('module dec_logic(\n')
+    f.write('  input clock,\n')
+    f.write('  input [7:0] address,\n')
+    f.write('  output [' + str(width-1) + ':0] q\n')
+    f.write(');\n\n')
+    f.write('parameter REGISTERED = 1;\n\n')
+    f.write('reg [' + str(width-1) + ':0] dec;\n\n')
+    f.write('always @* begin\n')
+    for bit in xrange(width-1, -1, -1):
+      if covers_by_bit[bit]:
+        expr = ' | '.join('(' + product(p) + ')' for p in covers_by_bit[bit])
+      else:
+        expr = "1'b0"
+      f.write('  dec[' + str(bit) + '] = ' + expr + ';\n')
+    f.write('end\n\n')
+    f.write('generate\n')
+    f.write('  if (REGISTERED) begin : dec_reg\n')
+    f.write('    reg [' + str(width-1) + ':0] q_r;\n')
+    f.write('    always @(posedge clock) q_r <= dec;\n')
+    f.write('    assign q = q_r;\n')
+    f.write('  end else begin : dec_comb\n')
+    f.write('    assign q = dec;\n')
+    f.write('  end\n')
+    f.write('endgenerate\n\n')
+    f.write('endmodule\n')
+    f.close()
+          
 def main():
   parser = argparse.ArgumentParser(description='Write decoder to file.')
   #parser.add_argument('--output', required=True, help='file to write out')
+  parser.add_argument('--verilog', help='also write a logic-minimised decoder module to this file')
+  parser.add_argument('--unused', default='', help='comma separated hex opcodes to treat as don\'t-cares in the logic decoder')
   args = parser.parse_args()
 
   # generate the instruction tables
@@ -148,6 +259,10 @@ def main():
     f.write('END;\n')
     f.close()
 
+  if args.verilog:
+    unused = set(int(op, 16) for op in args.unused.split(',') if op)
+    write_logic(args.verilog, [inst.to_string() for inst in mxTable], 16, unused)
+
   with open('regs.out', 'w') as f:
     f.write(Instruction.defines())
     f.write('\n')